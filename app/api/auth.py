@@ -1,26 +1,32 @@
 from fastapi import APIRouter, Response, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Optional
+import logging
 
-from ..db import db_get_user
+from ..db_async import db_get_user, db_update_hashpass
 from ..models.user_mod import Token, UserInDB
 from ..models.uni_mod import HTTPError
 from ..utils.auth import OAuth2PasswordBearerWithCookie, RefreshWithCookie
-from ..utils.crypto import verify_password
-from ..utils.jwt import create_access_token, create_refresh_token, decode_subject
+from ..utils.crypto import verify_password_async, get_password_hash_async, needs_rehash
+from ..utils.jwt import create_access_token, create_refresh_token, decode_subject, user_claims
 
 oauth2_scheme_acc = OAuth2PasswordBearerWithCookie(tokenUrl='auth/access', scheme_name='JWT')
 # oauth2_scheme_ref = OAuth2PasswordBearerWithCookie(tokenUrl='auth/refresh', token_type='refresh_token')
 
 router = APIRouter(prefix='/auth')
+logger = logging.getLogger(__name__)
 
 # Helper function
-def authenticate_user(username: str, password: str) -> Optional[UserInDB]:
-    user = db_get_user(username)
+async def authenticate_user(username: str, password: str) -> Optional[UserInDB]:
+    user = await db_get_user(username)
     if user is None:
         return None
-    if not verify_password(password, user.hashpass):
+    if not await verify_password_async(password, user.hashpass):
         return None
+    if needs_rehash(user.hashpass):
+        # the password is known only here, upgrade the hash to the current cost
+        user.hashpass = await get_password_hash_async(password)
+        await db_update_hashpass(user.username, user.hashpass)
     return user
 
 @router.post('/access', tags=['Auth'], responses={
@@ -28,7 +34,7 @@ def authenticate_user(username: str, password: str) -> Optional[UserInDB]:
         200: {'model': Token}
     })
 async def get_tokens(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
-    user: UserInDB = authenticate_user(form_data.username, form_data.password)
+    user: UserInDB = await authenticate_user(form_data.username, form_data.password)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,7 +45,7 @@ async def get_tokens(response: Response, form_data: OAuth2PasswordRequestForm =
             },
             headers={'WWW-Authenticate': 'Bearer'},
         )
-    access_token, exp = create_access_token(user.username)
+    access_token, exp = create_access_token(user.username, claims=user_claims(user))
     response.set_cookie(
         key="access_token",
         value=f"Bearer {access_token}",
@@ -48,7 +54,7 @@ async def get_tokens(response: Response, form_data: OAuth2PasswordRequestForm =
         secure=True,
         expires=exp.strftime("%a, %d %b %Y %H:%M:%S UTC")
     )
-    refresh_token, exp = create_refresh_token(user.username)
+    refresh_token, exp = create_refresh_token(user.username, claims=user_claims(user))
     response.set_cookie(
         key="refresh_token",
         value=f"Bearer {refresh_token}",
@@ -73,16 +79,15 @@ async def refresh_token(response: Response, ref_token: str = Depends(RefreshWith
         detail='Invalid authentication credentials',
         headers={'WWW-Authenticate': 'Bearer'},
     )
-    print('Get ref token: ', ref_token)
     payload = decode_subject(ref_token, refresh=True) # in our case subject is username
     username: str = payload.get('sub')
-    print('got username', username)
+    logger.debug('refresh requested', extra={'fields': {'user': username}})
     if username is None:
         raise credentials_exception
-    user = db_get_user(username)
-    if user is None:
+    user = await db_get_user(username)
+    if user is None or payload.get('ver', 0) != user.token_version:
         raise credentials_exception
-    access_token, _ = create_access_token(user.username)
+    access_token, _ = create_access_token(user.username, claims=user_claims(user))
     response.set_cookie(
         key="access_token",
         value=f"Bearer {access_token}",
@@ -1,84 +1,288 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import List, Optional
+from fastapi import (
+    APIRouter, HTTPException, Depends, Query, UploadFile, BackgroundTasks,
+)
+from fastapi.responses import StreamingResponse
+import logging
+from typing import List, Optional, Tuple
 from uuid import uuid4
 from datetime import datetime
 
-from ..models.link_mod import PutLinkRequest, Link, LinkListParams, LinkInp
+from ..models.link_mod import (
+    PutLinkRequest, Link, LinkListParams, LinkInp, TagPair, TagCount, parse_link_fields,
+)
 from ..models.user_mod import User
 from .users import get_current_user
-from ..db import (
-    db_get_links_by_user, db_put_link,
+from ..utils.export import FORMATS, ExportWriter, export_max_bytes, export_stream
+from ..utils import jobs
+from ..utils.importers import PARSERS, detect_format, iter_file_chunks
+from ..utils.metadata import fetcher, enrich_enabled
+from ..utils.serialize import FastJSONResponse, ndjson_lines
+from ..db_async import (
+    db_get_links_page, db_iter_links_by_user, db_put_link, db_update_link_metadata,
     db_get_link_by_url, db_get_link_by_id,
-    db_put_tag, db_delete_tag,
-    db_get_links_by_tag, db_delete_link
+    db_put_tag, db_put_tags, db_delete_tag,
+    db_get_links_by_tag, db_get_links_by_tags, db_get_tag_catalog, db_delete_link,
+    db_import_links, db_search_links
 )
+from ..repository import get_repository
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def link_fields(fields: Optional[str] = Query(None,
+    description='Comma separated link fields to return, e.g. `url,title`')
+) -> Optional[Tuple[str, ...]]:
+    '''
+    Only the requested attributes are read from DynamoDB and returned
+    '''
+    try:
+        return parse_link_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get('/get_my_links', tags=['Links'])
-async def get_links(query: LinkListParams = Depends(), 
+async def get_links(query: LinkListParams = Depends(),
+    fields: Optional[Tuple[str, ...]] = Depends(link_fields),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    One page of links, newest first. If there are more links the
+    `X-Next-Cursor` header holds the `cursor` for the next page.
+
+    With `stream=true` all links after `cursor` are sent as NDJSON,
+    page by page as DynamoDB returns them.
+    '''
+    if query.cursor:
+        try:
+            get_repository().check_link_cursor(cur_user.username, query.cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if query.stream:
+        pages = db_iter_links_by_user(cur_user.username, query.offset,
+            query.limit, query.cursor, fields, plain=True)
+        return StreamingResponse(_ndjson_links(pages),
+            media_type='application/x-ndjson')
+    linklist, next_cursor = await db_get_links_page(
+        cur_user.username, query.limit, query.offset, query.cursor, fields, plain=True)
+    response = FastJSONResponse(linklist)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@router.get('/export', tags=['Links'])
+async def export_links(
+    file_format: str = Query('ndjson', alias='format', regex='^(ndjson|csv)$'),
+    gzip: bool = False,
+    cursor: Optional[str] = None,
+    max_bytes: Optional[int] = None,
     cur_user: User = Depends(get_current_user)
 ):
-    linklist: List[Link] = db_get_links_by_user(
-        cur_user.username, query.limit, query.offset)
-    return linklist
+    '''
+    Stream all links of the user as NDJSON or CSV, optionally gzipped.
+
+    If the response reaches the size limit, the last line holds
+    `next_cursor`, pass it as `cursor` to get the rest.
+    '''
+    if cursor:
+        try:
+            get_repository().check_link_cursor(cur_user.username, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    writer = ExportWriter(file_format, compress=gzip)
+    pages = db_iter_links_by_user(cur_user.username, cursor=cursor)
+    body = export_stream(pages, writer, export_max_bytes(max_bytes),
+        lambda link: get_repository().link_cursor(cur_user.username, link.created))
+    filename = f'links.{file_format}' + ('.gz' if gzip else '')
+    return StreamingResponse(body,
+        media_type='application/gzip' if gzip else FORMATS[file_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+async def _ndjson_links(pages):
+    async for page in pages:
+        yield ndjson_lines(page)
 
 @router.get('/get_link_by_url', tags=['Links'])
 async def get_link_by_url(
     url: str,
+    fields: Optional[Tuple[str, ...]] = Depends(link_fields),
     cur_user: User = Depends(get_current_user)
 ):
-    link = db_get_link_by_url(username=cur_user.username, url=url)
-    return link
+    link = await db_get_link_by_url(username=cur_user.username, url=url,
+        fields=fields, plain=True)
+    return FastJSONResponse(link)
 
 @router.get('/get_link_by_timestamp', tags=['Links'])
 async def get_link_by_timestamp(
     timestamp: str,
+    fields: Optional[Tuple[str, ...]] = Depends(link_fields),
     cur_user: User = Depends(get_current_user)
 ):
-    link = db_get_link_by_id(username=cur_user.username, id=timestamp)
-    return link
+    link = await db_get_link_by_id(username=cur_user.username, id=timestamp,
+        fields=fields, plain=True)
+    return FastJSONResponse(link)
+
+@jobs.job('enrich_link')
+async def enrich_link(username: str, created: str, url: str, deadline: float = None):
+    # best effort, the link stays as it is if anything fails
+    try:
+        meta = await fetcher.fetch(url)
+        if meta:
+            await db_update_link_metadata(username, created, **meta)
+    except Exception:
+        pass
 
 @router.post('/add_link', tags=['Links'])
-async def add_link(link_inp: LinkInp, cur_user: User = Depends(get_current_user)):
-    l = db_put_link(username=cur_user.username, link_inp=link_inp)
+async def add_link(link_inp: LinkInp, background_tasks: BackgroundTasks,
+    on_duplicate: str = Query('merge', regex='^(merge|reject)$'),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    Add a link. If the user already has a link with the same canonical
+    url, it's returned instead (`merge`) or 409 is returned (`reject`).
+
+    Title, favicon and canonical url of the page are fetched after
+    the response is sent, on Lambda in an invocation of its own.
+    '''
+    try:
+        l = await db_put_link(username=cur_user.username, link_inp=link_inp,
+            on_duplicate=on_duplicate)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if l.icon is None and enrich_enabled():
+        try:
+            await jobs.submit(background_tasks, 'enrich_link',
+                username=cur_user.username, created=l.created, url=l.url)
+        except Exception as e:
+            # the link is added, it just stays without metadata
+            logger.warning('enrich_link not submitted: %s', e)
     return {'Message': l.dict()}
 
+@router.post('/import', tags=['Links'])
+async def import_links(file: UploadFile,
+    file_format: Optional[str] = Query(None, alias='format'),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    Import links from a JSON/NDJSON, CSV or Netscape bookmark HTML file.
+    The format is taken from the file extension unless `format` is set.
+    '''
+    file_format = file_format or detect_format(file.filename)
+    if file_format not in PARSERS:
+        raise HTTPException(status_code=400,
+            detail=f'Unknown file format, use one of: {", ".join(PARSERS)}')
+    records = PARSERS[file_format](iter_file_chunks(file.file))
+    try:
+        report = await db_import_links(cur_user.username, records)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'Message': f'{report["imported"]} links imported', **report}
+
 @router.post('/add_tag', tags=['Tags'])
 async def add_tag(link_timestamp: str, tagname: str,
     cur_user: User = Depends(get_current_user)
 ):
     try:
-        db_put_tag(username=cur_user.username,
+        await db_put_tag(username=cur_user.username,
             link_timestamp=link_timestamp, tagname=tagname)
     except Exception as e:
         return {'Message': 'Cant add a tag', 'details': str(e)}
     return {'Message': 'Tag added'}
 
+@router.post('/add_tags', tags=['Tags'])
+async def add_tags(pairs: List[TagPair],
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    Add many tags to many links in one request
+    '''
+    report = await db_put_tags(cur_user.username,
+        [(p.link_timestamp, p.tagname) for p in pairs])
+    return {'Message': f'{report["added"]} tags added', **report}
+
 @router.delete('/remove_tag', tags=['Tags'])
 async def remove_tag(link_timestamp: str, tagname: str,
     cur_user: User = Depends(get_current_user)
 ):
-    db_delete_tag(cur_user.username,
+    await db_delete_tag(cur_user.username,
         link_timestamp=link_timestamp, tagname=tagname)
 
 @router.get('/get_links_by_tag', tags=['Links'])
 async def get_links_by_tag(tagname: str,
+    fields: Optional[Tuple[str, ...]] = Depends(link_fields),
     cur_user: User = Depends(get_current_user)
 ):
     try:
-        links = db_get_links_by_tag(cur_user.username, tagname)
-        return links
+        links = await db_get_links_by_tag(cur_user.username, tagname, fields,
+            plain=True)
+        return FastJSONResponse(links)
     except:
         pass
     return {'Message': 'something went wrong'}
 
+@router.get('/get_links_by_tags', tags=['Links'])
+async def get_links_by_tags(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[Tuple[str, ...]] = Depends(link_fields),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    One page of links matching a boolean tag expression, newest first,
+    e.g. `python AND performance NOT draft` or `(go OR rust) AND NOT old`.
+    NOT binds tighter than AND, AND tighter than OR, tags next to each
+    other are joined with AND. If there are more links the
+    `X-Next-Cursor` header holds the `cursor` for the next page.
+    '''
+    try:
+        links, next_cursor = await db_get_links_by_tags(
+            cur_user.username, q, limit, cursor, fields, plain=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response = FastJSONResponse(links)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@router.get('/tags', tags=['Links'], response_model=List[TagCount])
+async def get_tags(limit: Optional[int] = Query(None, ge=1),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    Tags of the user with the number of links, most used first
+    '''
+    catalog = await db_get_tag_catalog(cur_user.username)
+    return [TagCount(tag=tag, count=count) for tag, count in catalog.top(limit)]
+
+@router.get('/tags/suggest', tags=['Links'], response_model=List[TagCount])
+async def suggest_tags(prefix: str = '', limit: int = Query(10, ge=1, le=100),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    Tags starting with `prefix`, most used first
+    '''
+    catalog = await db_get_tag_catalog(cur_user.username)
+    return [TagCount(tag=tag, count=count)
+        for tag, count in catalog.suggest(prefix, limit)]
+
+@router.get('/search', tags=['Links'])
+async def search_links(q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    fields: Optional[Tuple[str, ...]] = Depends(link_fields),
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    Full-text search over titles and urls, every word matches as a prefix
+    '''
+    links = await db_search_links(cur_user.username, q, limit, fields, plain=True)
+    return FastJSONResponse(links)
+
 @router.delete('/delete_link', tags=['Links'])
 async def delete_link(link_timestamp: str,
     cur_user: User = Depends(get_current_user)
 ):
     try:
-        db_delete_link(cur_user.username, link_timestamp)
+        await db_delete_link(cur_user.username, link_timestamp)
         return {'Message': 'link deleted'}
     except:
         pass
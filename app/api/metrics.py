@@ -0,0 +1,24 @@
+import os
+import hmac
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from ..utils import metrics
+
+router = APIRouter()
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics(request: Request):
+    '''
+    Metrics in Prometheus text format. Served only when `METRICS_TOKEN`
+    is set, the scraper sends it as `Authorization: Bearer <token>`.
+    '''
+    token = os.environ.get('METRICS_TOKEN')
+    if not token or not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail='Not Found')
+    authorization = request.headers.get('authorization', '')
+    if not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        raise HTTPException(status_code=401, detail='Invalid metrics token')
+    return PlainTextResponse(metrics.render(),
+        media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,30 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import os
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 
 
 from ..models.user_mod import (
-    User, UserInDB, UserReg, TokenData, ConfirmDelete, RegResp,
+    User, UserInDB, UserReg, TokenData, ConfirmDelete, RegResp, DeleteJob,
 )
 from ..models.uni_mod import HTTPError
-from ..utils.crypto import get_password_hash
+from ..utils import jobs
+from ..utils.crypto import get_password_hash_async, filter_keyword
 from ..utils.jwt import decode_subject
-from ..db import db_get_user, db_put_user, db_delete_user
+from ..utils.metrics import set_request_user
+from ..repository import get_repository
+from ..db_async import (
+    db_get_user, db_put_user, db_start_delete_user, db_get_delete_job,
+    db_get_user_cached, db_get_token_version, db_revoke_tokens,
+)
 from .auth import oauth2_scheme_acc as oauth2_scheme
 
 router = APIRouter(prefix='/user')
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
-    credentials_exception = HTTPException(
+# In stateless mode the user is taken from the token claims,
+# only the token version is checked against db (and cached)
+AUTH_STATELESS = os.environ.get('AUTH_STATELESS') == '1'
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Invalid authentication credentials',
         headers={'WWW-Authenticate': 'Bearer'},
     )
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    credentials_exception = _credentials_exception()
     payload = decode_subject(token) # in our case subject is username
     username: str = payload.get('sub')
     if username is None:
         raise credentials_exception
     token_data = TokenData(username=username)
-    user = db_get_user(token_data.username)
-    if user is None:
+    set_request_user(token_data.username)
+    if AUTH_STATELESS:
+        version = await db_get_token_version(token_data.username)
+        if version is None or payload.get('ver', 0) != version:
+            raise credentials_exception
+        return User(username=token_data.username, email=payload.get('email'))
+    user = await db_get_user_cached(token_data.username)
+    if user is None or payload.get('ver', 0) != user.token_version:
         raise credentials_exception
     return User(**user.dict())
 
@@ -33,7 +53,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         200: {'model': RegResp}
     })
 async def register(user_reg: UserReg):
-    user = db_get_user(user_reg.username)
+    user = await db_get_user(user_reg.username)
     if user is not None:
         raise HTTPException(status_code=409, detail={
             'msg': 'Such username is already used',
@@ -41,12 +61,19 @@ async def register(user_reg: UserReg):
             'type': '409 Conflict',
         })
     # not found - continue registration
-    hash_pass = get_password_hash(user_reg.password)
+    hash_pass = await get_password_hash_async(user_reg.password)
     user_in_db = UserInDB(
         username=user_reg.username,
         hashpass=hash_pass,
     )
-    db_put_user(user_in_db)
+    try:
+        await db_put_user(user_in_db)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail={
+            'msg': str(e),
+            'loc': 'username',
+            'type': '409 Conflict',
+        })
     out_user = User(**user_reg.dict())
     return RegResp(
         success=True,
@@ -54,10 +81,68 @@ async def register(user_reg: UserReg):
         user=out_user
     )
 
+@router.post('/revoke_tokens', tags=['Users'])
+async def revoke_tokens(cur_user: User = Depends(get_current_user)):
+    '''
+    Log out everywhere: all tokens issued before are rejected
+    '''
+    await db_revoke_tokens(cur_user.username)
+    return {'Message': 'All tokens are revoked'}
+
+async def get_token_subject(token: str = Depends(oauth2_scheme)) -> str:
+    '''
+    Username of a valid token, the user may be deleted already
+    '''
+    username = decode_subject(token).get('sub')
+    if username is None:
+        raise _credentials_exception()
+    return username
+
+@jobs.job('delete_user')
+def run_delete_job(job_id: str, deadline: float = None):
+    # sync on purpose, BackgroundTasks runs it in a worker thread
+    job = get_repository().run_delete_job(job_id, deadline=deadline)
+    if job is not None and job['status'] == 'pending':
+        return jobs.CONTINUE # stopped at the deadline
+
 @router.delete('/delete_me', tags=['Users'])
-async def delete_my_account(_: ConfirmDelete, cur_user: User = Depends(get_current_user)):
-    db_delete_user(cur_user.username)
-    return {'Message': f'User `{cur_user.username}` was successfully deleted'}
+async def delete_my_account(_: ConfirmDelete, background_tasks: BackgroundTasks,
+    cur_user: User = Depends(get_current_user)
+):
+    '''
+    The account is disabled right away, its data is deleted in background.
+    Follow the progress with `/user/delete_status/{job_id}`.
+    '''
+    job_id = await db_start_delete_user(cur_user.username)
+    await jobs.submit(background_tasks, 'delete_user', job_id=job_id)
+    return {
+        'Message': f'Deletion of user `{cur_user.username}` started',
+        'job_id': job_id,
+    }
+
+@router.get('/delete_status/{job_id}', tags=['Users'], responses={
+    404: {'model': HTTPError},
+    200: {'model': DeleteJob},
+})
+async def delete_status(job_id: str, background_tasks: BackgroundTasks,
+    username: str = Depends(get_token_subject)
+):
+    '''
+    State of the deletion of the caller's account, an interrupted
+    deletion is resumed in background. The token issued before
+    the deletion is accepted.
+    '''
+    job = await db_get_delete_job(job_id)
+    # a job of another user is not found, it's not a hint that it exists
+    if job is None or filter_keyword(job['username']) != filter_keyword(username):
+        raise HTTPException(status_code=404, detail={
+            'msg': 'Deletion job not found',
+            'loc': 'job_id',
+            'type': '404 Not Found',
+        })
+    if job['stale']:
+        await jobs.submit(background_tasks, 'delete_user', job_id=job_id)
+    return DeleteJob(job_id=job_id, **job)
 
 @router.get('/me', tags=['Users'], responses={
     '200': {'model': User},
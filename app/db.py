@@ -1,22 +1,44 @@
 import os
-from typing import Optional, List
+import time
+import logging
+import functools
+import threading
+import contextvars
+from typing import Optional, List, Tuple, Iterator, Iterable, Callable
 from pydantic import parse_obj_as
 from pprint import pprint as pp
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
+from uuid import uuid4
 import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 try:
     import boto3
     from boto3.dynamodb.conditions import Key
     from boto3.dynamodb import conditions
-    from botocore.exceptions import ClientError
+    from botocore.exceptions import ClientError, BotoCoreError
+    from botocore.config import Config
 except:
     pass
 
 from .models.user_mod import UserInDB, User
-from .models.link_mod import Link, LinkListParams, LinkInp, LinkInDB
+from .models.link_mod import Link, LinkListParams, LinkInp, LinkInDB, link_model
 from .utils.crypto import filter_keyword as f_k
+from .utils.pagination import encode_cursor, decode_cursor
+from .utils.text import tokenize, link_terms
+from .utils.tag_query import parse_tag_query
+from .utils.tag_catalog import TagCatalog
+from .utils.urls import canonical_url, url_key
+from .utils.ids import new_link_id, ID_PREFIX_END
+from .utils.serialize import link_adapter
+from .utils.metrics import instrument_client
+from .utils.cache import TTLCache, CacheBackend, LRUCache, VersionedCache
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
 
 """
     HELPERS
@@ -24,51 +46,292 @@ from .utils.crypto import filter_keyword as f_k
 
 def check_resp(func_name, resp):
     if resp['ResponseMetadata']['HTTPStatusCode'] != 200:
-        Exception(f"Can't execute <{func_name}> for some reason, details: {resp}")
+        raise Exception(f"Can't execute <{func_name}> for some reason, details: {resp}")
+
+def _with_context(func):
+    '''
+    `func` for worker threads: it runs with the context variables
+    of the caller, so the calls count for the caller's request
+    '''
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(func, *args)
 
 """
     OPERATIONS WITH TABLE
 """
 
+_table = None
+_table_lock = threading.Lock()
+
+def _get_config():
+    '''
+    Botocore settings for the shared DynamoDB connection pool.
+
+    `DYNAMODB_MAX_POOL_CONNECTIONS` - max number of kept connections (10)
+    `DYNAMODB_TCP_KEEPALIVE` - enable TCP keep-alive, `1` or `0` (1)
+    `DYNAMODB_CONNECT_TIMEOUT` - seconds to establish a connection (2)
+    `DYNAMODB_READ_TIMEOUT` - seconds to wait for a response (5)
+    '''
+    return Config(
+        max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', 10)),
+        tcp_keepalive=os.environ.get('DYNAMODB_TCP_KEEPALIVE', '1') == '1',
+        connect_timeout=float(os.environ.get('DYNAMODB_CONNECT_TIMEOUT', 2)),
+        read_timeout=float(os.environ.get('DYNAMODB_READ_TIMEOUT', 5)),
+    )
+
 def _get_table():
-    table_name = os.environ.get('TABLE_NAME')
-    return boto3.resource('dynamodb').Table(table_name)
+    '''
+    Return the process-wide Table resource, build it on the first call.
+
+    The resource lives in a module global, so it survives warm Lambda
+    invocations and keeps its connection pool between requests.
+    `DYNAMODB_ENDPOINT_URL` overrides the endpoint (DynamoDB-local for example).
+    '''
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                session = boto3.session.Session()
+                resource = session.resource(
+                    'dynamodb',
+                    endpoint_url=os.environ.get('DYNAMODB_ENDPOINT_URL') or None,
+                    config=_get_config(),
+                )
+                instrument_client(resource.meta.client)
+                _table = resource.Table(os.environ.get('TABLE_NAME'))
+    return _table
+
+def warmup_table(connect: bool = True) -> None:
+    '''
+    Build the Table ahead of the first request. With `connect` a GetItem
+    of a key that doesn't exist also resolves credentials and the
+    endpoint and opens a pooled connection.
+    '''
+    table = _get_table()
+    if connect:
+        table.get_item(Key={'PK': 'WARMUP', 'SK': 'WARMUP'})
+
+def reset_table() -> None:
+    '''
+    Drop the cached Table, the next call builds a new one.
+    Useful for tests and after changing the environment.
+    '''
+    global _table
+    with _table_lock:
+        _table = None
+
+"""
+    CACHE
+"""
+
+# Link reads are cached per user and every change of the user's links
+# bumps the user's version, so invalidation is O(1).
+#
+# Off unless `LINK_CACHE_TTL` (seconds) is set. Versions live in the cache
+# backend: with the default in-process LRU other processes (other warm
+# Lambda containers) don't see a bump and serve links up to
+# LINK_CACHE_TTL old. Keep it to a few seconds, or use a backend shared
+# by all processes (`set_link_cache_backend`).
+_link_cache = VersionedCache(
+    LRUCache(max_bytes=int(os.environ.get('LINK_CACHE_BYTES', 32 * 1024 * 1024))),
+    ttl=float(os.environ.get('LINK_CACHE_TTL', 0)),
+)
+
+def set_link_cache_backend(backend: CacheBackend) -> None:
+    '''
+    Use another cache store for link reads, an external one for example
+    '''
+    _link_cache.backend = backend
+
+def link_cache_stats() -> dict:
+    return _link_cache.stats()
+
+def _read_through(func):
+    '''
+    Cache results of a read function, the first argument is the username
+    '''
+    @functools.wraps(func)
+    def wrapper(username: str, *args, **kwargs):
+        if _link_cache.ttl <= 0:
+            return func(username, *args, **kwargs)
+        key = f'{func.__name__}:{args!r}:{sorted(kwargs.items())!r}'
+        return _link_cache.get_or_load(f_k(username), key,
+            lambda: func(username, *args, **kwargs))
+    return wrapper
+
+def _links_changed(username: str) -> None:
+    _link_cache.bump(f_k(username))
 
 """
     LINKS
+
+    A link is the LINK#<created> entity plus the URL#<key> entity,
+    the key is a hash of the canonical url (see utils.urls).
+    The URL# entity holds `created` of the link: it keeps urls unique
+    per user and makes a lookup by url two GetItem calls.
+
+    `created` is the link id made by `utils.ids.new_link_id`: sortable,
+    with microseconds, unique even for links added at the same time.
+    Links added before have ids with seconds precision.
 """
 
-def db_put_link(username: str, link_inp: LinkInp) -> Optional[Link]:
+PUT_LINK_ATTEMPTS = 3
+
+def _url_ref(username: str, url: str, link_timestamp: str) -> dict:
+    return {
+        'PK': f'USER#{f_k(username)}',
+        'SK': f'URL#{url_key(url)}',
+        'created': link_timestamp,
+    }
+
+def db_put_link(username: str, link_inp: LinkInp,
+    on_duplicate: str = 'merge') -> Optional[Link]:
+    '''
+    Add the link unless the user has one with the same canonical url.
+    Then with on_duplicate='merge' the existing link is returned (its
+    title is set if it had none), with 'reject' ValueError is raised.
+    Neither entity is ever overwritten, if the id is taken (it's not
+    expected to happen) the link gets a new one.
+    '''
+    table = _get_table()
+    for _ in range(PUT_LINK_ATTEMPTS):
+        created = new_link_id()
+        link_dict = link_inp.dict()
+        link_dict.update({
+            'PK': f'USER#{f_k(username)}',
+            'SK': f'LINK#{created}',
+            'created': created,
+            'icon': None,
+            'tags': [],
+            'GSI1PK': f'USER#{f_k(username)}',
+            'GSI1SK': f'LINK#{canonical_url(link_inp.url)}',
+        })
+        try:
+            resp = table.meta.client.transact_write_items(TransactItems=[
+                {'Put': {
+                    'TableName': table.name,
+                    'Item': _url_ref(username, link_inp.url, created),
+                    'ConditionExpression': 'attribute_not_exists(SK)',
+                    'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+                }},
+                {'Put': {
+                    'TableName': table.name,
+                    'Item': link_dict,
+                    'ConditionExpression': 'attribute_not_exists(SK)',
+                }},
+            ])
+        except ClientError as err:
+            reasons = err.response.get('CancellationReasons') or [{}, {}]
+            if reasons[0].get('Code') == 'ConditionalCheckFailed':
+                existing = reasons[0]['Item']['created']
+                if isinstance(existing, dict): # not deserialized
+                    existing = existing['S']
+                if on_duplicate == 'reject':
+                    raise ValueError('Link with this url already exists') from err
+                return _db_merge_link(username, existing, link_inp)
+            if reasons[1].get('Code') == 'ConditionalCheckFailed':
+                continue # the id is taken
+            raise err
+        check_resp('db_put_link', resp)
+        _db_index_link(username, created, link_inp.title, link_inp.url)
+        _links_changed(username)
+        return Link(**link_dict)
+    raise ValueError('Another link was added at the same time, try again')
+
+def _db_merge_link(username: str, link_timestamp: str, link_inp: LinkInp) -> Link:
+    '''
+    Give the existing link the new title if it has none
+    '''
+    table = _get_table()
+    if link_inp.title:
+        try:
+            resp = table.update_item(
+                Key={
+                    'PK': f'USER#{f_k(username)}',
+                    'SK': f'LINK#{link_timestamp}',
+                },
+                UpdateExpression='SET title = :title',
+                ConditionExpression='attribute_exists(PK) AND '
+                    '(attribute_not_exists(title) OR attribute_type(title, :null))',
+                ExpressionAttributeValues={':title': link_inp.title, ':null': 'NULL'},
+                ReturnValues='ALL_NEW',
+            )
+            check_resp('_db_merge_link', resp)
+            link = parse_obj_as(Link, resp['Attributes'])
+            _db_index_link(username, link.created, link.title, link.url)
+            _links_changed(username)
+            return link
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+    link = db_get_link_by_id(username, link_timestamp)
+    if link is None:
+        raise ValueError('Link with this url is being deleted, try again')
+    return link
+
+def db_update_link_metadata(username: str, link_timestamp: str,
+    title: Optional[str] = None, icon: Optional[str] = None,
+    canonical: Optional[str] = None) -> Optional[Link]:
+    '''
+    Store fetched page metadata. The title is set only if the link has
+    none, the one given by the user wins. TAG# entities are references,
+    so only the link entity changes. Returns None if the link is gone.
+    '''
     table = _get_table()
-    # timestamp = Decimal(f'{datetime.utcnow().timestamp():.4f}')
-    created = datetime.utcnow().isoformat(timespec='seconds')
-    link_dict = link_inp.dict()
-    link_dict.update({
+    key = {
         'PK': f'USER#{f_k(username)}',
-        'SK': f'LINK#{created}',
-        'created': created,
-        'icon': None,
-        'tags': [],
-        'GSI1PK': f'USER#{f_k(username)}',
-        'GSI1SK': f'LINK#{link_inp.url}',
-    })
-    resp = table.put_item(Item=link_dict)
-    check_resp('db_put_link', resp)
-    return Link(**link_dict)
+        'SK': f'LINK#{link_timestamp}',
+    }
+    values = {':icon': icon, ':canonical': canonical}
+    update = 'SET icon = :icon, canonical = :canonical'
+    condition = 'attribute_exists(PK)'
+    attempts = [(update, condition, values)]
+    if title:
+        attempts.insert(0, (update + ', title = :title', condition +
+            ' AND (attribute_not_exists(title) OR attribute_type(title, :null))',
+            dict(values, **{':title': title, ':null': 'NULL'})))
+    for update, condition, values in attempts:
+        try:
+            resp = table.update_item(Key=key, UpdateExpression=update,
+                ConditionExpression=condition, ExpressionAttributeValues=values,
+                ReturnValues='ALL_NEW')
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+            continue
+        check_resp('db_update_link_metadata', resp)
+        link = parse_obj_as(Link, resp['Attributes'])
+        if ':title' in values:
+            _db_index_link(username, link.created, link.title, link.url)
+        _links_changed(username)
+        return link
+    return None
 
-def db_get_links_by_user(username: str,
-    limit: int = None, offset: str = "") -> Optional[Link]:
-    """
-    Get links sorted by creation date in reverse order
-    You can specify desired number of items and the offset
-    datetime from which we should pick items
-    By default the function pick all items from the last one
+def _projection(fields: Optional[Tuple[str, ...]]) -> dict:
+    '''
+    ProjectionExpression for `fields` of links, nothing for all fields
+    '''
+    if fields is None:
+        return {}
+    return {
+        'ProjectionExpression': ', '.join(f'#p{i}' for i in range(len(fields))),
+        'ExpressionAttributeNames': {f'#p{i}': name for i, name in enumerate(fields)},
+    }
 
-    `offset` - utc datetime in ISO format with seconds precision.
-    `2023-01-13T10:32:24` for example
-    `limit` - max number of items to get
-    """
-    SK_end = f'LINK#{offset}'
+def _links_from_items(items: List[dict], fields: Tuple[str, ...] = None,
+    plain: bool = False) -> list:
+    '''
+    Link models of the items, or with `plain` response-ready dicts
+    made without validation (items of our own table are trusted)
+    '''
+    if plain:
+        adapt = link_adapter(fields)
+        return [adapt(item) for item in items]
+    return parse_obj_as(List[link_model(fields)], items)
+
+def _links_by_user_query(username: str, offset: str = "") -> dict:
+    # ids starting with the offset are included: links of the offset second
+    SK_end = f'LINK#{offset}{ID_PREFIX_END}'
     if not offset:
         SK_end = 'LINL#'
     kwargs = dict()
@@ -80,154 +343,366 @@ def db_get_links_by_user(username: str,
         ':SK_start': f'LINK#',
         ':SK_end': SK_end,
     }
-    if limit:
-        kwargs['Limit'] = limit
+    return kwargs
+
+def decode_user_cursor(username: str, cursor: str) -> dict:
+    '''
+    Decode a cursor and make sure it points into the user's partition
+    '''
+    key = decode_cursor(cursor)
+    if key.get('PK') != f'USER#{f_k(username)}':
+        raise ValueError('Invalid cursor')
+    return key
+
+def link_cursor(username: str, link_timestamp: str) -> str:
+    '''
+    Cursor which continues the listing right after the link
+    '''
+    return encode_cursor({
+        'PK': f'USER#{f_k(username)}',
+        'SK': f'LINK#{link_timestamp}',
+    })
+
+@_read_through
+def db_get_links_page(username: str, limit: int = None, offset: str = "",
+    cursor: str = None, fields: Tuple[str, ...] = None,
+    plain: bool = False) -> Tuple[List[Link], Optional[str]]:
+    '''
+    Get one page of links sorted by creation date in reverse order
+
+    `limit` - page size, capped by `MAX_PAGE_SIZE`
+    `offset` - same as in `db_get_links_by_user`
+    `cursor` - continuation token returned with the previous page
+    `fields` - only these attributes are read (see `parse_link_fields`)
+    `plain` - return dicts ready for the response instead of models
+
+    Returns links and the cursor for the next page (None on the last page)
+    '''
+    kwargs = _links_by_user_query(username, offset)
+    kwargs['Limit'] = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    kwargs.update(_projection(fields))
+    if cursor:
+        kwargs['ExclusiveStartKey'] = decode_user_cursor(username, cursor)
     table = _get_table()
     resp = table.query(**kwargs)
-    check_resp('db_get_links_by_user', resp)
-    items = resp['Items']
-    return parse_obj_as(List[Link], items)
+    check_resp('db_get_links_page', resp)
+    next_key = resp.get('LastEvaluatedKey')
+    next_cursor = encode_cursor(next_key) if next_key else None
+    return _links_from_items(resp['Items'], fields, plain), next_cursor
 
-def db_get_link_by_url(username: str, url: str):
+def db_iter_links_by_user(username: str, offset: str = "", page_size: int = None,
+    cursor: str = None, fields: Tuple[str, ...] = None,
+    plain: bool = False) -> Iterator[List[Link]]:
+    '''
+    Yield pages of links as DynamoDB returns them, newest first
+    '''
+    while True:
+        links, cursor = db_get_links_page(username, page_size, offset, cursor,
+            fields, plain)
+        if links:
+            yield links
+        if cursor is None:
+            return
+
+@_read_through
+def db_get_links_by_user(username: str, limit: int = None, offset: str = "",
+    fields: Tuple[str, ...] = None) -> List[Link]:
+    """
+    Get links sorted by creation date in reverse order
+    You can specify desired number of items and the offset
+    datetime from which we should pick items
+    By default the function pick all items from the last one
+
+    `offset` - utc datetime in ISO format, `2023-01-13T10:32:24` for
+    example, or a link id: links created at or before it are returned
+    `limit` - max number of items to get
+    """
+    links = []
+    for page in db_iter_links_by_user(username, offset, fields=fields):
+        links.extend(page)
+        if limit and len(links) >= limit:
+            return links[:limit]
+    return links
+
+@_read_through
+def db_get_link_by_url(username: str, url: str,
+    fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+    '''
+    The link with the same canonical url, as a list of zero or one link
+    '''
     table = _get_table()
-    resp = table.query(
-        IndexName='GSI1-index',
-        KeyConditionExpression='GSI1PK = :PK_val AND begins_with (GSI1SK, :SK_begins)',
-        ExpressionAttributeValues={
-            ':PK_val': f'USER#{f_k(username)}',
-            ':SK_begins': f'LINK#{url}'
-        }
+    resp = table.get_item(
+        Key={
+            'PK': f'USER#{f_k(username)}',
+            'SK': f'URL#{url_key(url)}',
+        },
+        ProjectionExpression='created',
     )
     check_resp('db_get_link_by_url', resp)
-    items = resp['Items']
-    return parse_obj_as(List[Link], items)
+    if 'Item' not in resp:
+        return []
+    link = db_get_link_by_id(username, resp['Item']['created'], fields, plain)
+    return [link] if link else []
 
-def db_get_link_by_id(username: str, id: str):
+def db_get_link_by_id(username: str, id: str, fields: Tuple[str, ...] = None,
+    plain: bool = False):
     '''
-    `id` - timestamp in ISO format with seconds precision.
-
-    `2023-01-13T10:32:24` for example
+    `id` - `created` of the link, `2026-10-18T18:21:21.123456-00A7XK3QMZ`
+    for example, or `2023-01-13T10:32:24` for links added before ids
+    had microseconds
     '''
     table = _get_table()
     resp = table.get_item(Key={
         'PK': f'USER#{f_k(username)}',
         'SK': f'LINK#{id}',
-    })
+    }, **_projection(fields))
     check_resp('db_get_link_by_id', resp)
     item = resp.get('Item')
     if item is None:
         return None
-    return parse_obj_as(Link, item)
+    return _links_from_items([item], fields, plain)[0]
 
 '''
     TAGS
+
+    A tag lives in the `tags` list of the LINK#<created> entity
+    and in a TAG#<tag>#<created> entity. The TAG# entity holds only
+    `created` - the reference to the link, so tag writes don't depend
+    on the number of tags the link already has.
 '''
 
-def _db_add_tag_to_link(username: str, link_timestamp: str, tagname: str):
-    table = _get_table()
-    try:
-        table.update_item(
-            Key={
-                'PK': f'USER#{f_k(username)}',
-                'SK': f'LINK#{link_timestamp}',
-            },
-            UpdateExpression="SET #t = list_append(#t, :tag)",
-            ExpressionAttributeNames={
-                '#t': 'tags',
-            },
-            ExpressionAttributeValues={
-                ':tag': [tagname],
-                ':tagval': tagname,
-            },
-            ConditionExpression='not(contains(tags, :tagval))',
-        )
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
-            # raise ValueError(f'The tag {tagname} already exists') from err
-            return {'Message': f'The tag {tagname} already exists'}
-        else:
-            raise err
-    return None
+TRANSACT_MAX_ITEMS = 100 # DynamoDB limit of items per TransactWriteItems
+BATCH_GET_MAX_KEYS = 100 # DynamoDB limit of keys per BatchGetItem
+BATCH_GET_MAX_RETRIES = 8
 
-def db_delete_tag(username: str, link_timestamp: str, tagname: str):
+def _tag_ref(username: str, tagname: str, link_timestamp: str) -> dict:
+    return {
+        'PK': f'USER#{f_k(username)}',
+        'SK': f'TAG#{tagname}#{link_timestamp}',
+        'created': link_timestamp,
+    }
+
+def _db_add_tags_to_link(username: str, link_timestamp: str,
+    new_tags: List[str], calls: Counter = None) -> None:
+    '''
+    Add `new_tags` to the link entity and create their TAG# entities.
+
+    It's one TransactWriteItems unless there are more new tags than
+    the transaction limit allows, then the rest of TAG# entities is
+    put by next transactions. The link entity and the tag catalog
+    counters are always in the first one.
+    '''
+    calls = Counter() if calls is None else calls
     table = _get_table()
-    # firstly get tags to find id (because it's only possible to delete by id)
-    resp = table.get_item(
-        Key={
+    values = {':new': new_tags}
+    values.update({f':t{i}': tag for i, tag in enumerate(new_tags)})
+    items = [{'Update': {
+        'TableName': table.name,
+        'Key': {
             'PK': f'USER#{f_k(username)}',
             'SK': f'LINK#{link_timestamp}',
         },
-        AttributesToGet=['tags'],
-    )
-    check_resp('_db_delete_tag_from_link(part1)', resp)
-    tags: list = resp['Item']['tags']
-    try:
-        index = tags.index(tagname)
-    except ValueError:
-        return None # no need to delete
-    # let's delete tag by id from link entity
-    try:
-        table.update_item(
-            Key={
-                'PK': f'USER#{f_k(username)}',
-                'SK': f'LINK#{link_timestamp}',
-            },
-            UpdateExpression=f"REMOVE #t[{index}]",
-            ExpressionAttributeNames={
-                '#t': 'tags',
-            },
-            ConditionExpression=conditions.Attr("PK").exists(),
-        )
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
-            raise ValueError(f'The tag {tagname} already exists') from err
-        else:
+        'UpdateExpression': 'SET #t = list_append(#t, :new)',
+        'ExpressionAttributeNames': {'#t': 'tags'},
+        'ExpressionAttributeValues': values,
+        'ConditionExpression': 'attribute_exists(PK) AND ' + ' AND '.join(
+            f'NOT contains(#t, :t{i})' for i in range(len(new_tags))),
+        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+    }}, {'Update': _tag_catalog_update(username, {tag: 1 for tag in new_tags})}]
+    for tagname in new_tags:
+        items.append({'Put': {
+            'TableName': table.name,
+            'Item': _tag_ref(username, tagname, link_timestamp),
+        }})
+    for i in range(0, len(items), TRANSACT_MAX_ITEMS):
+        try:
+            calls['TransactWriteItems'] += 1
+            resp = table.meta.client.transact_write_items(
+                TransactItems=items[i:i + TRANSACT_MAX_ITEMS])
+        except ClientError as err:
+            reasons = err.response.get('CancellationReasons') or [{}]
+            if reasons[0].get('Code') == 'ConditionalCheckFailed':
+                if 'Item' not in reasons[0]:
+                    raise ValueError('Link with this timestamp does not exist') from err
+                raise ValueError(f'A tag already exists ({len(new_tags)} tags, '
+                    f'transaction {i // TRANSACT_MAX_ITEMS + 1})') from err
             raise err
-    
-    # let's delete tag by id from all tags entities
-    for tag in tags:
-        if tag == tagname: # skip if its tag we want to delete
+        check_resp('_db_add_tags_to_link', resp)
+        _links_changed(username)
+
+def _db_get_links_by_ids(username: str, ids: List[str], calls: Counter = None,
+    fields: Tuple[str, ...] = None, plain: bool = False) -> dict:
+    '''
+    Get links by timestamps with BatchGetItem, returns {timestamp: Link}.
+    Unprocessed keys are requested again with exponential backoff.
+    '''
+    calls = Counter() if calls is None else calls
+    table = _get_table()
+    links = {}
+    ids = list(dict.fromkeys(ids))
+    for i in range(0, len(ids), BATCH_GET_MAX_KEYS):
+        request = {table.name: {'Keys': [{
+            'PK': f'USER#{f_k(username)}',
+            'SK': f'LINK#{id}',
+        } for id in ids[i:i + BATCH_GET_MAX_KEYS]], **_projection(fields)}}
+        attempt = 0
+        while request:
+            if attempt > BATCH_GET_MAX_RETRIES:
+                raise Exception("Can't execute <_db_get_links_by_ids>, "
+                    "keys are still unprocessed")
+            if attempt:
+                time.sleep(min(0.05 * 2 ** attempt, 2))
+            calls['BatchGetItem'] += 1
+            resp = table.meta.client.batch_get_item(RequestItems=request)
+            check_resp('_db_get_links_by_ids', resp)
+            items = resp['Responses'].get(table.name, [])
+            links.update(zip((item['created'] for item in items),
+                _links_from_items(items, fields, plain)))
+            request = resp.get('UnprocessedKeys')
+            attempt += 1
+    return links
+
+def db_put_tag(username: str, link_timestamp: str, tagname: str):
+    _db_add_tags_to_link(username, link_timestamp, [tagname])
+    return None
+
+def db_put_tags(username: str, pairs: List[Tuple[str, str]]) -> dict:
+    '''
+    Add many tags at once, `pairs` is a list of (link_timestamp, tagname).
+
+    Links are fetched with BatchGetItem and every link gets all
+    its new tags in one transaction. Returns a report with
+    DynamoDB call counts per operation.
+    '''
+    calls = Counter()
+    new_tags = {}
+    for link_timestamp, tagname in pairs:
+        tags = new_tags.setdefault(link_timestamp, [])
+        if tagname not in tags:
+            tags.append(tagname)
+    links = _db_get_links_by_ids(username, list(new_tags), calls)
+    added, skipped = 0, []
+    for link_timestamp, tags in new_tags.items():
+        link = links.get(link_timestamp)
+        if link is None:
+            skipped.extend({'link_timestamp': link_timestamp, 'tagname': tag,
+                'reason': 'link does not exist'} for tag in tags)
+            continue
+        fresh = [tag for tag in tags if tag not in link.tags]
+        skipped.extend({'link_timestamp': link_timestamp, 'tagname': tag,
+            'reason': 'tag already exists'} for tag in tags if tag in link.tags)
+        if not fresh:
             continue
         try:
-            table.update_item(
-                Key={
-                    'PK': f'USER#{f_k(username)}',
-                    'SK': f'TAG#{tag}#{link_timestamp}',
-                },
-                UpdateExpression=f"REMOVE #t[{index}]",
-                ExpressionAttributeNames={
-                    '#t': 'tags',
-                },
-                ConditionExpression=conditions.Attr("PK").exists(),
-            )
-        except ClientError as err:
-            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                raise ValueError(f'The tag {tagname} already exists') from err
-            else:
-                raise err
-    # lets delete a tag entity now
-    table.delete_item(Key={
+            _db_add_tags_to_link(username, link_timestamp, fresh, calls)
+        except ValueError as e:
+            skipped.extend({'link_timestamp': link_timestamp, 'tagname': tag,
+                'reason': str(e)} for tag in fresh)
+            continue
+        added += len(fresh)
+    return {'added': added, 'skipped': skipped, 'calls': dict(calls)}
+
+def db_delete_tag(username: str, link_timestamp: str, tagname: str):
+    table = _get_table()
+    key = {
         'PK': f'USER#{f_k(username)}',
-        'SK': f'TAG#{tagname}#{link_timestamp}',
-    })
+        'SK': f'LINK#{link_timestamp}',
+    }
+    for _ in range(3):
+        # firstly get tags to find id (because it's only possible to delete by id)
+        resp = table.get_item(Key=key, ProjectionExpression='#t',
+            ExpressionAttributeNames={'#t': 'tags'})
+        check_resp('db_delete_tag', resp)
+        if 'Item' not in resp:
+            raise ValueError('Link with this timestamp does not exist')
+        tags: list = resp['Item']['tags']
+        try:
+            index = tags.index(tagname)
+        except ValueError:
+            return None # no need to delete
+        # delete tag by id if it's still there and the TAG# entity
+        try:
+            resp = table.meta.client.transact_write_items(TransactItems=[
+                {'Update': {
+                    'TableName': table.name,
+                    'Key': key,
+                    'UpdateExpression': f'REMOVE #t[{index}]',
+                    'ExpressionAttributeNames': {'#t': 'tags'},
+                    'ExpressionAttributeValues': {':tag': tagname},
+                    'ConditionExpression': f'#t[{index}] = :tag',
+                }},
+                {'Delete': {
+                    'TableName': table.name,
+                    'Key': {
+                        'PK': f'USER#{f_k(username)}',
+                        'SK': f'TAG#{tagname}#{link_timestamp}',
+                    },
+                }},
+                {'Update': _tag_catalog_update(username, {tagname: -1})},
+            ])
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'TransactionCanceledException':
+                continue # tags were changed meanwhile, try again
+            raise err
+        check_resp('db_delete_tag', resp)
+        _links_changed(username)
+        return None
+    raise ValueError(f'The tag {tagname} is being changed concurrently, try again')
 
 def db_delete_link(username: str, link_timestamp: str):
     table = _get_table()
-    # find the link by link_timestamp
-    resp = table.get_item(
-        Key={
-            'PK': f'USER#{f_k(username)}',
-            'SK': f'LINK#{link_timestamp}',
-        },
-        AttributesToGet=['tags'],
-    )
-    check_resp('db_delete_link', resp)
-    tags: list = resp['Item']['tags']
-    # delete link
-    table.delete_item(Key={
+    key = {
         'PK': f'USER#{f_k(username)}',
-        'SK': f'LINK#{link_timestamp}', 
-    })
+        'SK': f'LINK#{link_timestamp}',
+    }
+    own_url_ref = True
+    for _ in range(3):
+        # find the link by link_timestamp
+        resp = table.get_item(Key=key,
+            ProjectionExpression='tags, title, #u',
+            ExpressionAttributeNames={'#u': 'url'},
+        )
+        check_resp('db_delete_link', resp)
+        if 'Item' not in resp:
+            raise ValueError('Link with this timestamp does not exist')
+        item = resp['Item']
+        tags: list = item['tags']
+        # delete link if its tags are still the same and decrement their counters
+        items = [{'Delete': {
+            'TableName': table.name,
+            'Key': key,
+            'ConditionExpression': '#t = :tags',
+            'ExpressionAttributeNames': {'#t': 'tags'},
+            'ExpressionAttributeValues': {':tags': tags},
+        }}]
+        if own_url_ref:
+            # links stored before urls were unique may share the URL# entity
+            items.append({'Delete': {
+                'TableName': table.name,
+                'Key': {
+                    'PK': f'USER#{f_k(username)}',
+                    'SK': f'URL#{url_key(item["url"])}',
+                },
+                'ConditionExpression': 'attribute_not_exists(SK) OR created = :c',
+                'ExpressionAttributeValues': {':c': link_timestamp},
+            }})
+        if tags:
+            items.append({'Update': _tag_catalog_update(username,
+                {tag: -1 for tag in tags})})
+        try:
+            resp = table.meta.client.transact_write_items(TransactItems=items)
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'TransactionCanceledException':
+                reasons = err.response.get('CancellationReasons') or []
+                if own_url_ref and len(reasons) > 1 and\
+                    reasons[1].get('Code') == 'ConditionalCheckFailed':
+                    own_url_ref = False # the URL# entity is another link's
+                continue # tags were changed meanwhile, try again
+            raise err
+        check_resp('db_delete_link', resp)
+        break
+    else:
+        raise ValueError('The link is being changed concurrently, try again')
     # delete tag entities
     with table.batch_writer() as batch:
         for tag in tags:
@@ -235,98 +710,715 @@ def db_delete_link(username: str, link_timestamp: str):
                 "PK": f'USER#{f_k(username)}',
                 "SK": f'TAG#{tag}#{link_timestamp}'
             })
+        for index_item in _search_index_items(username, link_timestamp,
+                item.get('title'), item['url']):
+            batch.delete_item(Key={
+                'PK': index_item['PK'],
+                'SK': index_item['SK'],
+            })
+    _links_changed(username)
 
-def _db_add_tag_to_tags(username: str, tagname: str, link: Link):
+@_read_through
+def db_get_links_by_tag(username: str, tagname: str,
+    fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
     '''
-    link doesn't contain a new tag <tagname> yet
+    Links with the tag sorted by creation date.
+    TAG# references are queried first, then links are read by BatchGetItem.
     '''
-    # У линка уже есть какие-то теги, например ['a', 'b', 'c']
-    # Значит существуют объекты, содержащие копию данного линка
-    # С ключами:
-    #   PK=USER#<username> SK=TAG#<a>#<link.created> 
-    #   PK=USER#<username> SK=TAG#<b>#<link.created> 
-    #   PK=USER#<username> SK=TAG#<c>#<link.created>
-    # Им то и нужно добавить новый тег <tagname>
     table = _get_table()
-    # print('link:', link)
-    for tag in link.tags:
-        try:
-            table.update_item(
-                Key={
-                    'PK': f'USER#{f_k(username)}',
-                    'SK': f'TAG#{tag}#{link.created}',
-                },
-                UpdateExpression="SET #t = list_append(#t, :l_tag)",
-                ExpressionAttributeNames={
-                    '#t': 'tags',
-                },
-                ExpressionAttributeValues={
-                    ':tag': tagname,
-                    ':l_tag': [tagname],
-                },
-                ConditionExpression='not(contains(tags, :tag))',
-            )
-        except ClientError as err:
-            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                raise ValueError(f'The tag {tagname} already exists in tag entity') from err
-            else:
-                raise err
+    kwargs = dict(
+        KeyConditionExpression='PK = :PK_val AND begins_with (SK, :SK_begins)',
+        ExpressionAttributeValues={
+            ':PK_val': f'USER#{f_k(username)}',
+            ':SK_begins': f'TAG#{tagname}#'
+        },
+        ProjectionExpression='created',
+    )
+    ids = []
+    while True:
+        resp = table.query(**kwargs)
+        check_resp('db_get_link_by_tag', resp)
+        ids.extend(item['created'] for item in resp['Items'])
+        if 'LastEvaluatedKey' not in resp:
+            break
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+    links = _db_get_links_by_ids(username, ids, fields=fields, plain=plain)
+    return [links[id] for id in ids if id in links]
 
-def _db_create_tag_entity(username: str, tagname: str, link: Link):
+"""
+    TAG CATALOG
+
+    One TAGS item per user holding a counter attribute `T#<tag>` for
+    every tag. Counters change in the same transaction as the link's
+    tags, so listing all tags is a single GetItem. Zero counters are
+    hidden and removed lazily. The item limit of 400KB fits ~10k tags.
+"""
+
+TAG_CATALOG_SK = 'TAGS'
+
+def _tag_catalog_key(username: str) -> dict:
+    return {'PK': f'USER#{f_k(username)}', 'SK': TAG_CATALOG_SK}
+
+def _tag_catalog_update(username: str, deltas: dict) -> dict:
+    '''
+    Update (in transaction format) adding `deltas` {tag: n} to the counters
     '''
-    `link` entity contains old tags, so we should add a new one <tagname>
+    deltas = {tag: n for tag, n in deltas.items() if n}
+    return {
+        'TableName': _get_table().name,
+        'Key': _tag_catalog_key(username),
+        'UpdateExpression': 'ADD ' + ', '.join(
+            f'#c{i} :c{i}' for i in range(len(deltas))),
+        'ExpressionAttributeNames': {
+            f'#c{i}': f'T#{tag}' for i, tag in enumerate(deltas)},
+        'ExpressionAttributeValues': {
+            f':c{i}': n for i, n in enumerate(deltas.values())},
+    }
+
+def _db_update_tag_catalog(username: str, deltas: dict) -> None:
+    if not any(deltas.values()):
+        return None
+    resp = _get_table().meta.client.update_item(
+        **_tag_catalog_update(username, deltas))
+    check_resp('_db_update_tag_catalog', resp)
 
-    TAG# entity should be able to provide the following queries:
-    - Find all links for specific tags
-    - Find all tags for specific link
+@_read_through
+def db_get_tag_catalog(username: str) -> TagCatalog:
+    '''
+    All tags of the user with link counts, one GetItem.
     '''
-    link.tags.append(tagname) # add a new tag
     table = _get_table()
-    link_dict = link.dict()
-    link_dict.update({
-        'PK': f'USER#{f_k(username)}',
-        'SK': f'TAG#{tagname}#{link.created}',
-        # 'GSI1PK': f'LINK#{link.created}#{tagname}',
-        # 'GSI1SK': f'LINK#{link.created}#{tagname}', # For reverse query
-    })
-    resp = table.put_item(Item=link_dict)
-    check_resp('_db_create_tag_entity', resp)
-    return None
+    # strongly consistent, or a stale catalog could be cached for a new version
+    resp = table.get_item(Key=_tag_catalog_key(username), ConsistentRead=True)
+    check_resp('db_get_tag_catalog', resp)
+    item = resp.get('Item', {})
+    counts = {name[len('T#'):]: int(n) for name, n in item.items()
+        if name.startswith('T#')}
+    empty = [tag for tag, n in counts.items() if n <= 0]
+    if empty:
+        _db_prune_tag_catalog(username, empty[:TRANSACT_MAX_ITEMS])
+    return TagCatalog(counts)
 
-def db_put_tag(username: str, link_timestamp: str, tagname: str):
-    # find existing link firstly
-    link = db_get_link_by_id(username, link_timestamp)
-    if not link:
-        raise ValueError('Link with this timestamp does not exist')
-    # put tag to link entity
-    _db_add_tag_to_link(username, link_timestamp, tagname)
-    # put tag to TAG entities
-    _db_add_tag_to_tags(username, tagname, link)
-    # create tag entity
-    _db_create_tag_entity(username, tagname, link)
-    return None
+def _db_prune_tag_catalog(username: str, tags: List[str]) -> None:
+    '''
+    Remove zero counters unless they were incremented meanwhile
+    '''
+    names = {f'#c{i}': f'T#{tag}' for i, tag in enumerate(tags)}
+    try:
+        _get_table().update_item(
+            Key=_tag_catalog_key(username),
+            UpdateExpression='REMOVE ' + ', '.join(names),
+            ConditionExpression=' AND '.join(f'{name} <= :zero' for name in names),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={':zero': 0},
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise err
+
+"""
+    TAG QUERIES
+
+    Boolean tag expressions are evaluated over TAG#<tag># ranges, which
+    are sorted by created timestamp. Every range is a stream of `created`
+    values read newest first, and streams are combined by sorted merge:
+    intersection, union and difference never hold whole sets in memory.
+    A stream that is far behind the others seeks: it queries again from
+    the target instead of paging through the refs in between, so a rare
+    tag ANDed with a common one reads few refs of the common one.
+"""
+
+TAG_QUERY_PAGE_SIZE = 1000 # max refs per Query, first pages are smaller
+TAG_QUERY_SEEK_SIZE = 8 # min refs per Query after a long seek
+
+def _first_at_most(values: List[str], target: str, lo: int) -> int:
+    # index of the first value <= target in a descending list
+    hi = len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[mid] > target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+class _RangeStream:
+    '''
+    `created` of SK=<prefix><created> items, newest first, starting
+    at `upper`. The first page is queried on `pool` right away.
+    '''
+    def __init__(self, username: str, prefix: str, page_size: int,
+        upper: Optional[str] = None, pool: ThreadPoolExecutor = None):
+        self.pk = f'USER#{f_k(username)}'
+        self.prefix = prefix
+        self.page_size = min(page_size, TAG_QUERY_PAGE_SIZE)
+        self.upper = upper
+        self.values, self.pos, self.last_key = [], 0, None
+        self.pending = pool.submit(_with_context(self._query)) if pool else None
+        if not pool:
+            self._load(self._query())
+
+    def _query(self, start_key: dict = None) -> dict:
+        values = {':PK_val': self.pk, ':SK_lo': self.prefix}
+        if self.upper is None:
+            condition = 'PK = :PK_val AND begins_with (SK, :SK_lo)'
+        else:
+            condition = 'PK = :PK_val AND SK BETWEEN :SK_lo AND :SK_hi'
+            values[':SK_hi'] = self.prefix + self.upper
+        kwargs = dict(
+            KeyConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ProjectionExpression='created',
+            ScanIndexForward=False,
+            Limit=self.page_size,
+        )
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        resp = _get_table().query(**kwargs)
+        check_resp('_RangeStream', resp)
+        self.page_size = min(self.page_size * 2, TAG_QUERY_PAGE_SIZE)
+        return resp
+
+    def _load(self, resp: dict):
+        self.values = [item['created'] for item in resp['Items']]
+        self.pos = 0
+        self.last_key = resp.get('LastEvaluatedKey')
+
+    def _resolve(self):
+        if self.pending:
+            self._load(self.pending.result())
+            self.pending = None
+
+    def head(self) -> Optional[str]:
+        self._resolve()
+        while self.pos >= len(self.values):
+            if not self.last_key:
+                return None
+            self._load(self._query(self.last_key))
+        return self.values[self.pos]
+
+    def advance(self):
+        self.pos += 1
+
+    def seek(self, target: str):
+        '''
+        Skip values newer than `target`
+        '''
+        self._resolve()
+        if self.pos < len(self.values) and self.values[-1] <= target:
+            self.pos = _first_at_most(self.values, target, self.pos)
+        elif not self.last_key:
+            self.pos = len(self.values)
+        else:
+            if len(self.values) - self.pos > len(self.values) // 2:
+                # most of the page is skipped, the stream is sparse here
+                self.page_size = max(self.page_size // 4, TAG_QUERY_SEEK_SIZE)
+            self.upper = target
+            self._load(self._query())
+
+class _AllStream:
+    '''
+    Intersection of the streams (leapfrog join)
+    '''
+    def __init__(self, streams: list):
+        self.streams = streams
+
+    def head(self) -> Optional[str]:
+        target = self.streams[0].head()
+        while target is not None:
+            for stream in self.streams:
+                stream.seek(target)
+                value = stream.head()
+                if value != target:
+                    target = value
+                    break
+            else:
+                return target
+        return None
+
+    def advance(self):
+        for stream in self.streams:
+            stream.advance()
+
+    def seek(self, target: str):
+        for stream in self.streams:
+            stream.seek(target)
+
+class _AnyStream:
+    '''
+    Union of the streams
+    '''
+    def __init__(self, streams: list):
+        self.streams = streams
+
+    def head(self) -> Optional[str]:
+        return max((v for v in (s.head() for s in self.streams) if v is not None),
+            default=None)
+
+    def advance(self):
+        value = self.head()
+        for stream in self.streams:
+            if stream.head() == value:
+                stream.advance()
+
+    def seek(self, target: str):
+        for stream in self.streams:
+            stream.seek(target)
+
+class _ExceptStream:
+    '''
+    Values of `base` that none of the `excluded` streams have
+    '''
+    def __init__(self, base, excluded: list):
+        self.base = base
+        self.excluded = excluded
+
+    def head(self) -> Optional[str]:
+        while True:
+            value = self.base.head()
+            if value is None:
+                return None
+            for stream in self.excluded:
+                stream.seek(value)
+                if stream.head() == value:
+                    self.base.advance()
+                    break
+            else:
+                return value
+
+    def advance(self):
+        self.base.advance()
+
+    def seek(self, target: str):
+        self.base.seek(target)
+
+def _tag_query_stream(node: tuple, username: str, page_size: int,
+    upper: Optional[str] = None, pool: ThreadPoolExecutor = None):
+    '''
+    Stream for a tree made by `parse_tag_query`,
+    NOT is evaluated against all links of the user
+    '''
+    def all_links():
+        return _RangeStream(username, 'LINK#', page_size, upper, pool)
+
+    def build(node):
+        kind = node[0]
+        if kind == 'tag':
+            return _RangeStream(username, f'TAG#{node[1]}#', page_size, upper, pool)
+        if kind == 'or':
+            return _AnyStream([build(child) for child in node[1]])
+        if kind == 'not':
+            return _ExceptStream(all_links(), [build(node[1])])
+        included = [build(child) for child in node[1] if child[0] != 'not']
+        excluded = [build(child[1]) for child in node[1] if child[0] == 'not']
+        if not included:
+            base = all_links()
+        elif len(included) == 1:
+            base = included[0]
+        else:
+            base = _AllStream(included)
+        return _ExceptStream(base, excluded) if excluded else base
+
+    return build(node)
+
+def _count_ranges(node: tuple) -> int:
+    # number of _RangeStream made by _tag_query_stream for the tree
+    if node[0] == 'tag':
+        return 1
+    if node[0] == 'not':
+        return 1 + _count_ranges(node[1])
+    count = sum(_count_ranges(child) for child in node[1])
+    if node[0] == 'and' and all(child[0] == 'not' for child in node[1]):
+        count += 1
+    return count
+
+@_read_through
+def db_get_links_by_tags(username: str, query: str, limit: int = 20,
+    cursor: Optional[str] = None, fields: Tuple[str, ...] = None,
+    plain: bool = False) -> Tuple[List[Link], Optional[str]]:
+    '''
+    One page of links matching the tag expression, newest first,
+    e.g. `python AND performance NOT draft` or `(go OR rust) NOT old`.
+    Returns the links and the cursor of the next page or None.
+    Raises ValueError if the expression or the cursor is malformed.
+    '''
+    tree = parse_tag_query(query)
+    upper = None
+    if cursor:
+        key = decode_cursor(cursor)
+        if set(key) != {'created'}:
+            raise ValueError('Invalid cursor')
+        upper = key['created']
+    limit = min(limit, MAX_PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=_count_ranges(tree),
+        thread_name_prefix='tag-query') as pool:
+        stream = _tag_query_stream(tree, username, limit + 1, upper, pool)
+        if upper is not None and stream.head() == upper:
+            stream.advance()
+        ids = []
+        while len(ids) <= limit:
+            value = stream.head()
+            if value is None:
+                break
+            ids.append(value)
+            stream.advance()
+    next_cursor = None
+    if len(ids) > limit:
+        ids = ids[:limit]
+        next_cursor = encode_cursor({'created': ids[-1]})
+    links = _db_get_links_by_ids(username, ids, fields=fields, plain=plain)
+    return [links[id] for id in ids if id in links], next_cursor
+
+"""
+    SEARCH
+
+    Inverted index over link titles and urls: an IDX#<term>#<created>
+    entity per term of a link, holding the term weight `w`.
+    Prefix search is a `begins_with` query on the term.
+"""
+
+SEARCH_MAX_TERMS = 8 # per query
+SEARCH_MAX_REFS = int(os.environ.get('SEARCH_MAX_REFS', 20000)) # per query term
+SEARCH_PREFIX_FACTOR = 0.5 # score of a prefix match relative to an exact one
+
+def _search_index_items(username: str, link_timestamp: str,
+    title: Optional[str], url: str) -> List[dict]:
+    return [{
+        'PK': f'USER#{f_k(username)}',
+        'SK': f'IDX#{term}#{link_timestamp}',
+        'created': link_timestamp,
+        'w': weight,
+    } for term, weight in link_terms(title, url).items()]
 
-def db_get_links_by_tag(username: str, tagname: str):
+def _db_index_link(username: str, link_timestamp: str,
+    title: Optional[str], url: str) -> None:
     table = _get_table()
+    with table.batch_writer() as batch:
+        for item in _search_index_items(username, link_timestamp, title, url):
+            batch.put_item(Item=item)
 
-    resp = table.query(
+def _db_search_term(username: str, term: str) -> dict:
+    '''
+    Links matching the term as a prefix, returns {created: score}
+    '''
+    table = _get_table()
+    kwargs = dict(
         KeyConditionExpression='PK = :PK_val AND begins_with (SK, :SK_begins)',
         ExpressionAttributeValues={
             ':PK_val': f'USER#{f_k(username)}',
-            ':SK_begins': f'TAG#{tagname}#'
-        }
+            ':SK_begins': f'IDX#{term}',
+        },
+        ProjectionExpression='SK, created, w',
     )
-    check_resp('db_get_link_by_tag', resp)
-    items = resp['Items']
-    return parse_obj_as(List[Link], items)
+    scores, read = {}, 0
+    while read < SEARCH_MAX_REFS:
+        resp = table.query(**kwargs)
+        check_resp('_db_search_term', resp)
+        for item in resp['Items']:
+            token = item['SK'][len('IDX#'):].rsplit('#', 1)[0]
+            score = float(item['w']) * (1 if token == term else SEARCH_PREFIX_FACTOR)
+            if scores.get(item['created'], 0) < score:
+                scores[item['created']] = score
+        read += len(resp['Items'])
+        if 'LastEvaluatedKey' not in resp:
+            break
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+    return scores
+
+@_read_through
+def db_search_links(username: str, query: str, limit: int = 20,
+    fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+    '''
+    Links having all words of `query` (as prefixes) in the title or url.
+
+    Ranked by the sum of term weights: title words weigh more than host
+    words, host words more than path words, exact matches more than
+    prefix ones. Newer links go first among equal scores.
+    '''
+    terms = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_TERMS]
+    if not terms:
+        return []
+    with ThreadPoolExecutor(max_workers=len(terms), thread_name_prefix='search') as pool:
+        results = list(pool.map(
+            _with_context(lambda term: _db_search_term(username, term)), terms))
+    results.sort(key=len)
+    candidates = set(results[0])
+    for scores in results[1:]:
+        candidates &= scores.keys()
+    ranked = sorted(candidates, reverse=True,
+        key=lambda id: (sum(scores[id] for scores in results), id))
+    top = ranked[:min(limit, MAX_PAGE_SIZE)]
+    links = _db_get_links_by_ids(username, top, fields=fields, plain=plain)
+    return [links[id] for id in top if id in links]
+
+"""
+    IMPORT
+"""
+
+BATCH_WRITE_MAX_ITEMS = 25 # DynamoDB limit of items per BatchWriteItem
+BATCH_WRITE_MAX_RETRIES = 8
+
+def _db_get_user_urls(username: str) -> set:
+    '''
+    Canonical urls the user already has (raw ones for links stored
+    before canonicalization), only index keys are read
+    '''
+    table = _get_table()
+    kwargs = dict(
+        IndexName='GSI1-index',
+        KeyConditionExpression='GSI1PK = :PK_val AND begins_with (GSI1SK, :SK_begins)',
+        ExpressionAttributeValues={
+            ':PK_val': f'USER#{f_k(username)}',
+            ':SK_begins': 'LINK#',
+        },
+        ProjectionExpression='GSI1SK',
+    )
+    urls = set()
+    while True:
+        resp = table.query(**kwargs)
+        check_resp('_db_get_user_urls', resp)
+        urls.update(item['GSI1SK'][len('LINK#'):] for item in resp['Items'])
+        if 'LastEvaluatedKey' not in resp:
+            return urls
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+class UnprocessedItemsError(Exception):
+    '''
+    BatchWriteItem kept returning unprocessed items
+    '''
+
+def _db_batch_write(requests: List[dict]) -> int:
+    '''
+    Send up to 25 put/delete requests with BatchWriteItem, unprocessed
+    ones are sent again with exponential backoff.
+    Returns the number of calls made.
+    '''
+    table = _get_table()
+    request = {table.name: requests}
+    calls = 0
+    while request:
+        if calls > BATCH_WRITE_MAX_RETRIES:
+            raise UnprocessedItemsError("Can't execute <_db_batch_write>, "
+                "items are still unprocessed")
+        if calls:
+            time.sleep(min(0.05 * 2 ** calls, 2))
+        resp = table.meta.client.batch_write_item(RequestItems=request)
+        check_resp('_db_batch_write', resp)
+        request = resp.get('UnprocessedItems')
+        calls += 1
+    return calls
+
+def _is_valid_url(url) -> bool:
+    if not isinstance(url, str) or len(url) > 2048:
+        return False
+    parsed = urllib.parse.urlsplit(url)
+    return bool(parsed.scheme and parsed.netloc)
+
+def _new_link_items(username: str, created: str, url: str, title: Optional[str],
+    tags: List[str]) -> List[dict]:
+    '''
+    Items of a new link: its URL# and LINK# entities first, then the
+    TAG# and IDX# ones
+    '''
+    pk = f'USER#{f_k(username)}'
+    items = [_url_ref(username, url, created), {
+        'PK': pk,
+        'SK': f'LINK#{created}',
+        'created': created,
+        'title': title,
+        'url': url,
+        'icon': None,
+        'tags': tags,
+        'GSI1PK': pk,
+        'GSI1SK': f'LINK#{canonical_url(url)}',
+    }]
+    items.extend(_tag_ref(username, tag, created) for tag in tags)
+    items.extend(_search_index_items(username, created, title, url))
+    return items
+
+def _import_put(table_name: str, item: dict) -> dict:
+    put = {'TableName': table_name, 'Item': item}
+    if item['SK'].startswith(('URL#', 'LINK#')):
+        # never overwrite a link or the url of a link added meanwhile
+        put['ConditionExpression'] = 'attribute_not_exists(SK)'
+    return {'Put': put}
+
+def _db_delete_items(items: List[dict]) -> None:
+    for i in range(0, len(items), BATCH_WRITE_MAX_ITEMS):
+        _db_batch_write([{'DeleteRequest': {'Key': {'PK': item['PK'], 'SK': item['SK']}}}
+            for item in items[i:i + BATCH_WRITE_MAX_ITEMS]])
+
+def _db_put_import_group(group: List[List[dict]]) -> Tuple[List[List[dict]], Counter]:
+    '''
+    Put the links of `group`, the items of each one with its URL# and
+    LINK# entities first, by one TransactWriteItems. So a link is written
+    whole or not at all.
+
+    A link with more items than a transaction takes is alone in its
+    group, its last items are put by BatchWriteItem before and are
+    deleted if the link isn't written.
+
+    Returns the written links and a Counter of `duplicates` (urls added
+    meanwhile), `failed` links and `calls`.
+    '''
+    table = _get_table()
+    counts = Counter()
+    extra = [item for items in group for item in items[TRANSACT_MAX_ITEMS:]]
+    group = [items[:TRANSACT_MAX_ITEMS] for items in group]
+    attempts = 0
+    try:
+        for i in range(0, len(extra), BATCH_WRITE_MAX_ITEMS):
+            counts['calls'] += _db_batch_write([{'PutRequest': {'Item': item}}
+                for item in extra[i:i + BATCH_WRITE_MAX_ITEMS]])
+        while group:
+            attempts += 1
+            counts['calls'] += 1
+            try:
+                resp = table.meta.client.transact_write_items(TransactItems=[
+                    _import_put(table.name, item) for items in group for item in items])
+            except ClientError as err:
+                reasons = err.response.get('CancellationReasons')
+                if not reasons or attempts > BATCH_WRITE_MAX_RETRIES:
+                    raise err
+                kept, at = [], 0
+                for items in group:
+                    codes = [r.get('Code') for r in reasons[at:at + 2]]
+                    at += len(items)
+                    if codes[0] == 'ConditionalCheckFailed':
+                        counts['duplicates'] += 1
+                    elif codes[1] == 'ConditionalCheckFailed':
+                        counts['failed'] += 1 # the id is taken, not expected
+                    else:
+                        kept.append(items)
+                if len(kept) == len(group): # a conflict with another transaction
+                    time.sleep(min(0.05 * 2 ** attempts, 2))
+                group = kept
+                continue
+            check_resp('_db_put_import_group', resp)
+            return group, counts
+    except (ClientError, BotoCoreError, UnprocessedItemsError) as e:
+        logger.warning('import of %d links failed: %s', len(group), e)
+        counts['failed'] += len(group)
+    if extra:
+        try:
+            _db_delete_items(extra)
+        except (ClientError, BotoCoreError, UnprocessedItemsError) as e:
+            logger.warning('items of the not imported link %s are left: %s',
+                extra[0]['created'], e)
+    return [], counts
+
+def db_import_links(username: str, records: Iterable[dict], workers: int = 4,
+    progress: Callable[[dict], None] = None) -> dict:
+    '''
+    Import links from `records` - dicts with `url`, `title` and `tags`.
+
+    Records are consumed lazily and written by `workers` threads, a
+    transaction of links at a time (see `_db_put_import_group`). Urls
+    the user already has and repeated urls (compared in canonical form)
+    are skipped. `progress` is called with the report after every
+    transaction. Results are counted per link.
+    '''
+    start = time.perf_counter()
+    report = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0,
+        'failed': 0, 'calls': 0, 'seconds': 0.0}
+    seen = {canonical_url(url) for url in _db_get_user_urls(username)}
+    report['calls'] += 1
+
+    def write(group: List[List[dict]]) -> Counter:
+        # errors of DynamoDB fail the links, anything else is a bug and is raised
+        written, counts = _db_put_import_group(group)
+        counts['imported'] = len(written)
+        # the LINK# entity is the second item
+        tags = Counter(tag for items in written for tag in items[1]['tags'])
+        if tags:
+            # the links are written, only the counts are off if this fails
+            counts['calls'] += 1
+            try:
+                _db_update_tag_catalog(username, tags)
+            except (ClientError, BotoCoreError) as e:
+                logger.warning('tag catalog not updated, rebuild it with '
+                    'scripts/build_tag_catalog.py: %s', e)
+        return counts
+
+    def collect(future):
+        counts = future.result()
+        for key in ('imported', 'duplicates', 'failed', 'calls'):
+            report[key] += counts[key]
+        report['seconds'] = round(time.perf_counter() - start, 3)
+        if progress:
+            progress(dict(report))
+
+    group, group_items, pending = [], 0, set()
+    write = _with_context(write)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as pool:
+        for record in records:
+            report['read'] += 1
+            url = record.get('url')
+            if not _is_valid_url(url):
+                report['invalid'] += 1
+                continue
+            canonical = canonical_url(url)
+            if canonical in seen:
+                report['duplicates'] += 1
+                continue
+            seen.add(canonical)
+            # ids grow in the import order
+            created = new_link_id()
+            items = _new_link_items(username, created, url, record.get('title'),
+                list(dict.fromkeys(record.get('tags') or [])))
+            # the items of a link are never split between groups
+            if group and group_items + len(items) > TRANSACT_MAX_ITEMS:
+                pending.add(pool.submit(write, group))
+                group, group_items = [], 0
+            group.append(items)
+            group_items += len(items)
+            # don't let the reader run away from the writers
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+        if group:
+            pending.add(pool.submit(write, group))
+        for future in pending:
+            collect(future)
+    _links_changed(username)
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return report
 
 """
     USERS
 """
 
+# Users are read on every authenticated request, so they are cached.
+# Invalidation is local, other processes see changes after the TTL.
+_user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60)),
+)
+_token_version_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('TOKEN_VERSION_CACHE_TTL', 10)),
+)
+
+def _invalidate_user(username: str) -> None:
+    _user_cache.delete(f_k(username))
+    _token_version_cache.delete(f_k(username))
+
+def clear_caches() -> None:
+    _user_cache.clear()
+    _token_version_cache.clear()
+    _link_cache.clear()
+
+def user_cache_stats() -> dict:
+    return {
+        'user': _user_cache.stats(),
+        'token_version': _token_version_cache.stats(),
+    }
+
 def db_put_user(user: UserInDB) -> None:
     '''
-    Put User to db
+    Put User to db, raises ValueError while a user with
+    this username is being deleted
     '''
     table = _get_table()
     # adding user entity
@@ -335,8 +1427,16 @@ def db_put_user(user: UserInDB) -> None:
         'PK': f'USER#{f_k(user.username)}',
         'SK': f'USER#{f_k(user.username)}',
     })
-    resp = table.put_item(Item=user_dict)
+    try:
+        resp = table.put_item(Item=user_dict,
+            ConditionExpression='attribute_not_exists(deleting)')
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise ValueError('User with this username is being deleted, '
+                'try again later') from err
+        raise err
     check_resp('db_put_user', resp)
+    _invalidate_user(user.username)
 
 def db_get_user(username: str) -> Optional[UserInDB]:
     '''
@@ -349,29 +1449,300 @@ def db_get_user(username: str) -> Optional[UserInDB]:
     })
     check_resp('db_get_user', resp)
     item = resp.get('Item')
-    if item is None:
+    if item is None or 'deleting' in item:
         return None
     return UserInDB(**item)
 
-def db_delete_user(username: str) -> None:
-    """
-    Delete all entities related to the User
-    """
+def cached_user(username: str) -> Optional[UserInDB]:
+    return _user_cache.get(f_k(username))
+
+def _db_load_user(username: str) -> Optional[UserInDB]:
+    user = db_get_user(username)
+    if user is not None:
+        _user_cache.set(f_k(username), user)
+    return user
+
+def db_get_user_cached(username: str) -> Optional[UserInDB]:
+    '''
+    Same as `db_get_user`, but the user may come from the cache
+    '''
+    return cached_user(username) or _db_load_user(username)
+
+def cached_token_version(username: str) -> Optional[int]:
+    return _token_version_cache.get(f_k(username))
+
+def _db_load_token_version(username: str) -> Optional[int]:
     table = _get_table()
-    # get all entities which belongs to the user
-    resp = table.query(
+    resp = table.get_item(Key={
+            'PK': f'USER#{f_k(username)}',
+            'SK': f'USER#{f_k(username)}',
+        },
+        ProjectionExpression='token_version, deleting',
+    )
+    check_resp('db_get_token_version', resp)
+    item = resp.get('Item')
+    if item is None or 'deleting' in item:
+        return None
+    version = int(item.get('token_version', 0))
+    _token_version_cache.set(f_k(username), version)
+    return version
+
+def db_get_token_version(username: str) -> Optional[int]:
+    '''
+    Current token version of the user (cached), None if the user doesn't exist
+    '''
+    version = cached_token_version(username)
+    if version is None:
+        version = _db_load_token_version(username)
+    return version
+
+def db_update_hashpass(username: str, hashpass: str) -> None:
+    '''
+    Replace the password hash only, other user fields stay untouched
+    '''
+    table = _get_table()
+    resp = table.update_item(
+        Key={
+            'PK': f'USER#{f_k(username)}',
+            'SK': f'USER#{f_k(username)}',
+        },
+        UpdateExpression='SET hashpass = :hashpass',
+        ConditionExpression='attribute_exists(PK)',
+        ExpressionAttributeValues={':hashpass': hashpass},
+    )
+    check_resp('db_update_hashpass', resp)
+    _invalidate_user(username)
+
+def db_revoke_tokens(username: str) -> None:
+    '''
+    Bump the token version, tokens issued before are rejected
+    '''
+    table = _get_table()
+    resp = table.update_item(
+        Key={
+            'PK': f'USER#{f_k(username)}',
+            'SK': f'USER#{f_k(username)}',
+        },
+        UpdateExpression='ADD token_version :one',
+        ConditionExpression='attribute_exists(PK)',
+        ExpressionAttributeValues={':one': 1},
+    )
+    check_resp('db_revoke_tokens', resp)
+    _invalidate_user(username)
+
+DELETE_PAGE_SIZE = 1000
+DELETE_JOB_STALE_SECONDS = 120
+
+def _db_delete_partition(username: str, workers: int = 4, deadline: float = None,
+    on_page: Callable[[int], None] = None, keep_user: bool = False) -> Tuple[int, bool]:
+    '''
+    Delete every entity of the user page by page, only keys are read.
+    Every page is deleted by `workers` threads with BatchWriteItem.
+    With `keep_user` the USER# entity is left, it's not counted.
+
+    Deleted items don't come back in the query, so the deletion always
+    starts from the beginning of the partition and an interrupted run
+    is simply continued by the next one.
+    Stops after the page which crossed `deadline` (time.monotonic()).
+    Returns (deleted items, whether the partition is empty).
+    '''
+    table = _get_table()
+    kwargs = dict(
         KeyConditionExpression='PK = :PK_val',
         ExpressionAttributeValues={
             ':PK_val': f'USER#{f_k(username)}',
-        }
+        },
+        ProjectionExpression='PK, SK',
+        Limit=DELETE_PAGE_SIZE,
     )
-    check_resp('db_delete_user', resp)
-    items_to_delete = resp['Items']
-    # let's delete all this items
-    with table.batch_writer() as batch:
-        for item in items_to_delete:
-            resp = batch.delete_item(Key={
-                'PK': item['PK'],
-                'SK': item['SK'],
-            })
-    return None
\ No newline at end of file
+    user_sk = f'USER#{f_k(username)}' if keep_user else None
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='delete') as pool:
+        while True:
+            resp = table.query(**kwargs)
+            check_resp('_db_delete_partition', resp)
+            requests = [{'DeleteRequest': {'Key': item}} for item in resp['Items']
+                if item['SK'] != user_sk]
+            chunks = [requests[i:i + BATCH_WRITE_MAX_ITEMS]
+                for i in range(0, len(requests), BATCH_WRITE_MAX_ITEMS)]
+            list(pool.map(_with_context(_db_batch_write), chunks))
+            deleted += len(requests)
+            _links_changed(username)
+            if on_page:
+                on_page(deleted)
+            if 'LastEvaluatedKey' not in resp:
+                return deleted, True
+            if deadline is not None and time.monotonic() >= deadline:
+                return deleted, False
+
+def db_delete_user(username: str) -> None:
+    """
+    Delete all entities related to the User
+    """
+    _invalidate_user(username)
+    _db_delete_partition(username)
+    _invalidate_user(username)
+    return None
+
+def _delete_job_key(job_id: str) -> dict:
+    return {
+        'PK': f'JOB#{job_id}',
+        'SK': f'JOB#{job_id}',
+    }
+
+def db_start_delete_user(username: str) -> str:
+    '''
+    Disable the user right away and create a deletion job for the rest
+    of the entities. Returns the job id for `db_run_delete_job`.
+
+    The user entity is replaced by a tombstone holding the job id in
+    the same transaction. Until the job is done the username can't log
+    in or be registered again, so the job never deletes a new account.
+    '''
+    table = _get_table()
+    job_id = uuid4().hex
+    now = datetime.utcnow().isoformat(timespec='seconds')
+    resp = table.meta.client.transact_write_items(TransactItems=[
+        {'Put': {
+            'TableName': table.name,
+            'Item': dict(_delete_job_key(job_id), username=username,
+                status='pending', deleted=0, created=now, updated=now),
+        }},
+        {'Put': {
+            'TableName': table.name,
+            'Item': {
+                'PK': f'USER#{f_k(username)}',
+                'SK': f'USER#{f_k(username)}',
+                'username': username,
+                'deleting': job_id,
+            },
+        }},
+    ])
+    check_resp('db_start_delete_user', resp)
+    _invalidate_user(username)
+    return job_id
+
+def db_get_delete_job(job_id: str) -> Optional[dict]:
+    '''
+    Deletion job state: `status` (pending, running, done), `deleted`,
+    `created` and `updated`. `stale` is True if the job should be resumed.
+    '''
+    table = _get_table()
+    resp = table.get_item(Key=_delete_job_key(job_id))
+    check_resp('db_get_delete_job', resp)
+    job = resp.get('Item')
+    if job is None:
+        return None
+    updated = datetime.fromisoformat(job['updated'])
+    idle = (datetime.utcnow() - updated).total_seconds()
+    job['stale'] = job['status'] == 'pending' or\
+        (job['status'] == 'running' and idle > DELETE_JOB_STALE_SECONDS)
+    return job
+
+def _delete_job_update(job_id: str, status: str, deleted: int = None) -> dict:
+    '''
+    Update (in transaction format) of the job status and progress
+    '''
+    values = {
+        ':status': status,
+        ':updated': datetime.utcnow().isoformat(timespec='seconds'),
+    }
+    update = 'SET #s = :status, updated = :updated'
+    if deleted is not None:
+        update += ', deleted = deleted + :deleted'
+        values[':deleted'] = deleted
+    return {
+        'TableName': _get_table().name,
+        'Key': _delete_job_key(job_id),
+        'UpdateExpression': update,
+        'ExpressionAttributeNames': {'#s': 'status'},
+        'ExpressionAttributeValues': values,
+    }
+
+def _db_update_delete_job(job_id: str, status: str, deleted: int = None) -> None:
+    resp = _get_table().meta.client.update_item(
+        **_delete_job_update(job_id, status, deleted))
+    check_resp('_db_update_delete_job', resp)
+
+def _db_finish_delete_job(job_id: str, username: str) -> None:
+    '''
+    Remove the tombstone and mark the job done at once
+    '''
+    table = _get_table()
+    resp = table.meta.client.transact_write_items(TransactItems=[
+        {'Delete': {
+            'TableName': table.name,
+            'Key': {
+                'PK': f'USER#{f_k(username)}',
+                'SK': f'USER#{f_k(username)}',
+            },
+            'ConditionExpression': 'deleting = :job',
+            'ExpressionAttributeValues': {':job': job_id},
+        }},
+        {'Update': _delete_job_update(job_id, 'done')},
+    ])
+    check_resp('_db_finish_delete_job', resp)
+    _invalidate_user(username)
+
+def _db_claim_delete_job(job_id: str) -> bool:
+    '''
+    Mark the job as running unless another worker runs it right now
+    '''
+    table = _get_table()
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=DELETE_JOB_STALE_SECONDS)
+    try:
+        table.update_item(
+            Key=_delete_job_key(job_id),
+            UpdateExpression='SET #s = :running, updated = :now',
+            ConditionExpression='#s = :pending OR (#s = :running AND updated < :stale)',
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={
+                ':running': 'running',
+                ':pending': 'pending',
+                ':now': now.isoformat(timespec='seconds'),
+                ':stale': stale_before.isoformat(timespec='seconds'),
+            },
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise err
+    return True
+
+def db_run_delete_job(job_id: str, workers: int = 4, deadline: float = None) -> Optional[dict]:
+    '''
+    Run or resume the deletion job until the user partition is empty
+    or `deadline` (time.monotonic()) is crossed. Progress is saved after
+    every page, an unfinished job stays `pending` and can be run again.
+    '''
+    job = db_get_delete_job(job_id)
+    if job is None or not job['stale']:
+        return job
+    if not _db_claim_delete_job(job_id):
+        return db_get_delete_job(job_id) # another worker took it
+    username = job['username']
+    resp = _get_table().get_item(Key={
+        'PK': f'USER#{f_k(username)}',
+        'SK': f'USER#{f_k(username)}',
+    }, ConsistentRead=True)
+    check_resp('db_run_delete_job', resp)
+    user = resp.get('Item')
+    if user is not None and user.get('deleting') != job_id:
+        # a job started before tombstones, the username has a new account
+        _db_update_delete_job(job_id, 'done')
+        return db_get_delete_job(job_id)
+    last = 0
+    def checkpoint(deleted: int):
+        nonlocal last
+        _db_update_delete_job(job_id, 'running', deleted - last)
+        last = deleted
+    _, finished = _db_delete_partition(username, workers, deadline, checkpoint,
+        keep_user=user is not None)
+    if not finished:
+        _db_update_delete_job(job_id, 'pending')
+    elif user is not None:
+        _db_finish_delete_job(job_id, username)
+    else:
+        _db_update_delete_job(job_id, 'done')
+    return db_get_delete_job(job_id)
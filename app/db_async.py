@@ -0,0 +1,142 @@
+'''
+    Async facade over the storage backend
+
+    Every `db_*` function here runs the method of the same name (without
+    `db_`) of the process-wide `Repository` in a bounded thread pool, so
+    a slow DynamoDB round trip doesn't block the event loop. Scripts can
+    keep using `app.db` directly.
+
+    `DB_MAX_WORKERS` - max number of DynamoDB calls in flight per process (10),
+    keep it not bigger than `DYNAMODB_MAX_POOL_CONNECTIONS`.
+'''
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from .repository import get_repository
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('DB_MAX_WORKERS', 10)),
+                    thread_name_prefix='db',
+                )
+    return _executor
+
+async def run_db(func, *args, **kwargs):
+    '''
+    Run sync `func` in the db pool and await the result.
+    Context variables of the caller are visible inside `func`.
+    '''
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(_get_executor(), call)
+
+def _make_async(name: str):
+    async def wrapper(*args, **kwargs):
+        return await run_db(getattr(get_repository(), name), *args, **kwargs)
+    wrapper.__name__ = f'db_{name}'
+    return wrapper
+
+_DONE = object()
+
+def _make_async_gen(name: str):
+    '''
+    Turn a sync generator method into an async one,
+    every `next()` runs in the db pool
+    '''
+    async def wrapper(*args, **kwargs):
+        gen = getattr(get_repository(), name)(*args, **kwargs)
+        pending = None
+        try:
+            while True:
+                pending = _get_executor().submit(
+                    contextvars.copy_context().run, next, gen, _DONE)
+                item = await asyncio.wrap_future(pending)
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            if pending is None:
+                gen.close()
+            else:
+                # a cancelled await leaves next() running in its thread,
+                # the generator is closed once it returns
+                pending.add_done_callback(lambda _: gen.close())
+    wrapper.__name__ = f'db_{name}'
+    return wrapper
+
+"""
+    LINKS
+"""
+
+db_put_link = _make_async('put_link')
+db_update_link_metadata = _make_async('update_link_metadata')
+db_get_links_by_user = _make_async('get_links_by_user')
+db_get_links_page = _make_async('get_links_page')
+db_iter_links_by_user = _make_async_gen('iter_links_by_user')
+db_get_link_by_url = _make_async('get_link_by_url')
+db_get_link_by_id = _make_async('get_link_by_id')
+db_delete_link = _make_async('delete_link')
+
+"""
+    TAGS
+"""
+
+db_put_tag = _make_async('put_tag')
+db_put_tags = _make_async('put_tags')
+db_delete_tag = _make_async('delete_tag')
+db_get_links_by_tag = _make_async('get_links_by_tag')
+db_get_links_by_tags = _make_async('get_links_by_tags')
+db_get_tag_catalog = _make_async('get_tag_catalog')
+
+"""
+    SEARCH
+"""
+
+db_search_links = _make_async('search_links')
+
+"""
+    IMPORT
+"""
+
+db_import_links = _make_async('import_links')
+
+"""
+    USERS
+"""
+
+db_put_user = _make_async('put_user')
+db_get_user = _make_async('get_user')
+
+async def db_get_user_cached(username: str):
+    '''
+    Cache hits are served right away, without a trip to the db pool
+    '''
+    repository = get_repository()
+    user = repository.cached_user(username)
+    if user is None:
+        user = await run_db(repository.load_user, username)
+    return user
+
+async def db_get_token_version(username: str):
+    repository = get_repository()
+    version = repository.cached_token_version(username)
+    if version is None:
+        version = await run_db(repository.load_token_version, username)
+    return version
+
+db_update_hashpass = _make_async('update_hashpass')
+db_revoke_tokens = _make_async('revoke_tokens')
+db_delete_user = _make_async('delete_user')
+db_start_delete_user = _make_async('start_delete_user')
+db_get_delete_job = _make_async('get_delete_job')
@@ -0,0 +1,718 @@
+'''
+    SQLite backend
+
+    An embedded alternative to the DynamoDB table for self-hosting,
+    local development and single-node deployments (`DB_BACKEND=sqlite`).
+    Tables mirror the DynamoDB entities, their primary keys are the
+    indexes the queries need (all are WITHOUT ROWID, rows are stored
+    in key order):
+
+    - links (user, created) - LINK#, listing newest first is a range scan,
+      the unique (user, url_key) index is the URL# entity
+    - link_tags (user, tag, created) - TAG# refs, every tag of a tag
+      query is a range scan, the tag catalog is a GROUP BY over them
+    - terms (user, term, created) - the IDX# search index, a prefix
+      match is a range scan
+    - users, delete_jobs
+
+    Connections are pooled, every connection works in WAL mode (readers
+    don't wait for the writer) with synchronous=NORMAL and keeps the
+    statements it prepared in the sqlite3 statement cache, so the SQL
+    here is constant text with `?` parameters. Writes run in BEGIN
+    IMMEDIATE transactions, a read-modify-write of a link never races.
+
+    `SQLITE_POOL_SIZE` - max number of kept connections (8)
+    `SQLITE_BUSY_TIMEOUT` - seconds to wait for the write lock (5)
+'''
+import os
+import json
+import time
+import queue
+import sqlite3
+import contextlib
+from datetime import datetime, timedelta
+from uuid import uuid4
+from typing import Optional, List, Tuple, Iterable, Callable
+
+from .db import (
+    MAX_PAGE_SIZE, PUT_LINK_ATTEMPTS, DELETE_PAGE_SIZE, DELETE_JOB_STALE_SECONDS, SEARCH_MAX_TERMS,
+    SEARCH_PREFIX_FACTOR, _links_from_items, _is_valid_url,
+)
+from .repository import Repository
+from .models.user_mod import UserInDB
+from .models.link_mod import Link, LinkInp, LINK_FIELDS
+from .utils.crypto import filter_keyword as f_k
+from .utils.pagination import encode_cursor, decode_cursor
+from .utils.text import tokenize, link_terms
+from .utils.tag_query import parse_tag_query
+from .utils.tag_catalog import TagCatalog
+from .utils.urls import url_key
+from .utils.ids import new_link_id, ID_PREFIX_END
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    email TEXT,
+    hashpass TEXT NOT NULL,
+    token_version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS links (
+    user TEXT NOT NULL,
+    created TEXT NOT NULL,
+    title TEXT,
+    url TEXT NOT NULL,
+    icon TEXT,
+    tags TEXT NOT NULL DEFAULT '[]',
+    canonical TEXT,
+    url_key TEXT NOT NULL,
+    PRIMARY KEY (user, created)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS links_by_url ON links (user, url_key);
+CREATE TABLE IF NOT EXISTS link_tags (
+    user TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    created TEXT NOT NULL,
+    PRIMARY KEY (user, tag, created)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS terms (
+    user TEXT NOT NULL,
+    term TEXT NOT NULL,
+    created TEXT NOT NULL,
+    w REAL NOT NULL,
+    PRIMARY KEY (user, term, created)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS delete_jobs (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    status TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS deleting_users (
+    user TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL
+) WITHOUT ROWID;
+'''
+
+IMPORT_BATCH_SIZE = 500 # links per transaction
+STATEMENT_CACHE_SIZE = 256 # prepared statements kept per connection
+
+"""
+    HELPERS
+"""
+
+def _columns(fields: Optional[Tuple[str, ...]], table: str = 'links') -> str:
+    fields = fields or LINK_FIELDS
+    if not set(fields).issubset(LINK_FIELDS):
+        raise ValueError(f'Unknown link fields {fields}')
+    return ', '.join(f'{table}.{name}' for name in fields)
+
+def _links(rows: list, fields: Optional[Tuple[str, ...]], plain: bool) -> list:
+    names = fields or LINK_FIELDS
+    items = [dict(zip(names, row)) for row in rows]
+    if 'tags' in names:
+        for item in items:
+            item['tags'] = json.loads(item['tags'])
+    return _links_from_items(items, fields, plain)
+
+def _created(row: tuple, fields: Optional[Tuple[str, ...]]) -> str:
+    return row[(fields or LINK_FIELDS).index('created')]
+
+def _prefix_end(prefix: str) -> str:
+    # the smallest string greater than every string starting with `prefix`
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec='seconds')
+
+_TAG_REFS = 'SELECT created FROM link_tags WHERE user = ? AND tag = ?'
+_ALL_LINKS = 'SELECT created FROM links WHERE user = ?'
+
+def _compound(parts: List[Tuple[str, list]], operator: str) -> Tuple[str, list]:
+    # compound operators of SQLite have the same precedence,
+    # so every part is a subquery
+    sql = f' {operator} '.join(f'SELECT created FROM ({part})' for part, _ in parts)
+    return sql, [param for _, params in parts for param in params]
+
+def _tag_query_sql(node: tuple, user: str) -> Tuple[str, list]:
+    '''
+    SELECT of `created` of links matching a tree made by `parse_tag_query`,
+    NOT is evaluated against all links of the user
+    '''
+    kind = node[0]
+    if kind == 'tag':
+        return _TAG_REFS, [user, node[1]]
+    if kind == 'or':
+        return _compound([_tag_query_sql(child, user) for child in node[1]], 'UNION')
+    if kind == 'not':
+        return _compound([(_ALL_LINKS, [user]), _tag_query_sql(node[1], user)], 'EXCEPT')
+    included = [_tag_query_sql(child, user) for child in node[1] if child[0] != 'not']
+    excluded = [_tag_query_sql(child[1], user) for child in node[1] if child[0] == 'not']
+    base = _compound(included, 'INTERSECT') if included else (_ALL_LINKS, [user])
+    return _compound([base] + excluded, 'EXCEPT') if excluded else base
+
+class SQLiteRepository(Repository):
+    def __init__(self, path: str, pool_size: int = None, busy_timeout: float = None):
+        self.path = path
+        self.busy_timeout = busy_timeout or float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+        self._pool = queue.LifoQueue(
+            maxsize=pool_size or int(os.environ.get('SQLITE_POOL_SIZE', 8)))
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    """
+        CONNECTIONS
+    """
+
+    def _connect(self) -> sqlite3.Connection:
+        # transactions are explicit, see `_transaction`
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+            isolation_level=None, check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        '''
+        A connection from the pool, a new one if all are busy.
+        Only `pool_size` connections are kept when they are returned.
+        '''
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        '''
+        Write transaction, it takes the write lock right away
+        '''
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            conn.commit()
+
+    def warmup(self) -> None:
+        with self._connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    """
+        LINKS
+    """
+
+    def _get_link(self, conn: sqlite3.Connection, user: str, created: str,
+        fields: Tuple[str, ...] = None, plain: bool = False):
+        rows = conn.execute(f'SELECT {_columns(fields)} FROM links '
+            'WHERE user = ? AND created = ?', (user, created)).fetchall()
+        return _links(rows, fields, plain)[0] if rows else None
+
+    def _index_link(self, conn: sqlite3.Connection, user: str, created: str,
+        title: Optional[str], url: str) -> None:
+        conn.executemany('INSERT OR REPLACE INTO terms (user, term, created, w) '
+            'VALUES (?, ?, ?, ?)', [(user, term, created, weight)
+                for term, weight in link_terms(title, url).items()])
+
+    def _unindex_link(self, conn: sqlite3.Connection, user: str, created: str,
+        title: Optional[str], url: str) -> None:
+        conn.executemany('DELETE FROM terms WHERE user = ? AND term = ? AND created = ?',
+            [(user, term, created) for term in link_terms(title, url)])
+
+    def put_link(self, username: str, link_inp: LinkInp,
+        on_duplicate: str = 'merge') -> Optional[Link]:
+        user = f_k(username)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT created, title FROM links '
+                'WHERE user = ? AND url_key = ?', (user, url_key(link_inp.url))).fetchone()
+            if row is not None:
+                if on_duplicate == 'reject':
+                    raise ValueError('Link with this url already exists')
+                existing, title = row
+                if link_inp.title and title is None:
+                    conn.execute('UPDATE links SET title = ? WHERE user = ? AND created = ?',
+                        (link_inp.title, user, existing))
+                    link = self._get_link(conn, user, existing)
+                    self._index_link(conn, user, existing, link.title, link.url)
+                    return link
+                return self._get_link(conn, user, existing)
+            for _ in range(PUT_LINK_ATTEMPTS):
+                created = new_link_id()
+                try:
+                    conn.execute('INSERT INTO links (user, created, title, url, url_key) '
+                        'VALUES (?, ?, ?, ?, ?)', (user, created, link_inp.title,
+                            link_inp.url, url_key(link_inp.url)))
+                    break
+                except sqlite3.IntegrityError:
+                    continue # the id is taken
+            else:
+                raise ValueError('Another link was added at the same time, try again')
+            self._index_link(conn, user, created, link_inp.title, link_inp.url)
+        return Link(created=created, title=link_inp.title, url=link_inp.url)
+
+    def update_link_metadata(self, username: str, link_timestamp: str,
+        title: Optional[str] = None, icon: Optional[str] = None,
+        canonical: Optional[str] = None) -> Optional[Link]:
+        user = f_k(username)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT title, url FROM links WHERE user = ? AND created = ?',
+                (user, link_timestamp)).fetchone()
+            if row is None:
+                return None
+            if title and row[0] is None:
+                conn.execute('UPDATE links SET icon = ?, canonical = ?, title = ? '
+                    'WHERE user = ? AND created = ?',
+                    (icon, canonical, title, user, link_timestamp))
+                self._index_link(conn, user, link_timestamp, title, row[1])
+            else:
+                conn.execute('UPDATE links SET icon = ?, canonical = ? '
+                    'WHERE user = ? AND created = ?', (icon, canonical, user, link_timestamp))
+            return self._get_link(conn, user, link_timestamp)
+
+    def get_links_page(self, username: str, limit: int = None, offset: str = "",
+        cursor: str = None, fields: Tuple[str, ...] = None,
+        plain: bool = False) -> Tuple[List[Link], Optional[str]]:
+        limit = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+        before = self._decode_link_cursor(username, cursor) if cursor else ID_PREFIX_END
+        with self._connection() as conn:
+            # one row more tells if there is a next page
+            rows = conn.execute(f'SELECT {_columns(fields)} FROM links '
+                'WHERE user = ? AND created <= ? AND created < ? '
+                'ORDER BY created DESC LIMIT ?',
+                (f_k(username), (offset or '') + ID_PREFIX_END, before,
+                    limit + 1)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.link_cursor(username, _created(rows[-1], fields))
+        return _links(rows, fields, plain), next_cursor
+
+    def link_cursor(self, username: str, link_timestamp: str) -> str:
+        return encode_cursor({'user': f_k(username), 'created': link_timestamp})
+
+    def check_link_cursor(self, username: str, cursor: str) -> None:
+        self._decode_link_cursor(username, cursor)
+
+    def _decode_link_cursor(self, username: str, cursor: str) -> str:
+        key = decode_cursor(cursor)
+        if set(key) != {'user', 'created'} or key['user'] != f_k(username):
+            raise ValueError('Invalid cursor')
+        return key['created']
+
+    def get_link_by_url(self, username: str, url: str,
+        fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+        with self._connection() as conn:
+            rows = conn.execute(f'SELECT {_columns(fields)} FROM links '
+                'WHERE user = ? AND url_key = ?', (f_k(username), url_key(url))).fetchall()
+        return _links(rows, fields, plain)
+
+    def get_link_by_id(self, username: str, id: str, fields: Tuple[str, ...] = None,
+        plain: bool = False):
+        with self._connection() as conn:
+            return self._get_link(conn, f_k(username), id, fields, plain)
+
+    def delete_link(self, username: str, link_timestamp: str):
+        user = f_k(username)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT title, url, tags FROM links '
+                'WHERE user = ? AND created = ?', (user, link_timestamp)).fetchone()
+            if row is None:
+                raise ValueError('Link with this timestamp does not exist')
+            title, url, tags = row
+            conn.execute('DELETE FROM links WHERE user = ? AND created = ?',
+                (user, link_timestamp))
+            conn.executemany('DELETE FROM link_tags WHERE user = ? AND tag = ? AND created = ?',
+                [(user, tag, link_timestamp) for tag in json.loads(tags)])
+            self._unindex_link(conn, user, link_timestamp, title, url)
+
+    """
+        TAGS
+    """
+
+    def _add_tags(self, conn: sqlite3.Connection, user: str, link_timestamp: str,
+        new_tags: List[str]) -> None:
+        row = conn.execute('SELECT tags FROM links WHERE user = ? AND created = ?',
+            (user, link_timestamp)).fetchone()
+        if row is None:
+            raise ValueError('Link with this timestamp does not exist')
+        tags = json.loads(row[0])
+        if any(tag in tags for tag in new_tags):
+            raise ValueError(f'A tag already exists ({len(new_tags)} tags)')
+        conn.execute('UPDATE links SET tags = ? WHERE user = ? AND created = ?',
+            (json.dumps(tags + new_tags), user, link_timestamp))
+        conn.executemany('INSERT INTO link_tags (user, tag, created) VALUES (?, ?, ?)',
+            [(user, tag, link_timestamp) for tag in new_tags])
+
+    def put_tag(self, username: str, link_timestamp: str, tagname: str):
+        with self._transaction() as conn:
+            self._add_tags(conn, f_k(username), link_timestamp, [tagname])
+        return None
+
+    def put_tags(self, username: str, pairs: List[Tuple[str, str]]) -> dict:
+        '''
+        All tags are added in one transaction, `calls` counts transactions
+        '''
+        user = f_k(username)
+        new_tags = {}
+        for link_timestamp, tagname in pairs:
+            tags = new_tags.setdefault(link_timestamp, [])
+            if tagname not in tags:
+                tags.append(tagname)
+        added, skipped = 0, []
+        with self._transaction() as conn:
+            for link_timestamp, tags in new_tags.items():
+                row = conn.execute('SELECT tags FROM links WHERE user = ? AND created = ?',
+                    (user, link_timestamp)).fetchone()
+                if row is None:
+                    skipped.extend({'link_timestamp': link_timestamp, 'tagname': tag,
+                        'reason': 'link does not exist'} for tag in tags)
+                    continue
+                existing = json.loads(row[0])
+                fresh = [tag for tag in tags if tag not in existing]
+                skipped.extend({'link_timestamp': link_timestamp, 'tagname': tag,
+                    'reason': 'tag already exists'} for tag in tags if tag in existing)
+                if fresh:
+                    self._add_tags(conn, user, link_timestamp, fresh)
+                    added += len(fresh)
+        return {'added': added, 'skipped': skipped, 'calls': {'Transaction': 1}}
+
+    def delete_tag(self, username: str, link_timestamp: str, tagname: str):
+        user = f_k(username)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT tags FROM links WHERE user = ? AND created = ?',
+                (user, link_timestamp)).fetchone()
+            if row is None:
+                raise ValueError('Link with this timestamp does not exist')
+            tags = json.loads(row[0])
+            if tagname not in tags:
+                return None
+            tags.remove(tagname)
+            conn.execute('UPDATE links SET tags = ? WHERE user = ? AND created = ?',
+                (json.dumps(tags), user, link_timestamp))
+            conn.execute('DELETE FROM link_tags WHERE user = ? AND tag = ? AND created = ?',
+                (user, tagname, link_timestamp))
+        return None
+
+    def get_links_by_tag(self, username: str, tagname: str,
+        fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+        user = f_k(username)
+        with self._connection() as conn:
+            rows = conn.execute(f'SELECT {_columns(fields)} FROM link_tags '
+                'JOIN links ON links.user = link_tags.user AND links.created = link_tags.created '
+                'WHERE link_tags.user = ? AND link_tags.tag = ? ORDER BY link_tags.created',
+                (user, tagname)).fetchall()
+        return _links(rows, fields, plain)
+
+    def get_links_by_tags(self, username: str, query: str, limit: int = 20,
+        cursor: Optional[str] = None, fields: Tuple[str, ...] = None,
+        plain: bool = False) -> Tuple[List[Link], Optional[str]]:
+        tree = parse_tag_query(query)
+        before = ID_PREFIX_END
+        if cursor:
+            key = decode_cursor(cursor)
+            if set(key) != {'created'}:
+                raise ValueError('Invalid cursor')
+            before = key['created']
+        limit = min(limit, MAX_PAGE_SIZE)
+        user = f_k(username)
+        matching, params = _tag_query_sql(tree, user)
+        with self._connection() as conn:
+            rows = conn.execute(f'WITH matching (created) AS ({matching}) '
+                f'SELECT {_columns(fields)} FROM matching '
+                'JOIN links ON links.user = ? AND links.created = matching.created '
+                'WHERE matching.created < ? ORDER BY matching.created DESC LIMIT ?',
+                (*params, user, before, limit + 1)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor({'created': _created(rows[-1], fields)})
+        return _links(rows, fields, plain), next_cursor
+
+    def get_tag_catalog(self, username: str) -> TagCatalog:
+        with self._connection() as conn:
+            rows = conn.execute('SELECT tag, count(*) FROM link_tags WHERE user = ? '
+                'GROUP BY tag', (f_k(username),)).fetchall()
+        return TagCatalog(dict(rows))
+
+    """
+        SEARCH
+    """
+
+    _SEARCH_TERM = ('SELECT created, max(w * (CASE WHEN term = ? THEN 1.0 ELSE ? END)) '
+        'AS score FROM terms WHERE user = ? AND term >= ? AND term < ? GROUP BY created')
+
+    def search_links(self, username: str, query: str, limit: int = 20,
+        fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+        '''
+        Same ranking as the DynamoDB backend, computed in one query:
+        a score per link and term, links matching all terms are summed
+        '''
+        terms = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_TERMS]
+        if not terms:
+            return []
+        user = f_k(username)
+        params = []
+        for term in terms:
+            params.extend((term, SEARCH_PREFIX_FACTOR, user, term, _prefix_end(term)))
+        scores = ' UNION ALL '.join([self._SEARCH_TERM] * len(terms))
+        with self._connection() as conn:
+            rows = conn.execute(f'WITH hits (created, score) AS ('
+                f'SELECT created, sum(score) FROM ({scores}) GROUP BY created '
+                'HAVING count(*) = ? ORDER BY 2 DESC, 1 DESC LIMIT ?) '
+                f'SELECT {_columns(fields)} FROM hits '
+                'JOIN links ON links.user = ? AND links.created = hits.created '
+                'ORDER BY hits.score DESC, hits.created DESC',
+                (*params, len(terms), min(limit, MAX_PAGE_SIZE), user)).fetchall()
+        return _links(rows, fields, plain)
+
+    """
+        IMPORT
+    """
+
+    def import_links(self, username: str, records: Iterable[dict], workers: int = 4,
+        progress: Callable[[dict], None] = None) -> dict:
+        '''
+        Same as `db_import_links`, links are written by the calling
+        thread (SQLite has one writer), `IMPORT_BATCH_SIZE` per
+        transaction. `workers` is ignored.
+        '''
+        start = time.perf_counter()
+        report = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0,
+            'failed': 0, 'calls': 0, 'seconds': 0.0}
+        user = f_k(username)
+        with self._connection() as conn:
+            seen = {row[0] for row in conn.execute(
+                'SELECT url_key FROM links WHERE user = ?', (user,))}
+        report['calls'] += 1
+
+        def write(batch: List[dict]):
+            # counted once the transaction is committed
+            imported = duplicates = 0
+            try:
+                with self._transaction() as conn:
+                    for link in batch:
+                        inserted = conn.execute('INSERT OR IGNORE INTO links '
+                            '(user, created, title, url, tags, url_key) VALUES (?, ?, ?, ?, ?, ?)',
+                            (user, link['created'], link['title'], link['url'],
+                                json.dumps(link['tags']), link['url_key'])).rowcount
+                        if not inserted: # added meanwhile
+                            duplicates += 1
+                            continue
+                        conn.executemany('INSERT INTO link_tags (user, tag, created) '
+                            'VALUES (?, ?, ?)', [(user, tag, link['created'])
+                                for tag in link['tags']])
+                        self._index_link(conn, user, link['created'], link['title'],
+                            link['url'])
+                        imported += 1
+                report['calls'] += 1
+                report['imported'] += imported
+                report['duplicates'] += duplicates
+            except sqlite3.Error:
+                report['failed'] += len(batch)
+            report['seconds'] = round(time.perf_counter() - start, 3)
+            if progress:
+                progress(dict(report))
+
+        batch = []
+        for record in records:
+            report['read'] += 1
+            url = record.get('url')
+            if not _is_valid_url(url):
+                report['invalid'] += 1
+                continue
+            key = url_key(url)
+            if key in seen:
+                report['duplicates'] += 1
+                continue
+            seen.add(key)
+            # ids grow in the import order
+            created = new_link_id()
+            batch.append({
+                'created': created,
+                'title': record.get('title'),
+                'url': url,
+                'tags': list(dict.fromkeys(record.get('tags') or [])),
+                'url_key': key,
+            })
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                write(batch)
+                batch = []
+        if batch:
+            write(batch)
+        report['seconds'] = round(time.perf_counter() - start, 3)
+        return report
+
+    """
+        USERS
+    """
+
+    def put_user(self, user: UserInDB) -> None:
+        with self._transaction() as conn:
+            if conn.execute('SELECT 1 FROM deleting_users WHERE user = ?',
+                    (f_k(user.username),)).fetchone():
+                raise ValueError('User with this username is being deleted, '
+                    'try again later')
+            conn.execute('INSERT OR REPLACE INTO users '
+                '(user, username, email, hashpass, token_version) VALUES (?, ?, ?, ?, ?)',
+                (f_k(user.username), user.username, user.email, user.hashpass,
+                    user.token_version))
+
+    def get_user(self, username: str) -> Optional[UserInDB]:
+        with self._connection() as conn:
+            row = conn.execute('SELECT username, email, hashpass, token_version '
+                'FROM users WHERE user = ?', (f_k(username),)).fetchone()
+        if row is None:
+            return None
+        return UserInDB(username=row[0], email=row[1], hashpass=row[2],
+            token_version=row[3])
+
+    def load_token_version(self, username: str) -> Optional[int]:
+        with self._connection() as conn:
+            row = conn.execute('SELECT token_version FROM users WHERE user = ?',
+                (f_k(username),)).fetchone()
+        return None if row is None else row[0]
+
+    def _update_user(self, sql: str, params: tuple) -> None:
+        with self._transaction() as conn:
+            if not conn.execute(sql, params).rowcount:
+                raise ValueError('User does not exist')
+
+    def update_hashpass(self, username: str, hashpass: str) -> None:
+        self._update_user('UPDATE users SET hashpass = ? WHERE user = ?',
+            (hashpass, f_k(username)))
+
+    def revoke_tokens(self, username: str) -> None:
+        self._update_user('UPDATE users SET token_version = token_version + 1 '
+            'WHERE user = ?', (f_k(username),))
+
+    """
+        DELETION
+    """
+
+    # pages of a partition are deleted table by table
+    _DELETE_PAGE = {
+        'terms': 'DELETE FROM terms WHERE (user, term, created) IN '
+            '(SELECT user, term, created FROM terms WHERE user = ? LIMIT ?)',
+        'link_tags': 'DELETE FROM link_tags WHERE (user, tag, created) IN '
+            '(SELECT user, tag, created FROM link_tags WHERE user = ? LIMIT ?)',
+        'links': 'DELETE FROM links WHERE (user, created) IN '
+            '(SELECT user, created FROM links WHERE user = ? LIMIT ?)',
+    }
+
+    def _delete_partition(self, username: str, deadline: float = None,
+        on_page: Callable[[int], None] = None) -> Tuple[int, bool]:
+        '''
+        Delete rows of the user `DELETE_PAGE_SIZE` at a time, every page
+        is a short transaction, so other writers aren't blocked for long.
+        Returns (deleted rows, whether everything is deleted).
+        '''
+        user = f_k(username)
+        deleted = 0
+        for sql in self._DELETE_PAGE.values():
+            while True:
+                with self._transaction() as conn:
+                    count = conn.execute(sql, (user, DELETE_PAGE_SIZE)).rowcount
+                deleted += count
+                if count and on_page:
+                    on_page(deleted)
+                if count < DELETE_PAGE_SIZE:
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    return deleted, False
+        return deleted, True
+
+    def delete_user(self, username: str) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM users WHERE user = ?', (f_k(username),))
+        self._delete_partition(username)
+        return None
+
+    def start_delete_user(self, username: str) -> str:
+        job_id = uuid4().hex
+        now = _now()
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO delete_jobs (id, username, status, created, updated) '
+                "VALUES (?, ?, 'pending', ?, ?)", (job_id, username, now, now))
+            # without the user row the user can't log in anymore, the
+            # username stays taken until the job is done
+            conn.execute('DELETE FROM users WHERE user = ?', (f_k(username),))
+            conn.execute('INSERT INTO deleting_users (user, job_id) VALUES (?, ?)',
+                (f_k(username), job_id))
+        return job_id
+
+    def get_delete_job(self, job_id: str) -> Optional[dict]:
+        with self._connection() as conn:
+            row = conn.execute('SELECT username, status, deleted, created, updated '
+                'FROM delete_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('username', 'status', 'deleted', 'created', 'updated'), row))
+        idle = (datetime.utcnow() - datetime.fromisoformat(job['updated'])).total_seconds()
+        job['stale'] = job['status'] == 'pending' or\
+            (job['status'] == 'running' and idle > DELETE_JOB_STALE_SECONDS)
+        return job
+
+    def run_delete_job(self, job_id: str, workers: int = 4,
+        deadline: float = None) -> Optional[dict]:
+        '''
+        Same as `db_run_delete_job`, `workers` is ignored
+        '''
+        job = self.get_delete_job(job_id)
+        if job is None or not job['stale']:
+            return job
+        stale_before = (datetime.utcnow() - timedelta(seconds=DELETE_JOB_STALE_SECONDS))\
+            .isoformat(timespec='seconds')
+        with self._transaction() as conn:
+            claimed = conn.execute("UPDATE delete_jobs SET status = 'running', updated = ? "
+                "WHERE id = ? AND (status = 'pending' OR (status = 'running' AND updated < ?))",
+                (_now(), job_id, stale_before)).rowcount
+        if not claimed:
+            return self.get_delete_job(job_id) # another worker took it
+        user = f_k(job['username'])
+        with self._connection() as conn:
+            reused = conn.execute('SELECT 1 FROM users WHERE user = ?',
+                (user,)).fetchone()
+        if reused:
+            # a job started before deleting_users, the username has a new account
+            self._update_delete_job(job_id, 'done', 0)
+            return self.get_delete_job(job_id)
+        last = 0
+        def checkpoint(deleted: int):
+            nonlocal last
+            self._update_delete_job(job_id, 'running', deleted - last)
+            last = deleted
+        _, finished = self._delete_partition(job['username'], deadline, checkpoint)
+        with self._transaction() as conn:
+            self._set_delete_job(conn, job_id, 'done' if finished else 'pending', 0)
+            if finished:
+                conn.execute('DELETE FROM deleting_users WHERE user = ? AND job_id = ?',
+                    (user, job_id))
+        return self.get_delete_job(job_id)
+
+    def _update_delete_job(self, job_id: str, status: str, deleted: int) -> None:
+        with self._transaction() as conn:
+            self._set_delete_job(conn, job_id, status, deleted)
+
+    @staticmethod
+    def _set_delete_job(conn, job_id: str, status: str, deleted: int) -> None:
+        conn.execute('UPDATE delete_jobs SET status = ?, updated = ?, '
+            'deleted = deleted + ? WHERE id = ?', (status, _now(), deleted, job_id))
@@ -1,3 +1,6 @@
+import os
+import json
+
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from mangum import Mangum
@@ -10,7 +13,11 @@ try:
 except:
     pass
 
-from .api import links, users, auth
+from .api import links, users, auth, metrics
+from .utils.metrics import MetricsMiddleware, METRICS_ENABLED
+from .utils import log, jobs
+
+log.setup_logging()
 
 tags_metadata = [
     {
@@ -32,11 +39,29 @@ tags_metadata = [
 ]
 
 app = FastAPI(openapi_tags=tags_metadata)
-handler = Mangum(app)
+# the app has no startup/shutdown handlers, running the lifespan
+# protocol on every invocation would be wasted work
+_mangum = Mangum(app, lifespan='off')
+
+def handler(event, context):
+    try:
+        if jobs.is_job(event):
+            # the function invoked itself to run a job, see app.utils.jobs
+            return jobs.handle(event, context)
+        return _mangum(event, context)
+    finally:
+        # Lambda may freeze the process as soon as the handler returns
+        log.flush()
 
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(links.router)
+app.include_router(metrics.router)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+# the outermost one, so everything below logs with the request id
+app.add_middleware(log.RequestIdMiddleware)
 
 
 
@@ -44,9 +69,7 @@ app.include_router(links.router)
 async def home():
     return RedirectResponse(url='/docs')
 
-def custom_openapi():
-    if app.openapi_schema:
-        return app.openapi_schema
+def build_openapi() -> dict:
     openapi_schema = get_openapi(
         title="Link Manager API",
         version="0.0.1",
@@ -56,7 +79,53 @@ def custom_openapi():
     openapi_schema["info"]["x-logo"] = {
         "url": "https://fastapi.tiangolo.com/img/logo-margin/logo-teal.png"
     }
-    app.openapi_schema = openapi_schema
+    return openapi_schema
+
+# written by the deploy workflow, next to this module in the package
+PACKAGED_OPENAPI_SCHEMA = os.path.join(os.path.dirname(__file__), 'openapi.json')
+
+def custom_openapi():
+    '''
+    The schema prebuilt by `scripts/build_openapi.py` if `OPENAPI_SCHEMA_FILE`
+    points to it (on Lambda the packaged `app/openapi.json` by default),
+    otherwise it's built from the routes on the first call
+    '''
+    if app.openapi_schema:
+        return app.openapi_schema
+    on_lambda = 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
+    path = os.environ.get('OPENAPI_SCHEMA_FILE',
+        PACKAGED_OPENAPI_SCHEMA if on_lambda else None)
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            app.openapi_schema = json.load(f)
+    else:
+        app.openapi_schema = build_openapi()
     return app.openapi_schema
 
-app.openapi = custom_openapi
\ No newline at end of file
+app.openapi = custom_openapi
+
+"""
+    LAMBDA INIT
+
+    Lambda imports this module in the init phase, before the first
+    invocation. `warmup` does there what the first request would do:
+    imports modules every request needs and opens the connection
+    of the storage backend.
+
+    `LAMBDA_WARMUP` - `1` or `0`, on by default when running on Lambda
+"""
+
+def warmup() -> None:
+    from jose import jwt
+    from .repository import get_repository
+    if app.middleware_stack is None:
+        app.middleware_stack = app.build_middleware_stack()
+    try:
+        get_repository().warmup()
+    except Exception:
+        # the first request will try again, init must not fail
+        pass
+
+if os.environ.get('LAMBDA_WARMUP',
+    '1' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else '0') == '1':
+    warmup()
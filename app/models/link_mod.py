@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+import functools
+from pydantic import BaseModel, create_model
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple, Type
 
 class Link(BaseModel):
     created: Optional[str] = None
@@ -8,6 +9,50 @@ class Link(BaseModel):
     url: str
     icon: Optional[str] = None
     tags: List[str] = []
+    canonical: Optional[str] = None
+
+LINK_FIELDS = tuple(Link.__fields__)
+
+def parse_link_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    '''
+    Comma separated Link fields as a tuple in the model order,
+    `created` is always included. None stands for all fields.
+    '''
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = names.difference(LINK_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}, '
+            f'available: {", ".join(LINK_FIELDS)}')
+    names.add('created')
+    return tuple(name for name in LINK_FIELDS if name in names)
+
+class PartialLink(BaseModel):
+    '''
+    Base of the models with only some Link fields. They are made at
+    runtime, so an instance is pickled as its fields and values and
+    the model is made again when it's loaded (cached links).
+    '''
+    def __reduce__(self):
+        return (_load_partial_link,
+            (tuple(self.__fields__), self.dict(), set(self.__fields_set__)))
+
+def _load_partial_link(fields: Tuple[str, ...], values: dict, fields_set: set):
+    # the values were validated when the link was made
+    return link_model(fields).construct(_fields_set=fields_set, **values)
+
+@functools.lru_cache(maxsize=None)
+def link_model(fields: Optional[Tuple[str, ...]] = None) -> Type[BaseModel]:
+    '''
+    Link or a model with only `fields` of it
+    '''
+    if fields is None or fields == LINK_FIELDS:
+        return Link
+    return create_model('Link_' + '_'.join(fields), __base__=PartialLink,
+        __module__=__name__, **{
+            field: (Link.__fields__[field].outer_type_, Link.__fields__[field].field_info)
+            for field in fields})
 
 class LinkInDB(Link):
     PK: str
@@ -20,6 +65,16 @@ class LinkInp(BaseModel):
 class LinkListParams(BaseModel):
     offset: Optional[str] = ""
     limit: Optional[int] = None
+    cursor: Optional[str] = None
+    stream: bool = False
+
+class TagPair(BaseModel):
+    link_timestamp: str
+    tagname: str
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
 
 class PutLinkRequest(BaseModel):
     title: Optional[str] = None
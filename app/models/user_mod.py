@@ -7,6 +7,7 @@ class User(BaseModel):
 
 class UserInDB(User):
     hashpass: str
+    token_version: int = 0
 
 class UserReg(User):
     password: str
@@ -60,3 +61,10 @@ class RegResp(BaseModel):
     success: bool
     msg: str
     user: User
+
+class DeleteJob(BaseModel):
+    job_id: str
+    status: str
+    deleted: int = 0
+    created: str
+    updated: str
@@ -0,0 +1,360 @@
+'''
+    Storage backends
+
+    `Repository` is everything the API needs from the storage, every
+    backend implements it with the semantics of `app.db`: same models,
+    errors (ValueError for conflicts and missing links) and ordering.
+    Cursors are opaque, only the backend which made one can read it.
+    The backend of the process is chosen by the environment:
+
+    `DB_BACKEND` - `dynamodb` or `sqlite` (dynamodb)
+    `SQLITE_PATH` - database file of the sqlite backend (links.db)
+
+    Both backends pass the contract tests in tests/test_repository.py.
+'''
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional, List, Tuple, Iterator, Iterable, Callable
+
+from .models.user_mod import UserInDB
+from .models.link_mod import Link, LinkInp
+from .utils.tag_catalog import TagCatalog
+
+class Repository(ABC):
+    '''
+    Interface of a storage backend, see `app.db` for the semantics
+    of every method (the `db_` prefix is dropped). Methods are called
+    from worker threads, so implementations must be thread safe.
+    A backend missing an abstract method can't be created.
+    '''
+
+    """
+        LINKS
+    """
+
+    @abstractmethod
+    def put_link(self, username: str, link_inp: LinkInp,
+        on_duplicate: str = 'merge') -> Optional[Link]:
+        ...
+
+    @abstractmethod
+    def update_link_metadata(self, username: str, link_timestamp: str,
+        title: Optional[str] = None, icon: Optional[str] = None,
+        canonical: Optional[str] = None) -> Optional[Link]:
+        ...
+
+    @abstractmethod
+    def get_links_page(self, username: str, limit: int = None, offset: str = "",
+        cursor: str = None, fields: Tuple[str, ...] = None,
+        plain: bool = False) -> Tuple[List[Link], Optional[str]]:
+        ...
+
+    def iter_links_by_user(self, username: str, offset: str = "", page_size: int = None,
+        cursor: str = None, fields: Tuple[str, ...] = None,
+        plain: bool = False) -> Iterator[List[Link]]:
+        while True:
+            links, cursor = self.get_links_page(username, page_size, offset, cursor,
+                fields, plain)
+            if links:
+                yield links
+            if cursor is None:
+                return
+
+    @abstractmethod
+    def link_cursor(self, username: str, link_timestamp: str) -> str:
+        '''
+        Cursor of `get_links_page` which continues right after the link
+        '''
+
+    @abstractmethod
+    def check_link_cursor(self, username: str, cursor: str) -> None:
+        '''
+        Raise ValueError if `cursor` isn't a `get_links_page` cursor of the user
+        '''
+
+    def get_links_by_user(self, username: str, limit: int = None, offset: str = "",
+        fields: Tuple[str, ...] = None) -> List[Link]:
+        links = []
+        for page in self.iter_links_by_user(username, offset, fields=fields):
+            links.extend(page)
+            if limit and len(links) >= limit:
+                return links[:limit]
+        return links
+
+    @abstractmethod
+    def get_link_by_url(self, username: str, url: str,
+        fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+        ...
+
+    @abstractmethod
+    def get_link_by_id(self, username: str, id: str, fields: Tuple[str, ...] = None,
+        plain: bool = False):
+        ...
+
+    @abstractmethod
+    def delete_link(self, username: str, link_timestamp: str):
+        ...
+
+    """
+        TAGS
+    """
+
+    @abstractmethod
+    def put_tag(self, username: str, link_timestamp: str, tagname: str):
+        ...
+
+    @abstractmethod
+    def put_tags(self, username: str, pairs: List[Tuple[str, str]]) -> dict:
+        ...
+
+    @abstractmethod
+    def delete_tag(self, username: str, link_timestamp: str, tagname: str):
+        ...
+
+    @abstractmethod
+    def get_links_by_tag(self, username: str, tagname: str,
+        fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+        ...
+
+    @abstractmethod
+    def get_links_by_tags(self, username: str, query: str, limit: int = 20,
+        cursor: Optional[str] = None, fields: Tuple[str, ...] = None,
+        plain: bool = False) -> Tuple[List[Link], Optional[str]]:
+        ...
+
+    @abstractmethod
+    def get_tag_catalog(self, username: str) -> TagCatalog:
+        ...
+
+    """
+        SEARCH AND IMPORT
+    """
+
+    @abstractmethod
+    def search_links(self, username: str, query: str, limit: int = 20,
+        fields: Tuple[str, ...] = None, plain: bool = False) -> List[Link]:
+        ...
+
+    @abstractmethod
+    def import_links(self, username: str, records: Iterable[dict], workers: int = 4,
+        progress: Callable[[dict], None] = None) -> dict:
+        ...
+
+    """
+        USERS
+    """
+
+    @abstractmethod
+    def put_user(self, user: UserInDB) -> None:
+        ...
+
+    @abstractmethod
+    def get_user(self, username: str) -> Optional[UserInDB]:
+        ...
+
+    def cached_user(self, username: str) -> Optional[UserInDB]:
+        '''
+        The user if it's known without I/O, None otherwise
+        '''
+        return None
+
+    def load_user(self, username: str) -> Optional[UserInDB]:
+        '''
+        Read the user from the storage, a backend with a cache keeps it
+        there for `cached_user`
+        '''
+        return self.get_user(username)
+
+    def get_user_cached(self, username: str) -> Optional[UserInDB]:
+        return self.cached_user(username) or self.load_user(username)
+
+    def cached_token_version(self, username: str) -> Optional[int]:
+        return None
+
+    def load_token_version(self, username: str) -> Optional[int]:
+        user = self.get_user(username)
+        return None if user is None else user.token_version
+
+    def get_token_version(self, username: str) -> Optional[int]:
+        '''
+        Current token version of the user, None if the user doesn't exist
+        '''
+        version = self.cached_token_version(username)
+        if version is None:
+            version = self.load_token_version(username)
+        return version
+
+    @abstractmethod
+    def update_hashpass(self, username: str, hashpass: str) -> None:
+        ...
+
+    @abstractmethod
+    def revoke_tokens(self, username: str) -> None:
+        ...
+
+    @abstractmethod
+    def delete_user(self, username: str) -> None:
+        ...
+
+    @abstractmethod
+    def start_delete_user(self, username: str) -> str:
+        ...
+
+    @abstractmethod
+    def get_delete_job(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def run_delete_job(self, job_id: str, workers: int = 4,
+        deadline: float = None) -> Optional[dict]:
+        ...
+
+    """
+        LIFECYCLE
+    """
+
+    def warmup(self) -> None:
+        '''
+        Open connections ahead of the first request
+        '''
+
+    def close(self) -> None:
+        pass
+
+class DynamoDBRepository(Repository):
+    '''
+    The single DynamoDB table of `app.db`
+    '''
+    def __init__(self):
+        from . import db
+        self.db = db
+
+    def put_link(self, *args, **kwargs):
+        return self.db.db_put_link(*args, **kwargs)
+
+    def update_link_metadata(self, *args, **kwargs):
+        return self.db.db_update_link_metadata(*args, **kwargs)
+
+    def get_links_page(self, *args, **kwargs):
+        return self.db.db_get_links_page(*args, **kwargs)
+
+    def iter_links_by_user(self, *args, **kwargs):
+        return self.db.db_iter_links_by_user(*args, **kwargs)
+
+    def get_links_by_user(self, *args, **kwargs):
+        return self.db.db_get_links_by_user(*args, **kwargs)
+
+    def link_cursor(self, username: str, link_timestamp: str) -> str:
+        return self.db.link_cursor(username, link_timestamp)
+
+    def check_link_cursor(self, username: str, cursor: str) -> None:
+        self.db.decode_user_cursor(username, cursor)
+
+    def get_link_by_url(self, *args, **kwargs):
+        return self.db.db_get_link_by_url(*args, **kwargs)
+
+    def get_link_by_id(self, *args, **kwargs):
+        return self.db.db_get_link_by_id(*args, **kwargs)
+
+    def delete_link(self, *args, **kwargs):
+        return self.db.db_delete_link(*args, **kwargs)
+
+    def put_tag(self, *args, **kwargs):
+        return self.db.db_put_tag(*args, **kwargs)
+
+    def put_tags(self, *args, **kwargs):
+        return self.db.db_put_tags(*args, **kwargs)
+
+    def delete_tag(self, *args, **kwargs):
+        return self.db.db_delete_tag(*args, **kwargs)
+
+    def get_links_by_tag(self, *args, **kwargs):
+        return self.db.db_get_links_by_tag(*args, **kwargs)
+
+    def get_links_by_tags(self, *args, **kwargs):
+        return self.db.db_get_links_by_tags(*args, **kwargs)
+
+    def get_tag_catalog(self, *args, **kwargs):
+        return self.db.db_get_tag_catalog(*args, **kwargs)
+
+    def search_links(self, *args, **kwargs):
+        return self.db.db_search_links(*args, **kwargs)
+
+    def import_links(self, *args, **kwargs):
+        return self.db.db_import_links(*args, **kwargs)
+
+    def put_user(self, *args, **kwargs):
+        return self.db.db_put_user(*args, **kwargs)
+
+    def get_user(self, *args, **kwargs):
+        return self.db.db_get_user(*args, **kwargs)
+
+    def cached_user(self, username: str) -> Optional[UserInDB]:
+        return self.db.cached_user(username)
+
+    def load_user(self, username: str) -> Optional[UserInDB]:
+        return self.db._db_load_user(username)
+
+    def cached_token_version(self, username: str) -> Optional[int]:
+        return self.db.cached_token_version(username)
+
+    def load_token_version(self, username: str) -> Optional[int]:
+        return self.db._db_load_token_version(username)
+
+    def update_hashpass(self, *args, **kwargs):
+        return self.db.db_update_hashpass(*args, **kwargs)
+
+    def revoke_tokens(self, *args, **kwargs):
+        return self.db.db_revoke_tokens(*args, **kwargs)
+
+    def delete_user(self, *args, **kwargs):
+        return self.db.db_delete_user(*args, **kwargs)
+
+    def start_delete_user(self, *args, **kwargs):
+        return self.db.db_start_delete_user(*args, **kwargs)
+
+    def get_delete_job(self, *args, **kwargs):
+        return self.db.db_get_delete_job(*args, **kwargs)
+
+    def run_delete_job(self, *args, **kwargs):
+        return self.db.db_run_delete_job(*args, **kwargs)
+
+    def warmup(self) -> None:
+        self.db.warmup_table()
+
+"""
+    BACKEND OF THE PROCESS
+"""
+
+_repository = None
+_repository_lock = threading.Lock()
+
+def create_repository(backend: str = None) -> Repository:
+    backend = backend or os.environ.get('DB_BACKEND', 'dynamodb')
+    if backend == 'dynamodb':
+        return DynamoDBRepository()
+    if backend == 'sqlite':
+        from .db_sqlite import SQLiteRepository
+        return SQLiteRepository(os.environ.get('SQLITE_PATH', 'links.db'))
+    raise ValueError(f'Unknown DB_BACKEND {backend!r}, use dynamodb or sqlite')
+
+def get_repository() -> Repository:
+    '''
+    The process-wide backend, made on the first call
+    '''
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = create_repository()
+    return _repository
+
+def set_repository(repository: Optional[Repository]) -> None:
+    '''
+    Use `repository` from now on, with None the next call
+    of `get_repository` makes one from the environment
+    '''
+    global _repository
+    with _repository_lock:
+        _repository = repository
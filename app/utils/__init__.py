@@ -0,0 +1 @@
+from .crypto import get_password_hash, verify_password
@@ -3,6 +3,9 @@ from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 from fastapi.security.utils import get_authorization_scheme_param
 from fastapi import HTTPException, status, Request
 from typing import Optional, Dict, Literal
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Securing JWT token with http-only cookie
 class OAuth2PasswordBearerWithCookie(OAuth2):
@@ -31,7 +34,8 @@ class OAuth2PasswordBearerWithCookie(OAuth2):
 
     async def __call__(self, request: Request) -> Optional[str]:
         authorization = request.cookies.get(self.token_type) # changed to accept access token from httpOnly Cookie
-        print(f'{self.token_type} is: {authorization}')
+        logger.debug('%s cookie %s', self.token_type,
+            'present' if authorization else 'missing')
 
         scheme, param = get_authorization_scheme_param(authorization)
         if not authorization or scheme.lower() != "bearer":
@@ -48,7 +52,7 @@ class OAuth2PasswordBearerWithCookie(OAuth2):
 
 async def RefreshWithCookie(request: Request) -> Optional[str]:
     authorization = request.cookies.get('refresh_token') # changed to accept access token from httpOnly Cookie
-    print(f'refresh_token is: {authorization}')
+    logger.debug('refresh_token cookie %s', 'present' if authorization else 'missing')
 
     scheme, param = get_authorization_scheme_param(authorization)
     if not authorization or scheme.lower() != "bearer":
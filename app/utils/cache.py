@@ -0,0 +1,194 @@
+import time
+import pickle
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+from typing import Any, Hashable, Callable, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    '''
+    Thread-safe LRU cache, every entry expires after `ttl` seconds.
+    `maxsize=0` disables the cache.
+    '''
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        '''
+        `ttl` overrides the default time to live for this entry
+        '''
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'size': len(self._data),
+            }
+
+'''
+    VERSIONED READ-THROUGH CACHE
+'''
+
+class CacheBackend:
+    '''
+    Interface of a cache store. An external cache (Redis, Memcached)
+    is plugged in by implementing these methods. Values are bytes.
+    '''
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+class LRUCache(CacheBackend):
+    '''
+    In-process backend, evicts least recently used entries
+    when the total size of values exceeds `max_bytes`
+    '''
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+class VersionedCache:
+    '''
+    Read-through cache where every namespace (a user) has a version.
+    The version is a part of every key, so bumping it invalidates all
+    entries of the namespace at once, old entries are evicted later.
+
+    A missing version is replaced by a new random one, so an evicted
+    version never brings back old entries.
+    '''
+    def __init__(self, backend: CacheBackend, ttl: float = 300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _version(self, namespace: str) -> str:
+        key = f'ver:{namespace}'
+        version = self.backend.get(key)
+        if version is None:
+            version = uuid4().hex.encode('ascii')
+            self.backend.set(key, version)
+        return version.decode('ascii')
+
+    def bump(self, namespace: str) -> None:
+        self.backend.set(f'ver:{namespace}', uuid4().hex.encode('ascii'))
+
+    def get_or_load(self, namespace: str, key: str, loader: Callable[[], Any]) -> Any:
+        full_key = f'{namespace}:{self._version(namespace)}:{key}'
+        data = self.backend.get(full_key)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            return pickle.loads(data)
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        self.backend.set(full_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.ttl)
+        return value
+
+    def clear(self) -> None:
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+        if isinstance(self.backend, LRUCache):
+            stats['bytes'] = self.backend.size
+        return stats
@@ -1,16 +1,101 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
 
+# bcrypt cost factor for new hashes, older hashes are rehashed on login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+# max number of hashes computed at once, bcrypt releases the GIL
+HASH_MAX_WORKERS = int(os.environ.get('HASH_MAX_WORKERS', os.cpu_count() or 2))
+
 # passwords
 def verify_password(plain_password: str, hashed_password: str):
     return bcrypt.checkpw(plain_password.encode('utf-8'), 
         hashed_password.encode('utf-8'))
 
-def get_password_hash(password: str):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())\
-        .decode('utf-8')
+def get_password_hash(password: str, rounds: int = None):
+    return bcrypt.hashpw(password.encode('utf-8'),
+        bcrypt.gensalt(rounds or BCRYPT_ROUNDS)).decode('utf-8')
+
+def needs_rehash(hashed_password: str) -> bool:
+    '''
+    True if the hash was made with a cost lower than `BCRYPT_ROUNDS`
+    '''
+    try:
+        rounds = int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds < BCRYPT_ROUNDS
+
+'''
+    HASHING POOL
+'''
+
+class _HashPool:
+    '''
+    Bounded thread pool for bcrypt, so hashing never runs on the event loop.
+    Tracks how many jobs are waiting and running.
+    '''
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='bcrypt')
+            return self._executor
+
+    def _run(self, func, *args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, func, *args):
+        executor = self._get_executor()
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self._run, func, *args)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queued': self.queued,
+                'running': self.running,
+                'max_queued': self.max_queued,
+                'completed': self.completed,
+            }
+
+_hash_pool = _HashPool(HASH_MAX_WORKERS)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _hash_pool.run(get_password_hash, password)
+
+def hash_pool_stats() -> dict:
+    return _hash_pool.stats()
 
 def filter_keyword(keyword: str):
     '''
     Prepare keywords for using it as unique name
     '''
-    return keyword.replace(' ', '_').lower()
\ No newline at end of file
+    return keyword.replace(' ', '_').lower()
@@ -0,0 +1,105 @@
+'''
+    Account export
+
+    Links are written as NDJSON or CSV, optionally gzipped, page by page.
+    When the size limit is reached the export ends with a `next_cursor`
+    trailer, the client continues the export from it.
+'''
+import io
+import os
+import csv
+import json
+import zlib
+from typing import AsyncIterator, Callable, List
+
+from ..models.link_mod import Link
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_FIELDS = ('created', 'title', 'url', 'icon', 'tags')
+
+def export_max_bytes(requested: int = None) -> int:
+    '''
+    Size limit of one export response, 0 means no limit.
+
+    `EXPORT_MAX_BYTES` sets the limit. Inside Lambda it's 4 MB by default,
+    so the response fits into 6 MB even after base64 encoding.
+    '''
+    default = 4 * 1024 * 1024 if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 0
+    limit = int(os.environ.get('EXPORT_MAX_BYTES', default))
+    if requested and requested > 0:
+        return min(requested, limit) if limit else requested
+    return limit
+
+class ExportWriter:
+    def __init__(self, file_format: str, compress: bool = False):
+        self.file_format = file_format
+        self._gzip = zlib.compressobj(wbits=31) if compress else None
+
+    def _encode(self, text: str) -> bytes:
+        data = text.encode('utf-8')
+        return self._gzip.compress(data) if self._gzip else data
+
+    def _csv_row(self, row) -> str:
+        buf = io.StringIO()
+        csv.writer(buf).writerow(row)
+        return buf.getvalue()
+
+    def header(self) -> str:
+        if self.file_format == 'csv':
+            return self._csv_row(CSV_FIELDS)
+        return ''
+
+    def link(self, link: Link) -> str:
+        if self.file_format == 'csv':
+            return self._csv_row([link.created, link.title, link.url,
+                link.icon, ','.join(link.tags)])
+        return link.json() + '\n'
+
+    def trailer(self, next_cursor: str) -> str:
+        if self.file_format == 'csv':
+            return f'# next_cursor={next_cursor}\n'
+        return json.dumps({'next_cursor': next_cursor}) + '\n'
+
+    def chunk(self, text: str) -> bytes:
+        '''
+        Encode text, with gzip the compressor is flushed,
+        so the client gets every chunk without waiting for the end
+        '''
+        data = self._encode(text)
+        if self._gzip:
+            data += self._gzip.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self) -> bytes:
+        return self._gzip.flush() if self._gzip else b''
+
+async def export_stream(pages: AsyncIterator[List[Link]], writer: ExportWriter,
+    max_bytes: int, cursor_of: Callable[[Link], str]) -> AsyncIterator[bytes]:
+    '''
+    Yield export chunks, one per page of links.
+    `cursor_of` builds the cursor which continues the export after the link.
+    `max_bytes` counts the UTF-8 bytes before compression.
+    '''
+    header = writer.header()
+    sent = len(header.encode('utf-8'))
+    yield writer.chunk(header)
+    try:
+        async for page in pages:
+            text = []
+            for link in page:
+                line = writer.link(link)
+                text.append(line)
+                # CSV keeps non-ASCII characters as they are
+                sent += len(line.encode('utf-8'))
+                if max_bytes and sent >= max_bytes:
+                    text.append(writer.trailer(cursor_of(link)))
+                    yield writer.chunk(''.join(text))
+                    yield writer.finish()
+                    return
+            yield writer.chunk(''.join(text))
+    finally:
+        await pages.aclose()
+    yield writer.finish()
@@ -0,0 +1,65 @@
+'''
+    Link ids
+
+    An id is the creation time in ISO format with microseconds,
+    a sequence number and a random tail, e.g.
+
+        2026-10-18T18:21:21.123456-00A7XK3QMZ
+
+    Ids sort as strings in the order they were made: by time, then by
+    the sequence, which counts ids made by the process within the same
+    microsecond (or while the clock is behind the last id). The random
+    tail keeps ids of different processes apart. Old ids with seconds
+    precision (`2023-01-13T10:32:24`) are a prefix of the new ids of
+    the same second, so they sort right before them.
+'''
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable
+
+# Crockford's base32, its characters are in ASCII order
+_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+SEQUENCE_CHARS = 3 # 32768 ids per microsecond
+RANDOM_CHARS = 6 # 30 bits
+
+# sorts after every id, appended to an `offset` it includes every id
+# starting with the offset
+ID_PREFIX_END = '\uffff'
+
+def _base32(value: int, width: int) -> str:
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, 32)
+        chars.append(_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+class LinkIdGenerator:
+    '''
+    Thread-safe, every id is greater than the previous one
+    '''
+    def __init__(self, clock: Callable[[], datetime] = datetime.utcnow):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last = None
+        self._sequence = 0
+
+    def __call__(self) -> str:
+        with self._lock:
+            now = self.clock()
+            if self._last is None or now > self._last:
+                self._last, self._sequence = now, 0
+            else:
+                self._sequence += 1
+                if self._sequence == 32 ** SEQUENCE_CHARS:
+                    # borrow the next microsecond
+                    self._last += timedelta(microseconds=1)
+                    self._sequence = 0
+            stamp, sequence = self._last, self._sequence
+        # os.urandom and not `random`: its state may be shared by
+        # processes forked or restored from the same snapshot
+        tail = int.from_bytes(os.urandom(4), 'big') >> (32 - 5 * RANDOM_CHARS)
+        return (f'{stamp.isoformat(timespec="microseconds")}-'
+            f'{_base32(sequence, SEQUENCE_CHARS)}{_base32(tail, RANDOM_CHARS)}')
+
+new_link_id = LinkIdGenerator()
@@ -0,0 +1,135 @@
+'''
+    Streaming parsers of link files for the bulk import
+
+    Every parser takes an iterable of bytes chunks and yields dicts
+    with `url`, `title` and `tags` as soon as they are parsed,
+    so a file is never loaded into memory at once.
+'''
+import csv
+import json
+import codecs
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, Optional
+
+FORMATS = ('json', 'csv', 'html')
+
+def _decode(chunks: Iterable[bytes]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def _split_tags(tags) -> list:
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    if not isinstance(tags, list):
+        return []
+    return [t.strip() for t in tags if isinstance(t, str) and t.strip()]
+
+def _record(url, title=None, tags=None) -> dict:
+    return {
+        'url': url.strip() if isinstance(url, str) else url,
+        'title': title.strip() if isinstance(title, str) and title.strip() else None,
+        'tags': _split_tags(tags),
+    }
+
+def iter_json(chunks: Iterable[bytes]) -> Iterator[dict]:
+    '''
+    JSON array of objects or NDJSON, object keys: `url`, `title`, `tags`
+    '''
+    decoder = json.JSONDecoder()
+    buf = ''
+    for text in _decode(chunks):
+        buf += text
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n[],':
+                pos += 1
+            if pos >= len(buf):
+                break
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break # the object isn't complete yet, wait for the next chunk
+            pos = end
+            if isinstance(obj, dict):
+                yield _record(obj.get('url'), obj.get('title'), obj.get('tags'))
+            else:
+                yield _record(None)
+        buf = buf[pos:]
+    if buf.strip(' \t\r\n[],'):
+        raise ValueError('Broken JSON at the end of the file')
+
+def _lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    buf = ''
+    for text in _decode(chunks):
+        buf += text
+        *lines, buf = buf.split('\n')
+        for line in lines:
+            yield line + '\n'
+    if buf:
+        yield buf
+
+def iter_csv(chunks: Iterable[bytes]) -> Iterator[dict]:
+    '''
+    CSV with a header row, columns: `url`, `title`, `tags` (comma separated)
+    '''
+    for row in csv.DictReader(_lines(chunks)):
+        yield _record(row.get('url'), row.get('title'), row.get('tags'))
+
+class _BookmarkParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        self._link: Optional[dict] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            attrs = dict(attrs)
+            self._link = {'url': attrs.get('href'), 'tags': attrs.get('tags'), 'title': ''}
+
+    def handle_data(self, data):
+        if self._link is not None:
+            self._link['title'] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            self.records.append(_record(**self._link))
+            self._link = None
+
+def iter_netscape(chunks: Iterable[bytes]) -> Iterator[dict]:
+    '''
+    Netscape bookmark file exported by browsers, <A HREF=... TAGS=...>title</A>
+    '''
+    parser = _BookmarkParser()
+    for text in _decode(chunks):
+        parser.feed(text)
+        yield from parser.records
+        parser.records.clear()
+    parser.close()
+    yield from parser.records
+
+PARSERS = {
+    'json': iter_json,
+    'csv': iter_csv,
+    'html': iter_netscape,
+}
+
+def detect_format(filename: str) -> Optional[str]:
+    ext = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return {
+        'json': 'json', 'ndjson': 'json', 'jsonl': 'json',
+        'csv': 'csv',
+        'html': 'html', 'htm': 'html',
+    }.get(ext)
+
+def iter_file_chunks(file, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
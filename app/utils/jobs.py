@@ -0,0 +1,94 @@
+'''
+    Background jobs
+
+    On Lambda an invocation lasts until the app is done with the request:
+    Mangum runs the event loop until BackgroundTasks finish, so work left
+    for after the response still delays it. There a job runs in an
+    invocation of its own, the function invokes itself asynchronously
+    (InvocationType=Event) with `{"job": name, "args": {...}}` and
+    `app.main.handler` passes such events to `handle`. Elsewhere (uvicorn)
+    jobs are BackgroundTasks, which do run after the response.
+
+    A job is called with its args and `deadline` (time.monotonic(), None
+    outside Lambda). A job which stopped at the deadline with work left
+    returns `CONTINUE` and is invoked again.
+
+    `JOBS_FUNCTION_NAME` - the function to invoke, the running one by default.
+    Its role needs `lambda:InvokeFunction` on that function.
+'''
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# stop a bit before the Lambda timeout
+LAMBDA_SAFETY_SECONDS = 5
+CONTINUE = 'continue'
+
+_jobs = {}
+_lambda_client = None
+
+def job(name: str):
+    '''
+    Register the decorated function (sync or async) as the job `name`
+    '''
+    def register(func):
+        _jobs[name] = func
+        return func
+    return register
+
+def _function_name() -> Optional[str]:
+    return os.environ.get('JOBS_FUNCTION_NAME') or\
+        os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+def _invoke(function: str, event: dict) -> None:
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client('lambda')
+    _lambda_client.invoke(FunctionName=function, InvocationType='Event',
+        Payload=json.dumps(event).encode('utf-8'))
+
+async def submit(background_tasks: BackgroundTasks, name: str, **args) -> None:
+    '''
+    Run the job after the response: in a new invocation on Lambda,
+    as a background task elsewhere. `args` must be JSON serializable.
+    '''
+    if name not in _jobs:
+        raise ValueError(f'Unknown job `{name}`')
+    function = _function_name()
+    if function is None:
+        background_tasks.add_task(_jobs[name], **args)
+        return
+    await run_in_threadpool(_invoke, function, {'job': name, 'args': args})
+
+def is_job(event) -> bool:
+    return isinstance(event, dict) and 'job' in event
+
+def handle(event: dict, context) -> dict:
+    '''
+    Run the job of a self-invocation
+    '''
+    name = event['job']
+    deadline = time.monotonic() +\
+        context.get_remaining_time_in_millis() / 1000 - LAMBDA_SAFETY_SECONDS
+    result = _jobs[name](deadline=deadline, **event.get('args', {}))
+    if asyncio.iscoroutine(result):
+        # the loop Mangum runs requests on, clients made for it are reused
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        result = loop.run_until_complete(result)
+    if result == CONTINUE:
+        _invoke(_function_name(), event)
+        logger.info('job %s continues in a new invocation', name)
+    return {'job': name, 'status': result if result == CONTINUE else 'done'}
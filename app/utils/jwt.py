@@ -1,7 +1,16 @@
-from jose import jwt, JWTError
 from typing import Union, Any, Tuple
 from datetime import datetime, timedelta
 import os
+import time
+import hashlib
+import logging
+
+# jose (with the cryptography backends) is imported where it's used,
+# so importing the app stays fast; app.main.warmup preloads it on Lambda
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 JWT_REFRESH_SECRET_KEY = os.getenv('JWT_REFRESH_SECRET_KEY')
@@ -9,36 +18,66 @@ ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 7 days
 
+# Already verified tokens, an entry lives until the token expires
+_verified_cache = TTLCache(maxsize=int(os.getenv('JWT_CACHE_SIZE', 4096)), ttl=0)
 
-def create_access_token(subject: Union[str, Any], expires_mins: int = None) -> Tuple[str, datetime]:
+
+def create_access_token(subject: Union[str, Any], expires_mins: int = None,
+    claims: dict = None) -> Tuple[str, datetime]:
     if expires_mins is not None:
         exp_delta = datetime.utcnow() + timedelta(minutes=expires_mins)
     else:
         exp_delta = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode = {"exp": exp_delta, "sub": str(subject)}
+    to_encode = {**(claims or {}), "exp": exp_delta, "sub": str(subject)}
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
     return encoded_jwt, exp_delta
 
-def create_refresh_token(subject: Union[str, Any], expires_mins: int = None) -> Tuple[str, datetime]:
+def create_refresh_token(subject: Union[str, Any], expires_mins: int = None,
+    claims: dict = None) -> Tuple[str, datetime]:
     if expires_mins is not None:
         expires_delta = datetime.utcnow() + timedelta(minutes=expires_mins)
     else:
         expires_delta = datetime.utcnow() + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
     
-    to_encode = {"exp": expires_delta, "sub": str(subject)}
-    print('encode name', str(subject), 'to refresh token')
+    to_encode = {**(claims or {}), "exp": expires_delta, "sub": str(subject)}
+    logger.debug('refresh token issued', extra={'fields': {'user': str(subject)}})
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, JWT_REFRESH_SECRET_KEY, ALGORITHM)
     return encoded_jwt, expires_delta
 
+def user_claims(user) -> dict:
+    '''
+    Claims which let to authenticate the user without reading it from db
+    '''
+    return {"ver": user.token_version, "email": user.email}
+
+def _cache_key(token: str, key: str) -> bytes:
+    # the secret is a part of the key, so rotated keys don't hit old entries
+    return hashlib.sha256(f'{key}:{token}'.encode('utf-8')).digest()
+
 def decode_subject(token: str, refresh=False) -> dict:
     '''
     return empty dict upon JWT decode error
+
+    Verified tokens are cached until their `exp`,
+    so repeated tokens skip the signature check
     '''
     key = JWT_REFRESH_SECRET_KEY if refresh else JWT_SECRET_KEY
+    cache_key = _cache_key(token, key)
+    res = _verified_cache.get(cache_key)
+    if res is not None and res['exp'] > time.time():
+        return dict(res)
+    from jose import jwt, JWTError
     try:
         res = jwt.decode(token, key, algorithms=[ALGORITHM])
     except JWTError as e:
-        print('JWTError:', e)
-        res = {}
-    return res
\ No newline at end of file
+        logger.info('token rejected: %s', e)
+        return {}
+    if isinstance(res.get('exp'), (int, float)):
+        _verified_cache.set(cache_key, res, ttl=res['exp'] - time.time())
+    return dict(res)
+
+def jwt_cache_stats() -> dict:
+    return _verified_cache.stats()
\ No newline at end of file
@@ -0,0 +1,288 @@
+'''
+    Logging pipeline of the app
+
+    Records of the `app` loggers go through a bounded queue to a
+    listener thread, which redacts secrets, formats them (JSON lines
+    by default) and writes them to stdout. The request thread only
+    puts the record in the queue: it never waits for I/O, and records
+    are dropped (and counted) when the queue is full.
+
+    Every record gets `request_id` of the request it was logged for,
+    `RequestIdMiddleware` sets it from `X-Request-ID`, the Lambda
+    request id or a new one.
+
+    `LOG_LEVEL` - level of the `app` loggers (INFO)
+    `LOG_FORMAT` - `json` or `text` (json)
+    `LOG_SAMPLE` - keep only a share of records of noisy loggers,
+      e.g. `app.utils.jwt=0.01,app.api=0.5`; warnings and errors are
+      always kept
+    `LOG_QUEUE_SIZE` - max number of records waiting for the writer (10000)
+'''
+import os
+import re
+import sys
+import copy
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+import threading
+import contextvars
+from uuid import uuid4
+from typing import Dict, Optional, TextIO
+
+"""
+    REQUEST ID
+"""
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def set_request_id(request_id: Optional[str]):
+    '''
+    Returns the token for `_request_id.reset`
+    '''
+    return _request_id.set(request_id)
+
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+class RequestIdMiddleware:
+    '''
+    ASGI middleware: takes the request id from `X-Request-ID` (if it
+    looks sane) or the Lambda context, or makes a new one, and returns
+    it in the `X-Request-ID` response header
+    '''
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request_id = None
+        for name, value in scope.get('headers', []):
+            if name == b'x-request-id':
+                value = value.decode('latin-1')
+                if _VALID_REQUEST_ID.match(value):
+                    request_id = value
+                break
+        if request_id is None:
+            context = scope.get('aws.context')
+            request_id = getattr(context, 'aws_request_id', None) or uuid4().hex
+        header = (b'x-request-id', request_id.encode('latin-1'))
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [header]
+            await send(message)
+
+        token = _request_id.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_id.reset(token)
+
+"""
+    REDACTION
+"""
+
+REDACTED = '[REDACTED]'
+_SECRET_NAME = re.compile(r'pass(word|wd)?|secret|token|authorization|cookie|api[_-]?key',
+    re.IGNORECASE)
+_SECRET_PATTERNS = (
+    # JWTs wherever they are
+    (re.compile(r'eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*'), REDACTED),
+    (re.compile(r'(?i)\b(bearer\s+)[A-Za-z0-9._~+/-]+=*'), r'\1' + REDACTED),
+    # password=..., "token": "..."
+    (re.compile(r'''(?i)\b((?:pass(?:word|wd)?|secret|[a-z_]*token|api[_-]?key)["']?\s*[:=]\s*["']?)[^\s"',;&]+'''),
+        r'\1' + REDACTED),
+)
+
+def redact(text: str) -> str:
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def redact_fields(fields: dict) -> dict:
+    return {key: REDACTED if _SECRET_NAME.search(key) else
+        redact(value) if isinstance(value, str) else value
+        for key, value in fields.items()}
+
+"""
+    FORMATTERS
+"""
+
+class JsonFormatter(logging.Formatter):
+    '''
+    One JSON object per line: time, level, logger, message, request_id
+    and the `fields` dict passed as `extra={'fields': {...}}`
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) +
+                f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(redact_fields(fields))
+        if record.exc_info:
+            entry['exception'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, 'request_id', None) or '-'
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f'{k}={v}' for k, v in redact_fields(fields).items())
+        return redact(text)
+
+"""
+    SAMPLING AND QUEUE
+"""
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    '''
+    `app.utils.jwt=0.01,app.api=0.5` -> {logger prefix: share of records kept}
+    '''
+    rates = {}
+    for part in filter(None, (p.strip() for p in (spec or '').split(','))):
+        name, _, rate = part.partition('=')
+        rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+class SamplingFilter(logging.Filter):
+    '''
+    Keeps a share of records below WARNING of the configured loggers
+    and their children, the longest matching name wins
+    '''
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            matches = [prefix for prefix in self.rates
+                if name == prefix or name.startswith(prefix + '.')]
+            rate = self.rates[max(matches, key=len)] if matches else 1.0
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Puts records in the queue without waiting, counts dropped records.
+    The message is rendered here (args may change later) and the
+    request id is taken from the caller's context, formatting and
+    redaction are left to the listener thread.
+    '''
+    def __init__(self, queue: queue.Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = _request_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+"""
+    SETUP
+"""
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+
+def configure(stream: TextIO = None, level: str = None, fmt: str = None,
+    sample: str = None, queue_size: int = None, blocking: bool = False) -> logging.Handler:
+    '''
+    (Re)configure the `app` loggers, arguments default to the environment.
+    With `blocking` records are written by the calling thread, without
+    the queue (used by the benchmark to compare).
+    '''
+    global _listener, _handler
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'json')
+    sample = os.environ.get('LOG_SAMPLE', '') if sample is None else sample
+    queue_size = queue_size or int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    with _lock:
+        shutdown()
+        if blocking:
+            handler = writer
+            handler.addFilter(lambda record: setattr(record, 'request_id',
+                _request_id.get()) or True)
+        else:
+            handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+            _listener = logging.handlers.QueueListener(handler.queue, writer)
+            _listener.start()
+        handler.addFilter(SamplingFilter(parse_sample_rates(sample)))
+        logger = logging.getLogger('app')
+        for old in list(logger.handlers):
+            logger.removeHandler(old)
+        logger.addHandler(handler)
+        logger.setLevel(level.upper())
+        logger.propagate = False
+        _handler = handler
+    return handler
+
+def setup_logging() -> logging.Handler:
+    '''
+    Configure from the environment once per process
+    '''
+    return _handler or configure()
+
+def flush(timeout: float = 1.0) -> None:
+    '''
+    Wait until queued records are written, Lambda may freeze
+    the process right after the invocation
+    '''
+    if _listener is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _listener.queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+def shutdown() -> None:
+    '''
+    Write the queued records and stop the listener thread
+    '''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def dropped_records() -> int:
+    return getattr(_handler, 'dropped', 0)
+
+atexit.register(shutdown)
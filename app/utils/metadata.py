@@ -0,0 +1,255 @@
+'''
+    Link metadata: title, favicon and canonical url of a page
+
+    Pages are fetched with httpx.AsyncClient under a global concurrency
+    limit, requests to the same host are spaced by `ENRICH_HOST_INTERVAL`.
+    The host is resolved once: the addresses are checked and the client
+    connects to them, with the host name in the Host header and SNI.
+    Results are cached by canonical url and favicons by host, so popular
+    pages are fetched once for all users.
+'''
+import os
+import time
+import importlib.util
+import socket
+import asyncio
+import ipaddress
+import threading
+import urllib.parse
+import weakref
+from html.parser import HTMLParser
+from typing import List, Optional
+
+from .cache import TTLCache
+from .urls import canonical_url
+
+ENRICH_MAX_CONCURRENCY = int(os.environ.get('ENRICH_MAX_CONCURRENCY', 8))
+ENRICH_HOST_INTERVAL = float(os.environ.get('ENRICH_HOST_INTERVAL', 1.0)) # seconds
+ENRICH_TIMEOUT = float(os.environ.get('ENRICH_TIMEOUT', 5.0)) # seconds
+ENRICH_MAX_BYTES = 256 * 1024 # of a page, the head is enough
+ENRICH_MAX_REDIRECTS = 5
+ENRICH_FAILURE_TTL = 600 # seconds to remember a failed fetch
+# fetching private addresses is off, so users can't probe the internal network
+ENRICH_ALLOW_PRIVATE = os.environ.get('ENRICH_ALLOW_PRIVATE') == '1'
+# httpx (with httpcore and anyio) is imported on the first fetch,
+# it's a big part of the cold start and most invocations don't fetch
+HTTPX_INSTALLED = importlib.util.find_spec('httpx') is not None
+USER_AGENT = 'link-manager/1.0 (+metadata fetcher)'
+
+_MISSING = object()
+
+_page_cache = TTLCache(
+    maxsize=int(os.environ.get('METADATA_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('METADATA_CACHE_TTL', 24 * 3600)),
+)
+_icon_cache = TTLCache(
+    maxsize=int(os.environ.get('METADATA_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('METADATA_CACHE_TTL', 24 * 3600)),
+)
+
+def enrich_enabled() -> bool:
+    return os.environ.get('ENRICH_LINKS', '1') == '1' and HTTPX_INSTALLED
+
+def clear_metadata_caches() -> None:
+    _page_cache.clear()
+    _icon_cache.clear()
+
+class _HeadParser(HTMLParser):
+    '''
+    Collects <title>, og:title, icon and canonical links, stops at <body>
+    '''
+    ICON_RELS = ('icon', 'shortcut icon', 'apple-touch-icon')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title, self.og_title, self.icon, self.canonical = None, None, None, None
+        self._in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or '' for name, value in attrs}
+        if tag == 'title' and self.title is None:
+            self._in_title = True
+            self.title = ''
+        elif tag == 'meta' and attrs.get('property') == 'og:title':
+            self.og_title = attrs.get('content') or None
+        elif tag == 'link':
+            rel = attrs.get('rel', '').lower().strip()
+            if rel in self.ICON_RELS and attrs.get('href') and\
+                (self.icon is None or rel != 'apple-touch-icon'):
+                self.icon = attrs['href']
+            elif rel == 'canonical' and attrs.get('href'):
+                self.canonical = attrs['href']
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+
+def parse_metadata(html: str, base_url: str) -> dict:
+    '''
+    Title, icon and canonical url of the page, urls are made absolute
+    '''
+    parser = _HeadParser()
+    for i in range(0, len(html), 8192):
+        parser.feed(html[i:i + 8192])
+        if parser.done:
+            break
+    title = ' '.join((parser.title or parser.og_title or '').split()) or None
+    join = lambda href: urllib.parse.urljoin(base_url, href.strip()) if href else None
+    return {'title': title, 'icon': join(parser.icon),
+        'canonical': join(parser.canonical)}
+
+def _is_public(address: str) -> bool:
+    try:
+        return ipaddress.ip_address(address).is_global
+    except ValueError: # e.g. IPv6 with a scope
+        return False
+
+async def _resolve(host: str, port: int) -> List[str]:
+    '''
+    Addresses to connect to, none if the host can't be resolved or
+    (unless ENRICH_ALLOW_PRIVATE) any of its addresses isn't public
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError:
+        return []
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    if not ENRICH_ALLOW_PRIVATE and not all(map(_is_public, addresses)):
+        return []
+    return addresses
+
+def _pinned_url(parts: urllib.parse.SplitResult, address: str, port: int) -> str:
+    host = f'[{address}]' if ':' in address else address
+    return urllib.parse.urlunsplit((parts.scheme, f'{host}:{port}', parts.path or '/',
+        parts.query, ''))
+
+class MetadataFetcher:
+    '''
+    Fetches page metadata with bounded concurrency and per-host spacing.
+    One instance is shared by the process; the client and the semaphore
+    are made per event loop, as they can't be shared between loops.
+    '''
+    def __init__(self, max_concurrency: int = ENRICH_MAX_CONCURRENCY,
+        host_interval: float = ENRICH_HOST_INTERVAL):
+        self.max_concurrency = max_concurrency
+        self.host_interval = host_interval
+        self._loops = weakref.WeakKeyDictionary()
+        self._host_next = {}
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            import httpx
+            client = httpx.AsyncClient(timeout=ENRICH_TIMEOUT,
+                headers={'User-Agent': USER_AGENT, 'Accept': 'text/html'})
+            state = self._loops[loop] = (client,
+                asyncio.Semaphore(self.max_concurrency), {})
+        return state
+
+    async def _wait_for_host(self, host: str):
+        # reserve the next free slot of the host, then sleep until it
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._host_next.get(host, 0))
+            self._host_next[host] = start + self.host_interval
+            if len(self._host_next) > 4096:
+                self._host_next = {h: t for h, t in self._host_next.items() if t > now}
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _get(self, client, url: str, addresses: List[str]):
+        '''
+        Open the response from the first address that accepts the connection
+        '''
+        import httpx
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        host = parts.hostname if parts.port is None else f'{parts.hostname}:{parts.port}'
+        for i, address in enumerate(addresses):
+            request = client.build_request('GET', _pinned_url(parts, address, port),
+                headers={'Host': host}, extensions={'sni_hostname': parts.hostname})
+            try:
+                return await client.send(request, stream=True)
+            except httpx.ConnectError:
+                if i == len(addresses) - 1:
+                    raise
+
+    async def _fetch(self, url: str) -> Optional[dict]:
+        import httpx
+        client, semaphore, _ = self._loop_state()
+        # redirects are followed here, every hop is checked
+        for _ in range(ENRICH_MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.hostname:
+                return None
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            addresses = await _resolve(parts.hostname, port)
+            if not addresses:
+                return None
+            # wait for the host before taking a slot, a slow host
+            # doesn't hold back the others
+            await self._wait_for_host(parts.hostname)
+            async with semaphore:
+                self.fetches += 1
+                try:
+                    resp = await self._get(client, url, addresses)
+                    try:
+                        if resp.is_redirect:
+                            url = urllib.parse.urljoin(url, resp.headers['location'])
+                            continue
+                        if resp.status_code != 200 or 'html' not in\
+                            resp.headers.get('content-type', 'text/html'):
+                            return None
+                        body = b''
+                        async for chunk in resp.aiter_bytes():
+                            body += chunk
+                            if len(body) >= ENRICH_MAX_BYTES:
+                                break
+                        html = body.decode(resp.encoding or 'utf-8', errors='replace')
+                        return parse_metadata(html, url)
+                    finally:
+                        await resp.aclose()
+                except (httpx.HTTPError, LookupError):
+                    return None
+        return None
+
+    async def fetch(self, url: str) -> Optional[dict]:
+        '''
+        Metadata of the page or None if it can't be fetched.
+        A page without an icon gets the icon known for its host or
+        `/favicon.ico`.
+        '''
+        key = canonical_url(url)
+        meta = _page_cache.get(key, _MISSING)
+        if meta is _MISSING:
+            # concurrent requests for the same page share one fetch
+            inflight = self._loop_state()[2]
+            task = inflight.get(key)
+            if task is None:
+                task = inflight[key] = asyncio.ensure_future(self._fetch(url))
+                task.add_done_callback(lambda _: inflight.pop(key, None))
+            meta = await asyncio.shield(task)
+            _page_cache.set(key, meta, None if meta else ENRICH_FAILURE_TTL)
+        if meta is None:
+            return None
+        meta = dict(meta)
+        host = urllib.parse.urlsplit(key).netloc
+        if meta['icon']:
+            _icon_cache.set(host, meta['icon'])
+        else:
+            meta['icon'] = _icon_cache.get(host) or\
+                urllib.parse.urljoin(key, '/favicon.ico')
+        return meta
+
+fetcher = MetadataFetcher()
@@ -0,0 +1,368 @@
+'''
+    Request and DynamoDB metrics in Prometheus text format
+
+    `MetricsMiddleware` tracks every request in a context variable, the
+    botocore hooks installed by `instrument_client` add the DynamoDB
+    calls made for it: count and latency per operation and consumed
+    capacity, which is asked for with ReturnConsumedCapacity. Totals are
+    kept per route and per user. The caches, the bcrypt pool and the
+    logging queue are read when the metrics are rendered. On Lambda the
+    numbers are per execution environment.
+
+    `METRICS_ENABLED` - `1` or `0` (1)
+    `METRICS_CONSUMED_CAPACITY` - ask DynamoDB for consumed capacity (1)
+    `METRICS_SERVER_TIMING` - add the `Server-Timing` header to responses (0)
+    `METRICS_MAX_USERS` - users with their own label, others are `other` (1000)
+'''
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import Counter as _Counter
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_CONSUMED_CAPACITY = os.environ.get('METRICS_CONSUMED_CAPACITY', '1') == '1'
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '0') == '1'
+METRICS_MAX_USERS = int(os.environ.get('METRICS_MAX_USERS', 1000))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALLS_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+READ_OPERATIONS = {'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'}
+
+"""
+    METRIC TYPES
+"""
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    '''
+    Thread-safe counter with labels
+    '''
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+
+class Histogram:
+    '''
+    Thread-safe histogram with fixed buckets and labels
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._values = {} # labels -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *labels: str) -> int:
+        return sum(self._values.get(labels, [0, 0])[:-1])
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        names = self.labels + ('le',)
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                yield f'{self.name}_bucket{_format_labels(names, labels + (le,))} {total}'
+            yield f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(counts[-1])}'
+            yield f'{self.name}_count{_format_labels(self.labels, labels)} {total}'
+
+class Gauge:
+    '''
+    Values read from elsewhere when the metrics are rendered, `collect`
+    returns {labels: value}. Totals kept by others are exported with
+    kind='counter'.
+    '''
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+        collect: Callable[[], Dict[Tuple[str, ...], float]] = dict, kind: str = 'gauge'):
+        self.name, self.help, self.labels = name, help, labels
+        self.collect = collect
+        self.kind = kind
+
+    def lines(self) -> Iterator[str]:
+        for labels, value in sorted(self.collect().items()):
+            yield f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+
+REGISTRY = []
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render() -> str:
+    '''
+    All metrics in Prometheus text format
+    '''
+    out = []
+    for metric in REGISTRY:
+        out.append(f'# HELP {metric.name} {metric.help}')
+        out.append(f'# TYPE {metric.name} {metric.kind}')
+        out.extend(metric.lines())
+    return '\n'.join(out) + '\n'
+
+"""
+    METRICS
+"""
+
+http_requests = _register(Counter('http_requests_total',
+    'HTTP requests', ('method', 'route', 'status')))
+http_duration = _register(Histogram('http_request_duration_seconds',
+    'HTTP request duration', ('route',)))
+db_calls = _register(Counter('dynamodb_calls_total',
+    'DynamoDB API calls', ('operation',)))
+db_errors = _register(Counter('dynamodb_errors_total',
+    'Failed DynamoDB API calls', ('operation', 'code')))
+db_duration = _register(Histogram('dynamodb_call_duration_seconds',
+    'DynamoDB API call duration with retries', ('operation',)))
+db_calls_per_request = _register(Histogram('dynamodb_calls_per_request',
+    'DynamoDB API calls made for one HTTP request', ('route',), CALLS_BUCKETS))
+route_capacity = _register(Counter('dynamodb_route_consumed_capacity_total',
+    'Consumed capacity units per route, kind is read (RCU) or write (WCU)',
+    ('route', 'kind')))
+user_capacity = _register(Counter('dynamodb_user_consumed_capacity_total',
+    'Consumed capacity units per user, kind is read (RCU) or write (WCU)',
+    ('user', 'kind')))
+
+# read at render time, the modules are imported here as app.db imports this one
+
+def _cache_stats() -> Dict[str, dict]:
+    from .. import db
+    from .jwt import jwt_cache_stats
+    return dict(db.user_cache_stats(), jwt=jwt_cache_stats(), link=db.link_cache_stats())
+
+def _cache_values(stat: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    return lambda: {(cache,): stats[stat] for cache, stats in _cache_stats().items()
+        if stat in stats}
+
+def _hash_pool_value(stat: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def collect():
+        from .crypto import hash_pool_stats
+        return {(): hash_pool_stats()[stat]}
+    return collect
+
+def _hash_pool_tasks() -> Dict[Tuple[str, ...], float]:
+    from .crypto import hash_pool_stats
+    pool = hash_pool_stats()
+    return {('queued',): pool['queued'], ('running',): pool['running']}
+
+def _dropped_records() -> Dict[Tuple[str, ...], float]:
+    from .log import dropped_records
+    return {(): dropped_records()}
+
+_register(Gauge('cache_hits_total', 'Cache hits', ('cache',),
+    _cache_values('hits'), kind='counter'))
+_register(Gauge('cache_misses_total', 'Cache misses', ('cache',),
+    _cache_values('misses'), kind='counter'))
+_register(Gauge('cache_entries', 'Entries in the cache', ('cache',), _cache_values('size')))
+_register(Gauge('cache_bytes', 'Size of the cached values', ('cache',), _cache_values('bytes')))
+_register(Gauge('hash_pool_workers', 'Threads of the bcrypt pool', (),
+    _hash_pool_value('workers')))
+_register(Gauge('hash_pool_tasks', 'bcrypt tasks waiting or running', ('state',),
+    _hash_pool_tasks))
+_register(Gauge('hash_pool_max_queued', 'Most bcrypt tasks waiting at once', (),
+    _hash_pool_value('max_queued')))
+_register(Gauge('hash_pool_completed_total', 'Completed bcrypt tasks', (),
+    _hash_pool_value('completed'), kind='counter'))
+_register(Gauge('log_dropped_records_total', 'Log records dropped as the queue was full',
+    (), _dropped_records, kind='counter'))
+
+"""
+    REQUEST TRACKING
+"""
+
+class RequestMetrics:
+    '''
+    DynamoDB usage of one request, shared by the threads working for it
+    '''
+    __slots__ = ('user', 'calls', 'db_time', 'rcu', 'wcu', '_lock')
+
+    def __init__(self):
+        self.user = None
+        self.calls = _Counter()
+        self.db_time = 0.0
+        self.rcu = 0.0
+        self.wcu = 0.0
+        self._lock = threading.Lock()
+
+    def add_call(self, operation: str, duration: float, rcu: float, wcu: float) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+            self.db_time += duration
+            self.rcu += rcu
+            self.wcu += wcu
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+def current_request() -> Optional[RequestMetrics]:
+    return _current.get()
+
+def set_request_user(username: str) -> None:
+    request = _current.get()
+    if request is not None:
+        request.user = username
+
+_known_users = set()
+_known_users_lock = threading.Lock()
+
+def _user_label(username: Optional[str]) -> str:
+    if username is None:
+        return 'anonymous'
+    with _known_users_lock:
+        if username in _known_users:
+            return username
+        if len(_known_users) < METRICS_MAX_USERS:
+            _known_users.add(username)
+            return username
+    return 'other'
+
+def _capacity(operation: str, parsed: dict) -> Tuple[float, float]:
+    # (RCU, WCU) of a response
+    consumed = parsed.get('ConsumedCapacity') or []
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    rcu = wcu = 0.0
+    for entry in consumed:
+        if 'ReadCapacityUnits' in entry or 'WriteCapacityUnits' in entry:
+            rcu += entry.get('ReadCapacityUnits', 0)
+            wcu += entry.get('WriteCapacityUnits', 0)
+        elif operation in READ_OPERATIONS:
+            rcu += entry.get('CapacityUnits', 0)
+        else:
+            wcu += entry.get('CapacityUnits', 0)
+    return rcu, wcu
+
+"""
+    BOTOCORE HOOKS
+"""
+
+def _before_parameter_build(params, model, **kwargs):
+    if METRICS_CONSUMED_CAPACITY and 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+def _before_call(model, context, **kwargs):
+    context['metrics_start'] = time.perf_counter()
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    duration = time.perf_counter() - context.get('metrics_start', time.perf_counter())
+    operation = model.name
+    db_calls.inc(operation)
+    db_duration.observe(duration, operation)
+    if 'Error' in parsed:
+        db_errors.inc(operation, parsed['Error'].get('Code', 'Unknown'))
+    request = _current.get()
+    if request is not None:
+        request.add_call(operation, duration, *_capacity(operation, parsed))
+
+def _after_call_error(exception, context, event_name, **kwargs):
+    # botocore passes no model here, the event name ends with the operation
+    operation = event_name.rsplit('.', 1)[-1]
+    db_calls.inc(operation)
+    db_errors.inc(operation, type(exception).__name__)
+    request = _current.get()
+    if request is not None:
+        duration = time.perf_counter() - context.get('metrics_start', time.perf_counter())
+        request.add_call(operation, duration, 0.0, 0.0)
+
+def instrument_client(client) -> None:
+    '''
+    Record calls of a DynamoDB client
+    '''
+    if not METRICS_ENABLED:
+        return
+    events = client.meta.events
+    events.register('before-parameter-build.dynamodb', _before_parameter_build)
+    events.register('before-call.dynamodb', _before_call)
+    events.register('after-call.dynamodb', _after_call)
+    events.register('after-call-error.dynamodb', _after_call_error)
+
+"""
+    MIDDLEWARE
+"""
+
+def _server_timing(request: RequestMetrics, elapsed: float) -> str:
+    calls = sum(request.calls.values())
+    return (f'db;dur={request.db_time * 1e3:.1f};desc="{calls} calls", '
+        f'app;dur={elapsed * 1e3:.1f}')
+
+class MetricsMiddleware:
+    '''
+    ASGI middleware recording every HTTP request with its DynamoDB usage
+    '''
+    def __init__(self, app, server_timing: bool = None):
+        self.app = app
+        self.server_timing = METRICS_SERVER_TIMING if server_timing is None else server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request = RequestMetrics()
+        token = _current.set(request)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.server_timing:
+                    value = _server_timing(request, time.perf_counter() - start)
+                    message['headers'] = list(message.get('headers', [])) +\
+                        [(b'server-timing', value.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = scope.get('route')
+            # the route template keeps the number of label values small
+            route = getattr(route, 'path', None) or 'unmatched'
+            http_requests.inc(scope['method'], route, str(status))
+            http_duration.observe(time.perf_counter() - start, route)
+            db_calls_per_request.observe(sum(request.calls.values()), route)
+            user = _user_label(request.user)
+            for kind, units in (('read', request.rcu), ('write', request.wcu)):
+                if units:
+                    route_capacity.inc(route, kind, value=units)
+                    user_capacity.inc(user, kind, value=units)
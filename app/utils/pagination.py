@@ -0,0 +1,24 @@
+import json
+import base64
+import binascii
+
+def encode_cursor(key: dict) -> str:
+    '''
+    Pack DynamoDB `LastEvaluatedKey` into an opaque url-safe token
+    '''
+    raw = json.dumps(key, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> dict:
+    '''
+    Unpack a token made by `encode_cursor`, raise ValueError if it's broken
+    '''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as err:
+        raise ValueError('Invalid cursor') from err
+    if not isinstance(key, dict) or\
+        not all(isinstance(v, str) for v in key.values()):
+        raise ValueError('Invalid cursor')
+    return key
@@ -0,0 +1,69 @@
+'''
+    Fast path from DynamoDB items to response JSON
+
+    Items read from our own table are trusted, so they skip pydantic:
+    an adapter made once per field set picks the Link fields with
+    their defaults, and the encoder (orjson if installed) turns
+    Decimal and set values into JSON types. Input is still validated
+    by the models.
+'''
+import json
+import functools
+from decimal import Decimal
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+try:
+    import orjson
+except:
+    pass
+
+from starlette.responses import Response
+
+from ..models.link_mod import Link, LINK_FIELDS
+
+def _default(value: Any) -> Any:
+    # the types boto3 gives that JSON doesn't have
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+if 'orjson' in globals():
+    def json_dumps(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False,
+        separators=(',', ':'))
+
+    def json_dumps(value: Any) -> bytes:
+        return _encoder.encode(value).encode('utf-8')
+
+@functools.lru_cache(maxsize=None)
+def link_adapter(fields: Optional[Tuple[str, ...]] = None) -> Callable[[dict], dict]:
+    '''
+    Function making a response dict of a DynamoDB link item:
+    only `fields` (all Link fields by default), missing ones get
+    the model defaults
+    '''
+    # get_default copies mutable defaults, items don't share a `tags` list
+    model_fields = tuple((name, Link.__fields__[name]) for name in fields or LINK_FIELDS)
+
+    def adapt(item: dict) -> dict:
+        return {name: item[name] if name in item else field.get_default()
+            for name, field in model_fields}
+    return adapt
+
+class FastJSONResponse(Response):
+    '''
+    JSON response of already plain data, rendered with `json_dumps`
+    '''
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+def ndjson_lines(items: Iterable[dict]) -> bytes:
+    return b''.join(json_dumps(item) + b'\n' for item in items)
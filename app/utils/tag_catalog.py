@@ -0,0 +1,55 @@
+'''
+    In-memory tag catalog for listing and autocomplete
+'''
+import heapq
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+class TagCatalog:
+    '''
+    Tags of a user with their link counts.
+
+    Names are kept sorted, so the tags starting with a prefix are a
+    contiguous slice found by two binary searches. Two flat lists
+    stay small and pickle quickly in the link cache.
+    '''
+    __slots__ = ('names', 'counts')
+
+    def __init__(self, counts: Dict[str, int]):
+        self.names = sorted(tag for tag, count in counts.items() if count > 0)
+        self.counts = [int(counts[tag]) for tag in self.names]
+
+    def __getstate__(self):
+        return self.names, self.counts
+
+    def __setstate__(self, state):
+        self.names, self.counts = state
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, tag: str) -> bool:
+        i = bisect_left(self.names, tag)
+        return i < len(self.names) and self.names[i] == tag
+
+    def _top(self, lo: int, hi: int, limit: int = None) -> List[Tuple[str, int]]:
+        # most used first, then by name
+        pairs = zip(self.names[lo:hi], self.counts[lo:hi])
+        key = lambda pair: (-pair[1], pair[0])
+        if limit is None:
+            return sorted(pairs, key=key)
+        return heapq.nsmallest(limit, pairs, key=key)
+
+    def top(self, limit: int = None) -> List[Tuple[str, int]]:
+        '''
+        (tag, count) pairs, most used first
+        '''
+        return self._top(0, len(self.names), limit)
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        '''
+        Tags starting with `prefix`, most used first
+        '''
+        lo = bisect_left(self.names, prefix)
+        hi = bisect_left(self.names, prefix + '\U0010ffff', lo)
+        return self._top(lo, hi, limit)
@@ -0,0 +1,82 @@
+'''
+    Parser of boolean tag expressions, e.g. `python AND perf NOT draft`
+
+    NOT binds tighter than AND, AND tighter than OR, tags next to each
+    other are joined with AND. Operators are uppercase words, anything
+    else is a tag name. The result is a tree of tuples:
+    ('tag', name), ('not', node), ('and', [nodes]), ('or', [nodes])
+'''
+import re
+from typing import List
+
+MAX_TAGS = 16 # distinct tags per expression
+
+_TOKEN_RE = re.compile(r'[()]|[^\s()]+')
+_OPERATORS = {'AND', 'OR', 'NOT'}
+
+def parse_tag_query(expr: str, max_tags: int = MAX_TAGS) -> tuple:
+    '''
+    Parse the expression, raise ValueError if it's malformed
+    '''
+    parser = _Parser(_TOKEN_RE.findall(expr or ''))
+    if not parser.tokens:
+        raise ValueError('Empty tag expression')
+    node = parser.parse_or()
+    if parser.peek() is not None:
+        raise ValueError(f'Unexpected {parser.peek()!r} in tag expression')
+    if len(query_tags(node)) > max_tags:
+        raise ValueError(f'Too many tags, at most {max_tags} are allowed')
+    return node
+
+def query_tags(node: tuple) -> set:
+    '''
+    Tag names used in the expression tree
+    '''
+    if node[0] == 'tag':
+        return {node[1]}
+    if node[0] == 'not':
+        return query_tags(node[1])
+    return set().union(*(query_tags(child) for child in node[1]))
+
+class _Parser:
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError('Unexpected end of tag expression')
+        self.pos += 1
+        return token
+
+    def parse_or(self) -> tuple:
+        nodes = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_and(self) -> tuple:
+        nodes = [self.parse_not()]
+        while self.peek() not in (None, 'OR', ')'):
+            if self.peek() == 'AND':
+                self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_not(self) -> tuple:
+        token = self.take()
+        if token == 'NOT':
+            return ('not', self.parse_not())
+        if token == '(':
+            node = self.parse_or()
+            if self.take() != ')':
+                raise ValueError("Missing ')' in tag expression")
+            return node
+        if token in _OPERATORS or token == ')':
+            raise ValueError(f'Unexpected {token!r} in tag expression')
+        return ('tag', token)
@@ -0,0 +1,52 @@
+'''
+    Tokenizer for the link search index
+'''
+import re
+import urllib.parse
+from typing import Dict, List
+
+MIN_TOKEN_LEN = 2
+MAX_TOKEN_LEN = 32
+MAX_TERMS = 64 # per link
+
+# weights of the fields a token comes from
+TITLE_WEIGHT = 3
+HOST_WEIGHT = 2
+PATH_WEIGHT = 1
+
+_TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+_SKIP_HOST_PARTS = {'www', 'com', 'org', 'net', 'io'}
+
+def tokenize(text: str) -> List[str]:
+    '''
+    Lowercase words and numbers of the text, too short ones are dropped
+    '''
+    if not text:
+        return []
+    return [t[:MAX_TOKEN_LEN] for t in _TOKEN_RE.findall(text.lower())
+        if len(t) >= MIN_TOKEN_LEN]
+
+def url_tokens(url: str):
+    '''
+    Tokens of the host and of the rest of the url (path, query)
+    '''
+    parsed = urllib.parse.urlsplit(url or '')
+    host = [t for t in tokenize(parsed.hostname or '') if t not in _SKIP_HOST_PARTS]
+    path = tokenize(urllib.parse.unquote(f'{parsed.path} {parsed.query}'))
+    return host, path
+
+def link_terms(title: str, url: str) -> Dict[str, int]:
+    '''
+    Index terms of a link with their weights,
+    a term found in several fields gets the highest weight
+    '''
+    host, path = url_tokens(url)
+    terms = {}
+    for tokens, weight in ((tokenize(title), TITLE_WEIGHT),
+            (host, HOST_WEIGHT), (path, PATH_WEIGHT)):
+        for token in tokens:
+            if terms.get(token, 0) < weight:
+                terms[token] = weight
+    if len(terms) > MAX_TERMS:
+        terms = dict(sorted(terms.items(), key=lambda t: -t[1])[:MAX_TERMS])
+    return terms
@@ -0,0 +1,63 @@
+'''
+    URL canonicalization for duplicate detection and exact lookup
+'''
+import hashlib
+import urllib.parse
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# query parameters that only track where the visitor came from
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid',
+    'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl', 'mkt_tok', 'oly_anon_id',
+    'oly_enc_id', 'vero_id', '_hsenc', '_hsmi',
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'hsa_')
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def canonical_url(url: str) -> str:
+    '''
+    The form of `url` used to compare links:
+
+    - scheme and host are lowercased, default ports dropped
+    - an empty path becomes `/`, other paths lose the trailing slash
+    - tracking parameters (utm_*, fbclid, ...) are removed and
+      the rest are sorted by name
+    - the fragment is dropped unless it's a client-side route (`#!`, `#/`)
+    '''
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host: # IPv6
+        host = f'[{host}]'
+    netloc = host
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo += ':' + parts.password
+        netloc = f'{userinfo}@{host}'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += f':{port}'
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+    params = [(name, value) for name, value in
+        urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking(name)]
+    params.sort(key=lambda param: param[0])
+    query = urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+    fragment = parts.fragment if parts.fragment.startswith(('!', '/')) else ''
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
+
+def url_key(url: str) -> str:
+    '''
+    Fixed size key of the canonical url
+    '''
+    return hashlib.sha256(canonical_url(url).encode('utf-8')).hexdigest()[:32]
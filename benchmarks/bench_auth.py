@@ -0,0 +1,61 @@
+'''
+Latency of an authenticated request (GET /user/me) with the user cache
+off, on and in the stateless mode.
+
+    python -m benchmarks.bench_auth [requests] [rtt_ms]
+
+`rtt_ms` is the simulated DynamoDB round trip (5 ms by default).
+'''
+import os
+import sys
+import time
+
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret')
+os.environ.setdefault('JWT_REFRESH_SECRET_KEY', 'bench-refresh-secret')
+
+from fastapi.testclient import TestClient
+
+from app import db
+from app.api import users
+from app.main import app
+from app.models.user_mod import UserInDB
+from app.utils.jwt import create_access_token, user_claims
+from .common import local_table, simulate_rtt, percentiles
+
+
+def run(client: TestClient, requests: int) -> dict:
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        assert client.get('/user/me').status_code == 200
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def main(requests: int = 300, rtt_ms: float = 5):
+    with local_table():
+        user = UserInDB(username='bench', hashpass='x')
+        db.db_put_user(user)
+        simulate_rtt(rtt_ms / 1000)
+        client = TestClient(app)
+        token, _ = create_access_token(user.username, claims=user_claims(user))
+        client.cookies.set('access_token', f'Bearer {token}')
+        maxsize = db._user_cache.maxsize
+        modes = (
+            ('no cache', 0, False),
+            ('user cache', maxsize, False),
+            ('stateless', maxsize, True),
+        )
+        for name, size, stateless in modes:
+            db.clear_caches()
+            db._user_cache.maxsize = db._token_version_cache.maxsize = size
+            users.AUTH_STATELESS = stateless
+            res = run(client, requests)
+            stats = db.user_cache_stats()['token_version' if stateless else 'user']
+            print(f'{name:<10}: p50 {res["p50"] * 1e3:6.2f} ms, p99 {res["p99"] * 1e3:6.2f} ms, '
+                f'hits {stats["hits"]}, misses {stats["misses"]}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:3]
+    main(int(args[0]) if args else 300, float(args[1]) if len(args) > 1 else 5)
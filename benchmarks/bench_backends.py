@@ -0,0 +1,114 @@
+'''
+The same operations on the DynamoDB and the SQLite backend.
+
+    python -m benchmarks.bench_backends [--links N] [--repeat N] [--rtt MS]
+
+Every backend gets a fresh store with a user of `--links` imported
+links (tags `all` and `even`/`odd`, not measured). Reads run on that
+user, writes on a user of their own. The median wall time of
+`--repeat` runs is reported, the DynamoDB link cache is cleared before
+every run, so reads are never served from memory.
+
+DynamoDB runs in moto unless `DYNAMODB_ENDPOINT_URL` is set: moto
+answers in-process, so its times are the CPU cost of boto3 and moto
+without the network. `--rtt` adds a round trip to every DynamoDB call.
+'''
+import os
+import time
+import argparse
+import tempfile
+from statistics import median
+
+from app import db
+from app.repository import DynamoDBRepository
+from app.db_sqlite import SQLiteRepository
+from app.models.link_mod import LinkInp
+from app.models.user_mod import UserInDB
+from .common import local_table, simulate_rtt
+
+USER = 'bench'
+
+
+def _records(count: int, prefix: str = ''):
+    for i in range(count):
+        yield {
+            'url': f'https://blog{i % 50}.example.com/{prefix}posts/{i}?lang=en',
+            'title': f'Article {i}: notes on performance engineering',
+            'tags': ['all', 'odd' if i % 2 else 'even'],
+        }
+
+
+def _fill(repo, links: int) -> list:
+    repo.put_user(UserInDB(username=USER, hashpass='x'))
+    repo.import_links(USER, _records(links))
+    return [link.created for link in repo.get_links_by_user(USER, limit=links)]
+
+
+def _cases(links: int):
+    '''
+    (name, run) pairs, `run(repo, created, i)` gets the timestamps
+    of the bench user and the number of the run
+    '''
+    return [
+        ('put_link', lambda repo, created, i:
+            repo.put_link(f'writer{i}', LinkInp(url='https://example.com/new', title='New'))),
+        ('get_link_by_id', lambda repo, created, i:
+            repo.get_link_by_id(USER, created[i % len(created)])),
+        ('get_link_by_url', lambda repo, created, i:
+            repo.get_link_by_url(USER, f'https://blog{i % 50}.example.com/posts/{i}?lang=en')),
+        ('get_links_page[100]', lambda repo, created, i: repo.get_links_page(USER, 100)),
+        (f'get_links_by_user[{links}]', lambda repo, created, i: repo.get_links_by_user(USER)),
+        ('put_tags[10]', lambda repo, created, i:
+            repo.put_tags(USER, [(created[i], f'new{i}.{k}') for k in range(10)])),
+        ('get_links_by_tags[all NOT even]', lambda repo, created, i:
+            repo.get_links_by_tags(USER, 'all NOT even', limit=50)),
+        ('get_tag_catalog', lambda repo, created, i: repo.get_tag_catalog(USER)),
+        ('search_links[performance]', lambda repo, created, i:
+            repo.search_links(USER, 'performance')),
+        ('import_links[200]', lambda repo, created, i:
+            repo.import_links(f'importer{i}', _records(200, f'i{i}/'))),
+        ('get_user', lambda repo, created, i: repo.get_user(USER)),
+    ]
+
+
+def run_backend(repo, links: int, repeat: int) -> dict:
+    created = _fill(repo, links)
+    results = {}
+    for name, run in _cases(links):
+        walls = []
+        for i in range(repeat):
+            db.clear_caches()
+            start = time.perf_counter()
+            run(repo, created, i)
+            walls.append((time.perf_counter() - start) * 1e3)
+        results[name] = median(walls)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--links', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rtt', type=float, default=0.0, help='ms per DynamoDB call')
+    args = parser.parse_args()
+
+    with local_table():
+        if args.rtt:
+            simulate_rtt(args.rtt / 1e3)
+        dynamodb = run_backend(DynamoDBRepository(), args.links, args.repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = SQLiteRepository(os.path.join(tmp, 'bench.db'))
+        sqlite = run_backend(repo, args.links, args.repeat)
+        repo.close()
+
+    backend = os.environ.get('DYNAMODB_ENDPOINT_URL') or 'moto'
+    if args.rtt:
+        backend += f' +{args.rtt:g}ms'
+    print(f'{"operation":<34} {backend:>14} {"sqlite":>10} {"ratio":>8}   (ms)')
+    for name, wall in dynamodb.items():
+        print(f'{name:<34} {wall:>14.2f} {sqlite[name]:>10.2f} '
+            f'{wall / max(sqlite[name], 1e-6):>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
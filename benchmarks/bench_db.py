@@ -0,0 +1,241 @@
+'''
+Call-level benchmark of `app.db` operations against a local table.
+
+    python -m benchmarks.bench_db [--repeat N] [--only NAME] [--check] [--update]
+
+Every case gets a fresh table (moto transactions slow down as the
+table grows) and every run a fresh user: the partition is filled first
+(not measured), then the operation runs once. For every case the median
+wall time of `--repeat` runs is reported with the DynamoDB API calls,
+consumed capacity units and items read and written of the last run.
+
+Results are compared with `baseline_db.json`:
+
+- `--check` exits with 1 if a case got worse than its baseline by more
+  than the thresholds of the file (relative, per metric)
+- `--update` writes the results as the new baseline
+
+Calls and items don't depend on the machine and are compared always.
+Wall time and capacity are only compared when the baseline was made
+on the same backend (moto or `DYNAMODB_ENDPOINT_URL`), wall time also
+depends on the machine, so update the baseline where the check runs.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+from statistics import median
+from typing import Callable, NamedTuple
+
+from app import db
+from app.models.link_mod import LinkInp
+from app.models.user_mod import UserInDB
+from tests.database import put_links, put_tag_refs
+from .common import local_table, CallCounter, IMPORT_WORKERS, fill_links
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline_db.json')
+DEFAULT_THRESHOLDS = {'calls': 0.0, 'items': 0.0, 'capacity': 0.1, 'wall_ms': 1.0}
+# wall time differences below this are noise whatever the ratio
+WALL_NOISE_MS = 2.0
+
+
+class Case(NamedTuple):
+    name: str
+    setup: Callable[[str], object] # username -> argument of run
+    run: Callable[[str, object], object]
+    quick: bool = True # cheap enough for the regression test
+
+
+def _table_name() -> str:
+    return db._get_table().name
+
+
+def _records(count: int):
+    for i in range(count):
+        yield {
+            'url': f'https://blog{i % 50}.example.com/posts/{i}?lang=en',
+            'title': f'Article {i}: notes on performance engineering',
+            'tags': [f'tag{(i + k) % 10}' for k in range(3)],
+        }
+
+
+def _put_link(username: str, url: str = 'https://example.com/new') -> str:
+    return db.db_put_link(username, LinkInp(url=url, title='New')).created
+
+
+def _tagged_link(count: int):
+    def setup(username: str) -> str:
+        created = put_links(username, 1, _table_name())[0]
+        if count:
+            db.db_put_tags(username, [(created, f'tag{i}') for i in range(count)])
+        return created
+    return setup
+
+
+def _tagged_links(count: int):
+    def setup(username: str) -> list:
+        created = put_links(username, count, _table_name())
+        put_tag_refs(username, 'a', created, _table_name())
+        put_tag_refs(username, 'b', created[::2], _table_name())
+        return created
+    return setup
+
+
+CASES = [
+    Case('put_link', lambda u: None, lambda u, _: _put_link(u)),
+    Case('put_link_duplicate', lambda u: _put_link(u), lambda u, _: _put_link(u)),
+    Case('get_link_by_id', lambda u: put_links(u, 1, _table_name())[0],
+        lambda u, created: db.db_get_link_by_id(u, created)),
+    Case('get_link_by_url', lambda u: _put_link(u),
+        lambda u, _: db.db_get_link_by_url(u, 'https://example.com/new')),
+    *(Case(f'get_links_by_user[{n}]', lambda u, n=n: put_links(u, n, _table_name()),
+        lambda u, _: db.db_get_links_by_user(u), quick=n <= 100)
+        for n in (10, 100, 1000)),
+    Case('get_links_page[100 of 1000]', lambda u: put_links(u, 1000, _table_name()),
+        lambda u, _: db.db_get_links_page(u, 100), quick=False),
+    *(Case(f'put_tag[{n}]', _tagged_link(n - 1),
+        lambda u, created: db.db_put_tag(u, created, 'new'))
+        for n in (1, 10, 50)),
+    *(Case(f'put_tags[{n}]', _tagged_link(0),
+        lambda u, created, n=n: db.db_put_tags(u, [(created, f'tag{i}') for i in range(n)]))
+        for n in (1, 10, 50)),
+    *(Case(f'delete_tag[{n}]', _tagged_link(n),
+        lambda u, created: db.db_delete_tag(u, created, 'tag0'))
+        for n in (1, 10, 50)),
+    Case('delete_link[5 tags]', _tagged_link(5),
+        lambda u, created: db.db_delete_link(u, created)),
+    Case('get_links_by_tag[100]', _tagged_links(100),
+        lambda u, _: db.db_get_links_by_tag(u, 'a')),
+    Case('get_links_by_tags[a NOT b, 200]', _tagged_links(200),
+        lambda u, _: db.db_get_links_by_tags(u, 'a NOT b')),
+    Case('search_links[100]', lambda u: fill_links(u, _records(100)),
+        lambda u, _: db.db_search_links(u, 'performance')),
+    # moto copies the table for every item of a transaction, keep it small
+    Case('import_links[20]', lambda u: None,
+        lambda u, _: db.db_import_links(u, _records(20), IMPORT_WORKERS)),
+    Case('get_tag_catalog', _tagged_link(10), lambda u, _: db.db_get_tag_catalog(u)),
+    Case('get_user', lambda u: db.db_put_user(UserInDB(username=u, hashpass='x')),
+        lambda u, _: db.db_get_user(u)),
+    *(Case(f'delete_user[{n} links]', _tagged_links(n),
+        lambda u, _: db.db_delete_user(u), quick=n <= 100)
+        for n in (100, 1000, 5000)),
+]
+
+
+def backend() -> str:
+    return os.environ.get('DYNAMODB_ENDPOINT_URL') or 'moto'
+
+
+def run_case(case: Case, repeat: int = 1) -> dict:
+    '''
+    Run the case `repeat` times on the current table, each time as a new user
+    '''
+    walls = []
+    for i in range(repeat):
+        username = f'bench{i}'
+        arg = case.setup(username)
+        db.clear_caches()
+        with CallCounter(capacity=True) as counter:
+            start = time.perf_counter()
+            case.run(username, arg)
+            walls.append(time.perf_counter() - start)
+    return {
+        'wall_ms': round(median(walls) * 1e3, 2),
+        'calls': dict(sorted(counter.calls.items())),
+        'items': {'read': counter.items_read, 'written': counter.items_written},
+        'capacity': round(counter.capacity_units, 2),
+    }
+
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'backend': backend(), 'thresholds': DEFAULT_THRESHOLDS, 'cases': {}}
+
+
+def _total(value) -> float:
+    return sum(value.values()) if isinstance(value, dict) else value
+
+
+def compare(result: dict, base: dict, thresholds: dict, same_backend: bool = True) -> list:
+    '''
+    Metrics of `result` worse than `base` by more than the thresholds,
+    as (metric, baseline, result) tuples
+    '''
+    worse = []
+    for metric, threshold in thresholds.items():
+        if metric not in base or (metric in ('wall_ms', 'capacity') and not same_backend):
+            continue
+        if metric in ('calls', 'items'):
+            # every kind of call must stay within the threshold
+            keys = set(base[metric]) | set(result[metric])
+            pairs = [(base[metric].get(k, 0), result[metric].get(k, 0)) for k in keys]
+        else:
+            pairs = [(base[metric], result[metric])]
+        for old, new in pairs:
+            if new > old * (1 + threshold) and\
+                (metric != 'wall_ms' or new - old > WALL_NOISE_MS):
+                worse.append((metric, base[metric], result[metric]))
+                break
+    return worse
+
+
+def _change(old, new) -> str:
+    old, new = _total(old), _total(new)
+    if old == new:
+        return ''
+    return f'{(new - old) / old:+.0%}' if old else 'new'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='run cases whose name contains this')
+    parser.add_argument('--check', action='store_true',
+        help='exit with 1 if a case is worse than the baseline')
+    parser.add_argument('--update', action='store_true', help='write the baseline')
+    args = parser.parse_args()
+    baseline = load_baseline()
+    thresholds = baseline.get('thresholds', DEFAULT_THRESHOLDS)
+    same_backend = baseline.get('backend') == backend()
+    cases = [case for case in CASES if not args.only or args.only in case.name]
+    results, regressions = {}, []
+    print(f'{"case":>32} | {"wall ms":>8} {"calls":>5} {"capacity":>8} '
+        f'{"read":>5} {"written":>7} | {"vs baseline":>28}')
+    for case in cases:
+        with local_table():
+            result = results[case.name] = run_case(case, args.repeat)
+        base = baseline['cases'].get(case.name)
+        note = 'no baseline'
+        if base:
+            worse = compare(result, base, thresholds, same_backend)
+            regressions.extend((case.name, *w) for w in worse)
+            note = ' '.join(f'{metric} {_change(base[metric], result[metric])}'
+                for metric in ('wall_ms', 'calls', 'capacity')
+                if _change(base[metric], result[metric])) or '='
+            note = ('WORSE ' if worse else '') + note
+        print(f'{case.name:>32} | {result["wall_ms"]:>8.2f} '
+            f'{_total(result["calls"]):>5} {result["capacity"]:>8.1f} '
+            f'{result["items"]["read"]:>5} {result["items"]["written"]:>7} '
+            f'| {note:>28}')
+    if not same_backend and baseline['cases']:
+        print(f'baseline was made on {baseline.get("backend")}, '
+            'wall time and capacity are not compared')
+    for name, metric, old, new in regressions:
+        print(f'regression: {name} {metric} {old} -> {new}')
+    if args.update:
+        baseline = {'backend': backend(), 'thresholds': thresholds,
+            'cases': {**(baseline['cases'] if same_backend else {}), **results}}
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'baseline written to {BASELINE_PATH}')
+    if args.check and regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
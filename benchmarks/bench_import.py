@@ -0,0 +1,43 @@
+'''
+Bulk import of a generated Netscape bookmark file.
+
+    python -m benchmarks.bench_import [links] [workers]
+
+The import writes transactions, which moto makes slower as the table
+grows (see common), so on moto it imports 200 links by default and
+10000 against DynamoDB-local.
+'''
+import io
+import sys
+
+from app import db
+from app.utils.importers import iter_netscape, iter_file_chunks
+from .common import local_table, timed, IMPORT_WORKERS, LOCAL_ENDPOINT
+
+
+def bookmarks_file(count: int) -> io.BytesIO:
+    lines = ['<!DOCTYPE NETSCAPE-Bookmark-file-1>', '<DL><p>']
+    for i in range(count):
+        lines.append(f'<DT><A HREF="https://example.com/{i}" ADD_DATE="1673606000" '
+            f'TAGS="bench,t{i % 10}">Bookmark {i}</A>')
+    lines.append('</DL><p>')
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+def main(count: int = None, workers: int = IMPORT_WORKERS):
+    count = count or (10000 if LOCAL_ENDPOINT else 200)
+    data = bookmarks_file(count)
+    with local_table():
+        records = iter_netscape(iter_file_chunks(data))
+        seconds, report = timed(db.db_import_links, 'bench', records, workers)
+        print(report)
+        print(f'{count} links in {seconds:.2f} s, {count / seconds:.0f} links/s')
+        data.seek(0)
+        records = iter_netscape(iter_file_chunks(data))
+        seconds, report = timed(db.db_import_links, 'bench', records, workers)
+        print(f'second run: {report["duplicates"]} duplicates in {seconds:.2f} s')
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
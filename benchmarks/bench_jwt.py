@@ -0,0 +1,59 @@
+'''
+Cost of the auth dependency: `OAuth2PasswordBearerWithCookie.__call__`
+plus `decode_subject`, with and without the verified-token cache.
+
+    python -m benchmarks.bench_jwt [calls]
+'''
+import io
+import sys
+import time
+import asyncio
+import contextlib
+
+from starlette.requests import Request
+
+from app.utils import jwt
+from app.utils.auth import OAuth2PasswordBearerWithCookie
+
+jwt.JWT_SECRET_KEY = jwt.JWT_SECRET_KEY or 'bench-secret'
+
+
+def make_request(token: str) -> Request:
+    cookie = f'access_token="Bearer {token}"'.encode('latin-1')
+    return Request({'type': 'http', 'headers': [(b'cookie', cookie)]})
+
+
+async def authenticate(scheme, request):
+    token = await scheme(request)
+    return jwt.decode_subject(token)
+
+
+def measure(calls: int, request: Request) -> float:
+    scheme = OAuth2PasswordBearerWithCookie(tokenUrl='auth/access')
+    loop = asyncio.new_event_loop()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(calls):
+            assert loop.run_until_complete(authenticate(scheme, request))['sub']
+        elapsed = time.perf_counter() - start
+    loop.close()
+    return elapsed / calls
+
+
+def main(calls: int = 5000):
+    token, _ = jwt.create_access_token('bench')
+    request = make_request(token)
+    maxsize = jwt._verified_cache.maxsize
+    jwt._verified_cache.maxsize = 0
+    without = measure(calls, request)
+    jwt._verified_cache.maxsize = maxsize
+    jwt._verified_cache.clear()
+    with_cache = measure(calls, request)
+    print(f'calls: {calls}')
+    print(f'without cache: {without * 1e6:8.1f} us/call')
+    print(f'with cache:    {with_cache * 1e6:8.1f} us/call')
+    print(f'cache stats:   {jwt.jwt_cache_stats()}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
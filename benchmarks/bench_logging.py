@@ -0,0 +1,80 @@
+'''
+Authenticated-request throughput with logging off and on.
+
+    python -m benchmarks.bench_logging [requests]
+
+`GET /user/me` with a valid access token is sent to the ASGI app by
+`CONCURRENCY` clients on one event loop (httpx.ASGITransport, no
+network); the user is cached, so DynamoDB is read once. At DEBUG
+every request logs the auth cookie check. Records are written to a
+line-buffered file, like stdout of a Lambda:
+
+- `off`: LOG_LEVEL=WARNING, no record is created
+- `queue`: DEBUG through the queue, the listener thread writes
+- `queue sampled`: DEBUG, 1% of `app.utils.auth` records kept
+- `blocking`: DEBUG, the request thread formats and writes (what
+  the old print() calls did)
+'''
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+import httpx
+
+from app import db
+from app.main import app
+from app.models.user_mod import UserInDB
+from app.utils import jwt, log
+from .common import local_table, percentiles
+
+MODES = (
+    ('off', dict(level='WARNING')),
+    ('queue', dict(level='DEBUG')),
+    ('queue sampled', dict(level='DEBUG', sample='app.utils.auth=0.01')),
+    ('blocking', dict(level='DEBUG', blocking=True)),
+)
+CONCURRENCY = 8
+
+
+async def send(client: httpx.AsyncClient, requests: int) -> list:
+    samples = []
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            resp = await client.get('/user/me')
+            samples.append(time.perf_counter() - start)
+            assert resp.status_code == 200, resp.text
+    await asyncio.gather(*(worker(requests // CONCURRENCY) for _ in range(CONCURRENCY)))
+    return samples
+
+
+def main(requests: int = 2000):
+    jwt.JWT_SECRET_KEY = jwt.JWT_SECRET_KEY or 'bench-secret'
+    with local_table(), tempfile.TemporaryDirectory() as tmp:
+        db.db_put_user(UserInDB(username='bench', hashpass='x'))
+        token, _ = jwt.create_access_token('bench')
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+            base_url='http://bench', cookies={'access_token': f'Bearer {token}'})
+        asyncio.run(send(client, CONCURRENCY))
+        print(f'{"mode":>14} | {"req/s":>7} {"p50 ms":>7} {"p99 ms":>7} | '
+            f'{"lines":>6} {"dropped":>7}')
+        for name, options in MODES:
+            path = os.path.join(tmp, name.replace(' ', '_') + '.log')
+            with open(path, 'w', buffering=1) as stream:
+                log.configure(stream=stream, fmt='json', **options)
+                start = time.perf_counter()
+                samples = asyncio.run(send(client, requests))
+                elapsed = time.perf_counter() - start
+                dropped = log.dropped_records()
+                log.shutdown()
+            with open(path) as f:
+                lines = sum(1 for _ in f)
+            stats = percentiles(samples)
+            print(f'{name:>14} | {len(samples) / elapsed:>7.0f} {stats["p50"] * 1e3:>7.3f} '
+                f'{stats["p99"] * 1e3:>7.3f} | {lines:>6} {dropped:>7}')
+    log.configure()
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
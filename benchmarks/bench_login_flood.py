@@ -0,0 +1,82 @@
+'''
+Login flood: login throughput and latency of non-auth requests while
+logins are running, with bcrypt inline on the event loop (the old way)
+and in the hashing pool.
+
+    python -m benchmarks.bench_login_flood [logins] [concurrency] [rounds]
+'''
+import io
+import os
+import sys
+import time
+import asyncio
+import contextlib
+
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret')
+os.environ.setdefault('JWT_REFRESH_SECRET_KEY', 'bench-refresh-secret')
+
+import httpx
+
+from app import db
+from app.api import auth
+from app.main import app
+from app.models.user_mod import UserInDB
+from app.utils import crypto
+from .common import local_table, percentiles
+
+
+async def verify_inline(plain_password: str, hashed_password: str) -> bool:
+    return crypto.verify_password(plain_password, hashed_password)
+
+
+async def flood(logins: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        done = asyncio.Event()
+        probe_samples = []
+
+        async def login():
+            async with semaphore:
+                resp = await client.post('/auth/access',
+                    data={'username': 'bench', 'password': 'secret'})
+                assert resp.status_code == 200
+
+        async def probe():
+            # latency counts from the moment the request was due,
+            # so time the event loop was blocked is not hidden
+            while not done.is_set():
+                due = time.perf_counter() + 0.005
+                await asyncio.sleep(0.005)
+                await client.get('/', follow_redirects=False)
+                probe_samples.append(time.perf_counter() - due)
+
+        prober = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await prober
+    return {'logins_per_s': logins / elapsed, **percentiles(probe_samples)}
+
+
+def main(logins: int = 40, concurrency: int = 10, rounds: int = 10):
+    crypto.BCRYPT_ROUNDS = rounds
+    with local_table():
+        db.db_put_user(UserInDB(username='bench',
+            hashpass=crypto.get_password_hash('secret')))
+        print(f'{logins} logins, concurrency {concurrency}, bcrypt rounds {rounds}, '
+            f'hash workers {crypto.HASH_MAX_WORKERS}')
+        pooled = auth.verify_password_async
+        for name, verify in (('inline', verify_inline), ('pool', pooled)):
+            auth.verify_password_async = verify
+            with contextlib.redirect_stdout(io.StringIO()):
+                res = asyncio.run(flood(logins, concurrency))
+            print(f'{name:<6}: {res["logins_per_s"]:6.1f} logins/s, non-auth p50 '
+                f'{res["p50"] * 1e3:7.2f} ms, p99 {res["p99"] * 1e3:7.2f} ms')
+        auth.verify_password_async = pooled
+        print(f'pool stats: {crypto.hash_pool_stats()}')
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:4]])
@@ -0,0 +1,73 @@
+'''
+Payload bytes and serialization time of a page with and without `fields`.
+
+    python -m benchmarks.bench_projection [links]
+
+Links look like real ones: a long title, a url with a path and query,
+an icon, a canonical url and five tags. For every field set a page of
+100 links is read (cache disabled) and serialized the way FastAPI does
+it: `jsonable_encoder` and `json.dumps`.
+`db bytes` is the size of the DynamoDB response, `parse` the time to
+validate its items, `json` the serialization time and size of the body.
+'''
+import sys
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from app import db
+from app.models.link_mod import parse_link_fields, link_model
+from app.utils.cache import LRUCache
+from .common import local_table, CallCounter, percentiles, fill_links
+
+FIELD_SETS = (None, 'url,title,tags', 'url,title', 'url')
+ROUNDS = 200
+
+
+def records(count: int):
+    for i in range(count):
+        yield {
+            'url': f'https://blog{i % 50}.example.com/posts/2023/{i}/'
+                f'a-fairly-long-article-slug-number-{i}?lang=en',
+            'title': f'Article {i}: notes on performance engineering of serverless '
+                'applications built on DynamoDB',
+            'tags': [f'tag{(i + k) % 40}' for k in range(5)],
+        }
+
+
+def main(count: int = 1000):
+    db.set_link_cache_backend(LRUCache(max_bytes=0))
+    with local_table() as table:
+        fill_links('bench', records(count))
+        # what enrichment adds to every link
+        for link in db.db_get_links_by_user('bench', limit=100):
+            db.db_update_link_metadata('bench', link.created,
+                icon=f'https://{link.url.split("/")[2]}/static/favicon-32x32.png',
+                canonical=link.url.split('?')[0])
+        print(f'{"fields":>16} | {"db bytes":>8} {"parse ms":>8} | '
+            f'{"json ms":>7} {"json bytes":>10}')
+        for fields in FIELD_SETS:
+            parsed = parse_link_fields(fields)
+            with CallCounter() as calls:
+                db.db_get_links_page('bench', 100, fields=parsed)
+            kwargs = db._links_by_user_query('bench')
+            kwargs.update(Limit=100, **db._projection(parsed))
+            items = table.query(**kwargs)['Items']
+            model = List[link_model(parsed)]
+            parse_times, json_times = [], []
+            for _ in range(ROUNDS):
+                start = time.perf_counter()
+                links = parse_obj_as(model, items)
+                parse_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                body = json.dumps(jsonable_encoder(links)).encode()
+                json_times.append(time.perf_counter() - start)
+            print(f'{fields or "(all)":>16} | {calls.bytes_read:>8} '
+                f'{percentiles(parse_times)["p50"] * 1e3:>8.2f} | '
+                f'{percentiles(json_times)["p50"] * 1e3:>7.2f} {len(body):>10}')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
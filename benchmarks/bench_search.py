@@ -0,0 +1,62 @@
+'''
+Search index build time and query latency.
+
+    python -m benchmarks.bench_search [links]
+
+Links get titles from a small vocabulary, so some terms are frequent
+and some are rare. The links are written with their index, the index
+is built again by the backfill script, then queries are timed (cache
+disabled).
+
+moto scans the whole partition for every query, so its latencies grow
+with the partition size. Run against DynamoDB-local or a real table
+(`DYNAMODB_ENDPOINT_URL`) for meaningful times, calls and items read
+don't depend on the backend.
+'''
+import sys
+import random
+import time
+
+from app import db
+from app.utils.cache import LRUCache
+from scripts.build_search_index import build
+from .common import local_table, timed, percentiles, CallCounter, fill_links
+
+WORDS = ('python asyncio performance database dynamodb lambda cache search '
+    'index tutorial guide tips design pattern rust golang linux kernel network '
+    'security testing docker cloud serverless api http json').split()
+QUERIES = ('python', 'py', 'dynamodb perf', 'tutorial linux kernel', 'serverless api guide', 'zzz')
+
+
+def records(count: int, rnd: random.Random):
+    for i in range(count):
+        title = ' '.join(rnd.sample(WORDS, 4))
+        host = rnd.choice(WORDS)
+        yield {'url': f'https://{host}.example.com/{rnd.choice(WORDS)}/{i}', 'title': title}
+
+
+def main(count: int = 5000):
+    rnd = random.Random(42)
+    db.set_link_cache_backend(LRUCache(max_bytes=0))
+    with local_table() as table:
+        with CallCounter() as calls:
+            seconds, _ = timed(fill_links, 'bench', records(count, rnd))
+        print(f'links with index:  {count} links, {calls.items_written} items in {seconds:.2f} s')
+        seconds, report = timed(build, table, 'bench')
+        print(f'backfill script:   {report["links"]} links, '
+            f'{report["index_items"]} index items in {seconds:.2f} s')
+        for query in QUERIES:
+            samples = []
+            for _ in range(5):
+                with CallCounter() as calls:
+                    start = time.perf_counter()
+                    found = db.db_search_links('bench', query)
+                    samples.append(time.perf_counter() - start)
+            res = percentiles(samples)
+            print(f'{query!r:>24}: {len(found):>3} results, {calls.total:>2} calls, '
+                f'{calls.items_read:>5} items read, p50 {res["p50"] * 1e3:7.1f} ms, '
+                f'max {max(samples) * 1e3:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,69 @@
+'''
+Time from DynamoDB items to the response body, model path vs fast path.
+
+    python -m benchmarks.bench_serialize [rounds]
+
+Pages of 10, 1k and 10k synthetic link items (as boto3 returns them)
+are turned into JSON two ways:
+
+- `models`: `parse_obj_as(List[Link])`, `jsonable_encoder` and `json.dumps`,
+  what a route returning models costs
+- `fast`: `link_adapter` and `json_dumps` (orjson if installed)
+
+Both bodies are checked to hold the same data.
+'''
+import sys
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from app.models.link_mod import Link
+from app.utils.serialize import json_dumps, link_adapter
+from .common import percentiles
+
+PAGE_SIZES = (10, 1000, 10000)
+
+
+def items(count: int) -> List[dict]:
+    return [{
+        'PK': 'USER#bench',
+        'SK': f'LINK#2023-01-01T00:00:00.{i:06d}',
+        'created': f'2023-01-01T00:00:00.{i:06d}',
+        'url': f'https://blog{i % 50}.example.com/posts/2023/{i}/'
+            f'a-fairly-long-article-slug-number-{i}?lang=en',
+        'title': f'Article {i}: notes on performance engineering',
+        'icon': f'https://blog{i % 50}.example.com/favicon.ico',
+        'tags': [f'tag{(i + k) % 40}' for k in range(5)],
+    } for i in range(count)]
+
+
+def models_body(page: List[dict]) -> bytes:
+    return json.dumps(jsonable_encoder(parse_obj_as(List[Link], page))).encode()
+
+
+def fast_body(page: List[dict]) -> bytes:
+    adapt = link_adapter(None)
+    return json_dumps([adapt(item) for item in page])
+
+
+def main(rounds: int = 20):
+    print(f'{"items":>6} | {"models ms":>9} {"fast ms":>8} {"speedup":>7}')
+    for size in PAGE_SIZES:
+        page = items(size)
+        assert json.loads(models_body(page)) == json.loads(fast_body(page))
+        times = {}
+        for name, render in (('models', models_body), ('fast', fast_body)):
+            samples = []
+            for _ in range(max(1, rounds * 1000 // size)):
+                start = time.perf_counter()
+                render(page)
+                samples.append(time.perf_counter() - start)
+            times[name] = percentiles(samples)['p50']
+        print(f'{size:>6} | {times["models"] * 1e3:>9.3f} {times["fast"] * 1e3:>8.3f} '
+            f'{times["models"] / times["fast"]:>6.1f}x')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,178 @@
+'''
+Cold start of the Lambda handler: import time by package and time to
+the first response through `app.main.handler`.
+
+    python -m benchmarks.bench_startup [--runs N] [--record FILE]
+
+Every run is a fresh interpreter:
+
+- `python -X importtime -c "import app.main"`, self time is summed by
+  top-level package
+- a child imports `app.main`, optionally runs `warmup` (what the
+  Lambda init phase does), then sends two API Gateway events to
+  `handler`: `GET /get_my_links` of a user with a valid token
+
+The table lives in moto unless `DYNAMODB_ENDPOINT_URL` is set. moto is
+imported after `app.main` and answers in-process, so `warmup` and the
+first response don't include a real network round trip.
+With `--record` a JSON line with the medians, the commit and the
+Python version is appended to FILE, to track the numbers over time.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from collections import Counter
+from statistics import median
+
+TABLE_NAME = 'BenchLM'
+USERNAME = 'bench'
+ENV = {
+    'TABLE_NAME': TABLE_NAME,
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'JWT_SECRET_KEY': 'bench-secret',
+    'ENRICH_LINKS': '0',
+    'LAMBDA_WARMUP': '0',
+}
+
+
+class _Context:
+    function_name = 'link-manager'
+    aws_request_id = 'bench'
+
+
+def _event(token: str) -> dict:
+    return {
+        'version': '2.0',
+        'routeKey': '$default',
+        'rawPath': '/get_my_links',
+        'rawQueryString': 'limit=20',
+        'cookies': [f'access_token=Bearer {token}'],
+        'headers': {'host': 'bench.execute-api.us-east-1.amazonaws.com'},
+        'requestContext': {
+            'http': {'method': 'GET', 'path': '/get_my_links',
+                'protocol': 'HTTP/1.1', 'sourceIp': '127.0.0.1',
+                'userAgent': 'bench'},
+            'stage': '$default',
+        },
+        'isBase64Encoded': False,
+    }
+
+
+def child(warmup: bool):
+    # runs in a fresh interpreter, prints the timings as JSON
+    timings = {}
+    start = time.perf_counter()
+    import app.main
+    timings['import'] = time.perf_counter() - start
+
+    import contextlib
+    from app import db
+    from app.models.user_mod import UserInDB
+    from tests.database import create_table
+    endpoint = os.environ.get('DYNAMODB_ENDPOINT_URL')
+    mock = contextlib.nullcontext()
+    if not endpoint:
+        import moto
+        mock = moto.mock_aws()
+    with mock:
+        import boto3
+        client = boto3.client('dynamodb', endpoint_url=endpoint)
+        create_table(client, TABLE_NAME)
+        try:
+            db.db_put_user(UserInDB(username=USERNAME, hashpass='x'))
+            db.reset_table()
+            event = _event(os.environ['BENCH_TOKEN'])
+            start = time.perf_counter()
+            if warmup:
+                app.main.warmup()
+            timings['warmup'] = time.perf_counter() - start
+            for name in ('first', 'second'):
+                start = time.perf_counter()
+                resp = app.main.handler(event, _Context())
+                timings[name] = time.perf_counter() - start
+                assert resp['statusCode'] == 200, resp
+        finally:
+            client.delete_table(TableName=TABLE_NAME)
+    print(json.dumps(timings))
+
+
+def _run(args: list, env: dict) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], env={**os.environ, **env},
+        capture_output=True, text=True, check=True)
+
+
+def import_times(env: dict) -> Counter:
+    '''
+    Self time in ms of every top-level package imported by `app.main`
+    '''
+    proc = _run(['-X', 'importtime', '-c', 'import app.main'], env)
+    times = Counter()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip().split('.')[0]] += int(self_us) / 1000
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--record', help='append the result to this JSON lines file')
+    parser.add_argument('--child', choices=('warm', 'cold'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child == 'warm')
+
+    env = dict(ENV)
+    os.environ.update(env)
+    from app.utils import jwt
+    env['BENCH_TOKEN'], _ = jwt.create_access_token(USERNAME)
+
+    packages = Counter()
+    for _ in range(args.runs):
+        packages.update(import_times(env))
+    print(f'import self time by package, ms (mean of {args.runs} runs)')
+    for name, ms in packages.most_common(12):
+        print(f'{name:>24} {ms / args.runs:>8.1f}')
+    print(f'{"total":>24} {sum(packages.values()) / args.runs:>8.1f}')
+
+    result = {}
+    print(f'\n{"":>10} | {"import":>7} {"warmup":>7} {"first":>7} {"second":>7} '
+        f'| {"cold start ms":>13}')
+    for key, mode in (('warmup', 'warm'), ('no warmup', 'cold')):
+        runs = [json.loads(_run(['-m', 'benchmarks.bench_startup', '--child', mode],
+            env).stdout.splitlines()[-1]) for _ in range(args.runs)]
+        ms = {name: round(median(run[name] for run in runs) * 1e3, 1)
+            for name in runs[0]}
+        ms['cold_start'] = round(ms['import'] + ms['warmup'] + ms['first'], 1)
+        result[key.replace(' ', '_')] = ms
+        print(f'{key:>10} | '
+            f'{ms["import"]:>7.1f} {ms["warmup"]:>7.1f} {ms["first"]:>7.1f} '
+            f'{ms["second"]:>7.1f} | {ms["cold_start"]:>13.1f}')
+    print('(first: the first response after init, what users wait for)')
+
+    if args.record:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True).stdout.strip()
+        os.makedirs(os.path.dirname(args.record) or '.', exist_ok=True)
+        with open(args.record, 'a') as f:
+            f.write(json.dumps({
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit': commit,
+                'python': platform.python_version(),
+                'runs': args.runs,
+                'imports': {name: round(ms / args.runs, 1)
+                    for name, ms in packages.most_common(12)},
+                **result,
+            }) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+'''
+Per-call overhead of getting a DynamoDB Table: a new resource on every
+call (the old `_get_table`) against the shared provider from `app.db`.
+
+    python -m benchmarks.bench_table_provider [calls]
+
+No network is touched, only session/client construction is measured.
+'''
+import os
+import sys
+import time
+
+import boto3
+
+os.environ.setdefault('TABLE_NAME', 'BenchLM')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+from app import db
+
+
+def per_call_resource():
+    return boto3.resource('dynamodb').Table(os.environ['TABLE_NAME'])
+
+
+def measure(func, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def main(calls: int = 200):
+    db.reset_table()
+    first = measure(db._get_table, 1)
+    before = measure(per_call_resource, calls)
+    after = measure(db._get_table, calls)
+    print(f'calls: {calls}')
+    print(f'provider first call:   {first * 1e6:10.1f} us')
+    print(f'new resource per call: {before * 1e6:10.1f} us/call')
+    print(f'shared provider:       {after * 1e6:10.1f} us/call')
+    print(f'speedup:               {before / after:10.0f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
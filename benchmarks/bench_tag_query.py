@@ -0,0 +1,79 @@
+'''
+Cost of boolean tag queries over tags of skewed cardinality.
+
+    python -m benchmarks.bench_tag_query [links]
+
+Every link has `common`, half of them `half`, a tenth `tenth` and
+one in two hundred `rare`. For every expression the first page of 20
+links and then all pages are read (cache disabled). `items` is the
+number of items read, the returned links included; `join refs` is what
+reading every range of the expression in full and joining the sets
+would read for one page.
+
+As in bench_search, moto latencies grow with the partition size, calls
+and items read don't depend on the backend.
+'''
+import sys
+
+from app import db
+from app.utils.cache import LRUCache
+from app.utils.tag_query import parse_tag_query, query_tags
+from .common import local_table, timed, CallCounter, fill_links
+
+QUERIES = (
+    'rare AND common',
+    'rare AND half AND common',
+    'tenth AND NOT half',
+    'rare OR tenth',
+    'common AND NOT rare',
+    'NOT half',
+)
+
+
+def records(count: int):
+    for i in range(count):
+        tags = ['common']
+        if i % 2 == 0:
+            tags.append('half')
+        if i % 10 == 0:
+            tags.append('tenth')
+        if i % 200 == 0:
+            tags.append('rare')
+        yield {'url': f'https://example.com/{i}', 'title': f'Link {i}', 'tags': tags}
+
+
+def read_all(user: str, query: str) -> int:
+    count, cursor = 0, None
+    while True:
+        links, cursor = db.db_get_links_by_tags(user, query, 100, cursor)
+        count += len(links)
+        if not cursor:
+            return count
+
+
+def main(count: int = 2000):
+    db.set_link_cache_backend(LRUCache(max_bytes=0))
+    with local_table():
+        seconds, written = timed(fill_links, 'bench', records(count))
+        print(f'{written} links written in {seconds:.2f} s')
+        sizes = {'common': count, 'half': (count + 1) // 2,
+            'tenth': (count + 9) // 10, 'rare': (count + 199) // 200}
+        print(f'{"query":>26} | {"page: calls":>11} {"items":>6} {"ms":>7} | '
+            f'{"all: links":>10} {"calls":>5} {"items":>6} {"ms":>7} | {"join refs":>9}')
+        for query in QUERIES:
+            tree = parse_tag_query(query)
+            tags = query_tags(tree)
+            join_refs = sum(sizes[tag] for tag in tags)
+            if db._count_ranges(tree) > len(tags): # NOT over all links
+                join_refs += count
+            with CallCounter() as page:
+                page_time, _ = timed(db.db_get_links_by_tags, 'bench', query, 20)
+            with CallCounter() as full:
+                full_time, found = timed(read_all, 'bench', query)
+            print(f'{query:>26} | {page.total:>11} {page.items_read:>6} '
+                f'{page_time * 1e3:>7.1f} | {found:>10} {full.total:>5} '
+                f'{full.items_read:>6} {full_time * 1e3:>7.1f} | {join_refs:>9}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
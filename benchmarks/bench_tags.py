@@ -0,0 +1,40 @@
+'''
+Cost of tag writes and reads for links with 1..50 tags.
+
+    python -m benchmarks.bench_tags
+
+For every tag count the link gets its last tag added and removed, then
+links are read by tag. The `copy model` column is the number of items
+the previous storage (full link copies in TAG# entities) wrote for the
+same tag addition: the link, every existing copy and the new copy.
+'''
+from app import db
+from app.models.link_mod import LinkInp
+from .common import local_table, CallCounter, timed
+
+TAG_COUNTS = (1, 5, 10, 25, 50)
+
+
+def main():
+    print(f'{"tags":>4} | {"add: calls":>10} {"items":>5} {"copy model":>10} {"ms":>6} | '
+        f'{"remove: calls":>13} {"items":>5} {"ms":>6} | {"read: calls":>11} {"ms":>6}')
+    with local_table():
+        for count in TAG_COUNTS:
+            user = f'bench{count}'
+            link = db.db_put_link(user, LinkInp(url=f'https://{count}.com'))
+            for i in range(count - 1):
+                db.db_put_tag(user, link.created, f'tag{i}')
+            last = f'tag{count - 1}'
+            with CallCounter() as add:
+                add_time, _ = timed(db.db_put_tag, user, link.created, last)
+            with CallCounter() as read:
+                read_time, _ = timed(db.db_get_links_by_tag, user, last)
+            with CallCounter() as remove:
+                remove_time, _ = timed(db.db_delete_tag, user, link.created, last)
+            print(f'{count:>4} | {add.total:>10} {add.items_written:>5} {count + 1:>10} '
+                f'{add_time * 1e3:>6.1f} | {remove.total:>13} {remove.items_written:>5} '
+                f'{remove_time * 1e3:>6.1f} | {read.total:>11} {read_time * 1e3:>6.1f}')
+
+
+if __name__ == '__main__':
+    main()
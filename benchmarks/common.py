@@ -0,0 +1,150 @@
+'''
+Helpers shared by benchmarks: a local table and a DynamoDB call counter.
+
+The table lives in moto unless `DYNAMODB_ENDPOINT_URL` points to
+a DynamoDB-local instance. moto copies the whole table for every item
+of a transaction, so transactional writes (the import among them) get
+slow as the table grows there.
+'''
+import os
+import time
+import contextlib
+from collections import Counter
+
+import boto3
+
+from app import db
+
+TABLE_NAME = 'BenchLM'
+
+LOCAL_ENDPOINT = os.environ.get('DYNAMODB_ENDPOINT_URL')
+# import writers, moto transactions are not thread-safe
+IMPORT_WORKERS = 4 if LOCAL_ENDPOINT else 1
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+
+@contextlib.contextmanager
+def local_table(table_name: str = TABLE_NAME):
+    from tests.database import create_table
+    os.environ['TABLE_NAME'] = table_name
+    endpoint = os.environ.get('DYNAMODB_ENDPOINT_URL')
+    mock = contextlib.nullcontext()
+    if not endpoint:
+        import moto
+        mock = moto.mock_aws()
+    with mock:
+        client = boto3.client('dynamodb', endpoint_url=endpoint)
+        create_table(client, table_name)
+        db.reset_table()
+        try:
+            yield db._get_table()
+        finally:
+            client.delete_table(TableName=table_name)
+            db.reset_table()
+
+
+def fill_links(username: str, records) -> int:
+    '''
+    Write the items `db.db_import_links` makes for `records` (no
+    dedup, no tag catalog) with BatchWriteItem, fast on moto too.
+    Returns the number of links.
+    '''
+    count = 0
+    with db._get_table().batch_writer() as batch:
+        for record in records:
+            for item in db._new_link_items(username, db.new_link_id(), record['url'],
+                    record.get('title'), record.get('tags') or []):
+                batch.put_item(Item=item)
+            count += 1
+    return count
+
+
+def _items_written(operation: str, params: dict) -> int:
+    if operation == 'TransactWriteItems':
+        return len(params['TransactItems'])
+    if operation == 'BatchWriteItem':
+        return sum(len(reqs) for reqs in params['RequestItems'].values())
+    if operation in ('PutItem', 'UpdateItem', 'DeleteItem'):
+        return 1
+    return 0
+
+
+class CallCounter:
+    '''
+    Count DynamoDB API calls, written and read items and response bytes
+    of the shared client
+
+        with CallCounter() as calls:
+            db.db_put_tag(...)
+        calls.calls['TransactWriteItems']
+
+    With `capacity` every call asks for ReturnConsumedCapacity and the
+    units are summed in `capacity_units`. moto reports rough units
+    (none for transactions), DynamoDB-local and AWS report real ones.
+    '''
+    def __init__(self, capacity: bool = False):
+        self.calls = Counter()
+        self.items_written = 0
+        self.items_read = 0
+        self.bytes_read = 0
+        self.capacity = capacity
+        self.capacity_units = 0.0
+
+    def _on_call(self, model, params, **kwargs):
+        self.calls[model.name] += 1
+        self.items_written += _items_written(model.name, params)
+        if self.capacity and 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def _on_response(self, parsed, http_response=None, **kwargs):
+        if http_response is not None:
+            self.bytes_read += len(http_response.content or b'')
+        self.items_read += parsed.get('Count', 0)
+        if 'Item' in parsed:
+            self.items_read += 1
+        responses = parsed.get('Responses')
+        if isinstance(responses, dict):
+            self.items_read += sum(len(items) for items in responses.values())
+        consumed = parsed.get('ConsumedCapacity') or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        self.capacity_units += sum(c.get('CapacityUnits', 0) for c in consumed)
+
+    def __enter__(self):
+        self._events = db._get_table().meta.client.meta.events
+        self._events.register('before-parameter-build.dynamodb', self._on_call)
+        self._events.register('after-call.dynamodb', self._on_response)
+        return self
+
+    def __exit__(self, *exc):
+        self._events.unregister('before-parameter-build.dynamodb', self._on_call)
+        self._events.unregister('after-call.dynamodb', self._on_response)
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def simulate_rtt(seconds: float):
+    '''
+    Add a network round trip to every call of the shared client,
+    moto answers in-process and would hide the cost of a call
+    '''
+    def sleep(**kwargs):
+        time.sleep(seconds)
+    db._get_table().meta.client.meta.events.register('before-call.dynamodb', sleep)
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))]
+    return {'p50': pick(0.5), 'p99': pick(0.99), 'mean': sum(samples) / len(samples)}
@@ -0,0 +1,36 @@
+'''
+Prebuild the OpenAPI schema when packaging the Lambda, so the first
+`/docs` or `/openapi.json` request doesn't walk all routes.
+
+    python -m scripts.build_openapi [--out app/openapi.json]
+
+The deploy workflow runs it before zipping `app/`. On Lambda the app
+reads `app/openapi.json` from the package by default; set
+`OPENAPI_SCHEMA_FILE` to use another file. The schema is built again
+on every deploy, so it follows the routes and models.
+'''
+import os
+import json
+import argparse
+
+from app.main import build_openapi
+
+
+def build(path: str) -> dict:
+    schema = build_openapi()
+    with open(path, 'w') as f:
+        json.dump(schema, f, separators=(',', ':'))
+    return schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default=os.path.join('app', 'openapi.json'))
+    args = parser.parse_args()
+    schema = build(args.out)
+    print(f'{len(schema["paths"])} paths written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+'''
+Build the search index (IDX# entities) for links created before it existed.
+
+    python -m scripts.build_search_index [--table NAME] [--user USERNAME]
+
+Index entities are put with their final content, so the script can be
+run again safely.
+'''
+import os
+import argparse
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from app.db import _get_table, _search_index_items
+
+
+def iter_links(table, username: str = None):
+    kwargs = dict(ProjectionExpression='PK, created, title, #u',
+        ExpressionAttributeNames={'#u': 'url'})
+    if username:
+        kwargs['KeyConditionExpression'] = Key('PK').eq(f'USER#{username}') &\
+            Key('SK').begins_with('LINK#')
+        read = table.query
+    else:
+        kwargs['FilterExpression'] = Attr('SK').begins_with('LINK#')
+        read = table.scan
+    while True:
+        resp = read(**kwargs)
+        yield from resp['Items']
+        if 'LastEvaluatedKey' not in resp:
+            return
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def build(table, username: str = None) -> dict:
+    report = {'links': 0, 'index_items': 0}
+    with table.batch_writer() as batch:
+        for link in iter_links(table, username):
+            items = _search_index_items(link['PK'][len('USER#'):],
+                link['created'], link.get('title'), link['url'])
+            for item in items:
+                batch.put_item(Item=item)
+            report['links'] += 1
+            report['index_items'] += len(items)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default=os.environ.get('TABLE_NAME'))
+    parser.add_argument('--user', help='index only this user')
+    args = parser.parse_args()
+    os.environ['TABLE_NAME'] = args.table
+    print(build(_get_table(), args.user))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Build the tag catalog (TAGS entity with per-tag counters) from TAG# entities.
+
+    python -m scripts.build_tag_catalog [--table NAME] [--user USERNAME]
+
+The catalog is replaced with counts of the TAG# references, so the
+script can be run again safely. Tags changed while it runs may be
+counted wrong, run it when the users are not tagging links.
+'''
+import os
+import argparse
+from collections import Counter, defaultdict
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from app.db import _get_table, TAG_CATALOG_SK
+from app.utils.crypto import filter_keyword as f_k
+
+
+def iter_tag_refs(table, username: str = None):
+    kwargs = dict(ProjectionExpression='PK, SK')
+    if username:
+        kwargs['KeyConditionExpression'] = Key('PK').eq(f'USER#{f_k(username)}') &\
+            Key('SK').begins_with('TAG#')
+        read = table.query
+    else:
+        kwargs['FilterExpression'] = Attr('SK').begins_with('TAG#')
+        read = table.scan
+    while True:
+        resp = read(**kwargs)
+        yield from resp['Items']
+        if 'LastEvaluatedKey' not in resp:
+            return
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def build(table, username: str = None) -> dict:
+    counts = defaultdict(Counter)
+    if username:
+        counts[f'USER#{f_k(username)}']
+    for ref in iter_tag_refs(table, username):
+        counts[ref['PK']][ref['SK'][len('TAG#'):].rsplit('#', 1)[0]] += 1
+    with table.batch_writer() as batch:
+        for pk, tags in counts.items():
+            item = {'PK': pk, 'SK': TAG_CATALOG_SK}
+            item.update({f'T#{tag}': count for tag, count in tags.items()})
+            batch.put_item(Item=item)
+    return {'users': len(counts), 'tags': sum(len(tags) for tags in counts.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default=os.environ.get('TABLE_NAME'))
+    parser.add_argument('--user', help='build only this user')
+    args = parser.parse_args()
+    os.environ['TABLE_NAME'] = args.table
+    print(build(_get_table(), args.user))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''
+Import links for a user from a JSON/NDJSON, CSV or Netscape bookmark file.
+
+    python -m scripts.import_links USERNAME FILE [--format html] [--workers 4]
+
+The file is read in chunks and written by parallel workers, a
+transaction of whole links at a time.
+'''
+import os
+import sys
+import argparse
+
+from app.db import db_import_links
+from app.utils.importers import PARSERS, detect_format, iter_file_chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('username')
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=list(PARSERS))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--table', default=os.environ.get('TABLE_NAME'))
+    args = parser.parse_args()
+    os.environ['TABLE_NAME'] = args.table
+    file_format = args.format or detect_format(args.file)
+    if file_format not in PARSERS:
+        parser.error('can not detect the file format, use --format')
+
+    def progress(report):
+        print(f'\rread {report["read"]}, imported {report["imported"]}, '
+            f'duplicates {report["duplicates"]}, invalid {report["invalid"]}, '
+            f'failed {report["failed"]}', end='', file=sys.stderr)
+
+    with open(args.file, 'rb') as f:
+        records = PARSERS[file_format](iter_file_chunks(f))
+        report = db_import_links(args.username, records, args.workers, progress)
+    print(file=sys.stderr)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+Rewrite old TAG#<tag>#<created> entities, which were full copies of
+the link, into references holding only `created`.
+
+    python -m scripts.migrate_tag_refs [--table NAME] [--dry-run]
+
+The script is idempotent, already migrated entities are skipped.
+'''
+import os
+import argparse
+
+from boto3.dynamodb.conditions import Attr
+
+from app.db import _get_table
+
+
+def iter_tag_copies(table):
+    kwargs = dict(
+        FilterExpression=Attr('SK').begins_with('TAG#') & Attr('url').exists(),
+        ProjectionExpression='PK, SK, created',
+    )
+    while True:
+        resp = table.scan(**kwargs)
+        yield from resp['Items']
+        if 'LastEvaluatedKey' not in resp:
+            return
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def migrate(table, dry_run: bool = False) -> int:
+    migrated = 0
+    with table.batch_writer() as batch:
+        for item in iter_tag_copies(table):
+            migrated += 1
+            if not dry_run:
+                batch.put_item(Item={
+                    'PK': item['PK'],
+                    'SK': item['SK'],
+                    'created': item['created'],
+                })
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default=os.environ.get('TABLE_NAME'))
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    os.environ['TABLE_NAME'] = args.table
+    count = migrate(_get_table(), args.dry_run)
+    action = 'to migrate' if args.dry_run else 'migrated'
+    print(f'{count} TAG# entities {action}')
+
+
+if __name__ == '__main__':
+    main()
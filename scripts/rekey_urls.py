@@ -0,0 +1,88 @@
+'''
+Re-key links stored before urls were canonicalized: set GSI1SK to the
+canonical url and create the URL#<key> entities.
+
+    python -m scripts.rekey_urls [--table NAME] [--user USERNAME] [--dry-run]
+
+If a user has several links with the same canonical url, the oldest
+one gets the URL# entity and the others are reported as duplicates,
+nothing is deleted. The script is idempotent.
+'''
+import os
+import argparse
+from collections import Counter
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from app.db import _get_table
+from app.utils.crypto import filter_keyword as f_k
+from app.utils.urls import canonical_url, url_key
+
+
+def iter_links(table, username: str = None):
+    kwargs = dict(ProjectionExpression='PK, SK, created, GSI1SK, #u',
+        ExpressionAttributeNames={'#u': 'url'})
+    if username:
+        kwargs['KeyConditionExpression'] = Key('PK').eq(f'USER#{f_k(username)}') &\
+            Key('SK').begins_with('LINK#')
+        read = table.query
+    else:
+        kwargs['FilterExpression'] = Attr('SK').begins_with('LINK#')
+        read = table.scan
+    while True:
+        resp = read(**kwargs)
+        yield from resp['Items']
+        if 'LastEvaluatedKey' not in resp:
+            return
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def rekey(table, username: str = None, dry_run: bool = False) -> dict:
+    report = {'links': 0, 'rekeyed': 0, 'duplicates': 0}
+    urls = Counter()
+    for link in iter_links(table, username):
+        report['links'] += 1
+        canonical = canonical_url(link['url'])
+        urls[link['PK'], url_key(canonical)] += 1
+        if dry_run:
+            report['rekeyed'] += link.get('GSI1SK') != f'LINK#{canonical}'
+            continue
+        if link.get('GSI1SK') != f'LINK#{canonical}':
+            table.update_item(
+                Key={'PK': link['PK'], 'SK': link['SK']},
+                UpdateExpression='SET GSI1SK = :k',
+                ExpressionAttributeValues={':k': f'LINK#{canonical}'},
+            )
+            report['rekeyed'] += 1
+        # the oldest link keeps the url whatever order links come in
+        try:
+            table.put_item(
+                Item={
+                    'PK': link['PK'],
+                    'SK': f'URL#{url_key(canonical)}',
+                    'created': link['created'],
+                },
+                ConditionExpression='attribute_not_exists(SK) OR created > :c',
+                ExpressionAttributeValues={':c': link['created']},
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+    report['duplicates'] = sum(count - 1 for count in urls.values())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default=os.environ.get('TABLE_NAME'))
+    parser.add_argument('--user', help='re-key only this user')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    os.environ['TABLE_NAME'] = args.table
+    print(rekey(_get_table(), args.user, args.dry_run))
+
+
+if __name__ == '__main__':
+    main()
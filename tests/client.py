@@ -0,0 +1,73 @@
+import json
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.repository import get_repository
+from app.main import app
+from app.models.user_mod import UserInDB
+from app.utils import jwt, jobs
+
+@pytest.fixture(autouse=True)
+def jwt_keys(monkeypatch):
+    monkeypatch.setattr(jwt, 'JWT_SECRET_KEY', 'test-secret')
+    monkeypatch.setattr(jwt, 'JWT_REFRESH_SECRET_KEY', 'test-refresh-secret')
+
+def auth_client(username: str) -> TestClient:
+    '''
+    Register `username` in the storage and return a client logged in as it
+    '''
+    get_repository().put_user(UserInDB(username=username, hashpass='x'))
+    client = TestClient(app)
+    token, _ = jwt.create_access_token(username)
+    client.cookies.set('access_token', f'Bearer {token}')
+    return client
+
+class LambdaContext:
+    '''
+    The parts of the Lambda context the app reads
+    '''
+    aws_request_id = 'test-request'
+
+    def __init__(self, remaining_ms: int = 60000):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_ms
+
+@pytest.fixture
+def lambda_invocations(monkeypatch):
+    '''
+    Run as the Lambda function `link-manager`, returns the list of events
+    the function sends to itself instead of invoking it
+    '''
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'link-manager')
+    invocations = []
+    monkeypatch.setattr(jobs, '_invoke',
+        lambda function, event: invocations.append(json.loads(json.dumps(event))))
+    # Mangum runs requests on the event loop of the thread
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield invocations
+    asyncio.set_event_loop(None)
+    loop.close()
+
+def api_event(method: str, path: str, username: str = None, body=None) -> dict:
+    '''
+    API Gateway (HTTP API) event of a request, logged in as `username`
+    '''
+    event = {
+        'version': '2.0',
+        'rawPath': path,
+        'rawQueryString': '',
+        'headers': {'host': 'api.example.com', 'content-type': 'application/json'},
+        'requestContext': {'http': {'method': method, 'path': path,
+            'sourceIp': '192.0.2.1'}},
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False,
+    }
+    if username:
+        token, _ = jwt.create_access_token(username)
+        event['cookies'] = [f'access_token=Bearer {token}']
+    return event
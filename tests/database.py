@@ -1,28 +1,88 @@
-# import pytest
-# import os
-# import moto
-# import boto3
+import pytest
+import os
+import moto
+import boto3
 
-# TABLE_NAME = 'TestLM'
+from app import db
 
-# @pytest.fixture
-# def lambda_environment():
-#     os.environ['TABLE_NAME'] = TABLE_NAME
+TABLE_NAME = 'TestLM'
 
-# @pytest.fixture
-# def data_table():
-#     with moto.mock_dynamodb():
-#         client = boto3.client('dynamodb')
-#         client.create_table(
-#             AttributeDefinitions=[
-#                 {'AttributeName': 'PK', 'AttributeType': 'S'},
-#                 {'AttributeName': 'SK', 'AttributeType': 'S'},
-#             ],
-#             TableName=TABLE_NAME,
-#             KeySchema=[
-#                 {'AttributeName': 'PK', 'KeyType': 'HASH'},
-#                 {'AttributeName': 'SK', 'KeyType': 'RANGE'},
-#             ],
-#             BillingMode='PAY_PER_REQUEST',
-#         )
-#         yield TABLE_NAME
+@pytest.fixture
+def lambda_environment(monkeypatch):
+    monkeypatch.setenv('TABLE_NAME', TABLE_NAME)
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.delenv('DYNAMODB_ENDPOINT_URL', raising=False)
+    monkeypatch.setenv('ENRICH_LINKS', '0')
+
+def create_table(client, table_name=TABLE_NAME):
+    client.create_table(
+        AttributeDefinitions=[
+            {'AttributeName': 'PK', 'AttributeType': 'S'},
+            {'AttributeName': 'SK', 'AttributeType': 'S'},
+            {'AttributeName': 'GSI1PK', 'AttributeType': 'S'},
+            {'AttributeName': 'GSI1SK', 'AttributeType': 'S'},
+        ],
+        TableName=table_name,
+        KeySchema=[
+            {'AttributeName': 'PK', 'KeyType': 'HASH'},
+            {'AttributeName': 'SK', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'GSI1-index',
+            'KeySchema': [
+                {'AttributeName': 'GSI1PK', 'KeyType': 'HASH'},
+                {'AttributeName': 'GSI1SK', 'KeyType': 'RANGE'},
+            ],
+            'Projection': {'ProjectionType': 'ALL'},
+        }],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+@pytest.fixture
+def data_table(lambda_environment):
+    with moto.mock_aws():
+        create_table(boto3.client('dynamodb'))
+        db.reset_table()
+        db.clear_caches()
+        yield TABLE_NAME
+        db.reset_table()
+        db.clear_caches()
+
+def put_links(username: str, count: int, table_name=TABLE_NAME, tags=()):
+    '''
+    Write `count` links straight to the table, one per second starting
+    from 2023-01-01T00:00:00, returns their timestamps
+    '''
+    table = boto3.resource('dynamodb').Table(table_name)
+    created_list = []
+    with table.batch_writer() as batch:
+        for i in range(count):
+            created = f'2023-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}'
+            batch.put_item(Item={
+                'PK': f'USER#{username}',
+                'SK': f'LINK#{created}',
+                'created': created,
+                'title': f'Link {i}',
+                'url': f'https://example.com/{i}',
+                'icon': None,
+                'tags': list(tags),
+                'GSI1PK': f'USER#{username}',
+                'GSI1SK': f'LINK#https://example.com/{i}',
+            })
+            created_list.append(created)
+    return created_list
+
+def put_tag_refs(username: str, tag: str, created_list, table_name=TABLE_NAME):
+    '''
+    Write TAG# references of `tag` for links with the given timestamps
+    '''
+    table = boto3.resource('dynamodb').Table(table_name)
+    with table.batch_writer() as batch:
+        for created in created_list:
+            batch.put_item(Item={
+                'PK': f'USER#{username}',
+                'SK': f'TAG#{tag}#{created}',
+                'created': created,
+            })
@@ -0,0 +1,18 @@
+import pytest
+
+from benchmarks import bench_db
+from .database import data_table, lambda_environment
+
+BASELINE = bench_db.load_baseline()
+QUICK_CASES = [case for case in bench_db.CASES if case.quick]
+
+@pytest.mark.parametrize('case', QUICK_CASES, ids=[case.name for case in QUICK_CASES])
+def test_calls_within_baseline(data_table, case):
+    '''
+    DynamoDB calls and items of the hot paths, update the baseline with
+    `python -m benchmarks.bench_db --update` when a change is intended
+    '''
+    base = BASELINE['cases'][case.name]
+    result = bench_db.run_case(case)
+    thresholds = {metric: BASELINE['thresholds'][metric] for metric in ('calls', 'items')}
+    assert bench_db.compare(result, base, thresholds) == []
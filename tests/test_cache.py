@@ -0,0 +1,60 @@
+from app import db
+from app.models.link_mod import LinkInp
+from app.utils.cache import LRUCache, VersionedCache, TTLCache
+from .database import data_table, lambda_environment, put_links
+
+def test_lru_cache_evicts_by_size():
+    cache = LRUCache(max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    cache.get('a')
+    cache.set('c', b'1234')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234' and cache.get('c') == b'1234'
+    assert cache.size == 8
+    cache.set('big', b'x' * 11)
+    assert cache.get('big') is None
+
+def test_versioned_cache_bump_invalidates_namespace():
+    cache = VersionedCache(LRUCache())
+    loads = []
+    def loader():
+        loads.append(1)
+        return [len(loads)]
+    assert cache.get_or_load('john', 'k', loader) == [1]
+    assert cache.get_or_load('john', 'k', loader) == [1]
+    assert cache.get_or_load('alice', 'k', loader) == [2]
+    cache.bump('john')
+    assert cache.get_or_load('john', 'k', loader) == [3]
+    assert cache.get_or_load('alice', 'k', loader) == [2]
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 3
+
+def test_ttl_cache_lru_order():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1
+
+def test_link_cache_is_off_by_default(data_table):
+    put_links('john', 2)
+    db.db_get_links_by_user('john')
+    db.db_get_links_by_user('john')
+    assert db.link_cache_stats()['hits'] == db.link_cache_stats()['misses'] == 0
+
+def test_link_reads_are_invalidated_by_writes(data_table, monkeypatch):
+    monkeypatch.setattr(db._link_cache, 'ttl', 5)
+    created = put_links('john', 2)
+    assert len(db.db_get_links_by_user('john')) == 2
+    assert len(db.db_get_links_by_user('john')) == 2
+    assert db.link_cache_stats()['hits'] == 1
+    db.db_put_link('john', LinkInp(url='https://new.com'))
+    assert len(db.db_get_links_by_user('john')) == 3
+    assert db.db_get_links_by_tag('john', 'x') == []
+    db.db_put_tag('john', created[0], 'x')
+    assert len(db.db_get_links_by_tag('john', 'x')) == 1
+    db.db_delete_tag('john', created[0], 'x')
+    assert db.db_get_links_by_tag('john', 'x') == []
+    db.db_delete_link('john', created[0])
+    assert len(db.db_get_links_by_user('john')) == 2
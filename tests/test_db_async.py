@@ -0,0 +1,101 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from app import db_async
+from app.db import _get_table
+from app.models.link_mod import LinkInp
+from app.models.user_mod import UserInDB
+from .database import data_table, lambda_environment
+
+RTT = 0.05 # simulated DynamoDB round trip, seconds
+
+def _slow_network(**kwargs):
+    time.sleep(RTT)
+
+def _timed(coro_factory) -> float:
+    async def run():
+        start = time.perf_counter()
+        await coro_factory()
+        return time.perf_counter() - start
+    return asyncio.run(run())
+
+def test_async_roundtrip(data_table):
+    async def scenario():
+        await db_async.db_put_user(UserInDB(username='john', hashpass='x'))
+        link = await db_async.db_put_link('john', LinkInp(url='https://a.com', title='A'))
+        links = await db_async.db_get_links_by_user('john')
+        user = await db_async.db_get_user('john')
+        return link, links, user
+    link, links, user = asyncio.run(scenario())
+    assert user.username == 'john'
+    assert [l.url for l in links] == [link.url]
+
+def test_throughput_scales_with_concurrent_clients(data_table):
+    asyncio.run(db_async.db_put_user(UserInDB(username='john', hashpass='x')))
+    _get_table().meta.client.meta.events.register('before-call.dynamodb', _slow_network)
+    clients = 8
+
+    async def sequential():
+        for _ in range(clients):
+            await db_async.db_get_user('john')
+
+    async def concurrent():
+        await asyncio.gather(*(db_async.db_get_user('john') for _ in range(clients)))
+
+    seq_time = _timed(sequential)
+    conc_time = _timed(concurrent)
+    rates = f'sequential {clients / seq_time:.1f} req/s, concurrent {clients / conc_time:.1f} req/s'
+    assert seq_time >= clients * RTT, rates
+    assert conc_time < seq_time / 3, rates
+
+def test_event_loop_is_not_blocked(data_table):
+    _get_table().meta.client.meta.events.register('before-call.dynamodb', _slow_network)
+
+    async def scenario():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(RTT / 10)
+                ticks += 1
+        task = asyncio.create_task(ticker())
+        await db_async.db_get_user('john')
+        task.cancel()
+        return ticks
+    assert asyncio.run(scenario()) >= 5
+
+def test_cancelled_stream_closes_generator_after_next(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    closed = []
+    class Repository:
+        def iter_links_by_user(self, username):
+            try:
+                yield 1
+                started.set()
+                release.wait()
+                yield 2
+            finally:
+                closed.append(username)
+    monkeypatch.setattr(db_async, 'get_repository', Repository)
+
+    async def scenario():
+        links = db_async.db_iter_links_by_user('john')
+        assert await links.__anext__() == 1
+        task = asyncio.ensure_future(links.__anext__())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        task.cancel()
+        try:
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # next() is still running, the generator can't be closed yet
+            assert closed == []
+        finally:
+            release.set()
+    asyncio.run(scenario())
+    deadline = time.monotonic() + 5
+    while not closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert closed == ['john']
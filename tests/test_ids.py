@@ -0,0 +1,41 @@
+import threading
+from datetime import datetime, timedelta
+
+from app.utils import ids
+from app.utils.ids import LinkIdGenerator
+
+def test_ids_sort_by_time_then_sequence():
+    now = datetime(2026, 1, 2, 3, 4, 5, 6)
+    clock = [now, now, now - timedelta(seconds=1), now + timedelta(microseconds=1)]
+    new_id = LinkIdGenerator(lambda: clock.pop(0))
+    made = [new_id() for _ in range(4)]
+    assert made == sorted(made) and len(set(made)) == 4
+    assert [i[:26] for i in made] == ['2026-01-02T03:04:05.000006'] * 3 +\
+        ['2026-01-02T03:04:05.000007']
+    # the clock went back, the sequence goes on
+    assert [i[27:30] for i in made] == ['000', '001', '002', '000']
+    # ids with seconds precision sort before the new ids of their second
+    assert '2026-01-02T03:04:04' < '2026-01-02T03:04:05' < made[0] < '2026-01-02T03:04:06'
+
+def test_sequence_overflow_moves_to_next_microsecond(monkeypatch):
+    monkeypatch.setattr(ids, 'SEQUENCE_CHARS', 1)
+    now = datetime(2026, 1, 1)
+    new_id = LinkIdGenerator(lambda: now)
+    made = [new_id() for _ in range(40)]
+    assert made == sorted(made) and len(set(made)) == 40
+    assert made[31][:26] == '2026-01-01T00:00:00.000000'
+    assert made[32][:26] == '2026-01-01T00:00:00.000001'
+
+def test_ids_of_many_threads_are_unique():
+    new_id = LinkIdGenerator()
+    made = [[] for _ in range(8)]
+    def worker(out: list):
+        for _ in range(5000):
+            out.append(new_id())
+    threads = [threading.Thread(target=worker, args=(out,)) for out in made]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(out == sorted(out) for out in made)
+    assert len({i for out in made for i in out}) == 40000
@@ -0,0 +1,24 @@
+import time
+
+from app.utils import jwt
+from .client import jwt_keys
+
+def test_verified_tokens_are_cached():
+    jwt._verified_cache.clear()
+    token, _ = jwt.create_access_token('john')
+    first = jwt.decode_subject(token)
+    first['sub'] = 'changed'
+    assert jwt.decode_subject(token)['sub'] == 'john'
+    stats = jwt.jwt_cache_stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert jwt.decode_subject(token, refresh=True) == {}
+
+def test_cached_token_expires_with_exp():
+    jwt._verified_cache.clear()
+    token, _ = jwt.create_access_token('john', expires_mins=1 / 60)
+    payload = jwt.decode_subject(token)
+    assert payload['sub'] == 'john'
+    time.sleep(max(0, payload['exp'] - time.time()) + 0.1)
+    assert jwt._verified_cache.get(jwt._cache_key(token, jwt.JWT_SECRET_KEY)) is None
+    time.sleep(1) # jose still accepts the token during the `exp` second
+    assert jwt.decode_subject(token) == {}
@@ -0,0 +1,529 @@
+import io
+import csv
+import gzip
+import json
+import pickle
+import sys
+import asyncio
+import subprocess
+import pytest
+from decimal import Decimal
+from datetime import datetime
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from fastapi.encoders import jsonable_encoder
+
+from app import db
+from app.models import link_mod
+from app.models.link_mod import Link, LinkInp, link_model
+from app.utils.export import ExportWriter, export_stream
+from app.utils.tag_catalog import TagCatalog
+from app.utils.serialize import json_dumps, link_adapter
+from app.utils.urls import canonical_url
+from app.utils.ids import LinkIdGenerator
+from scripts.build_tag_catalog import build as build_tag_catalog
+from scripts.rekey_urls import rekey as rekey_urls
+from .database import data_table, lambda_environment, put_links, put_tag_refs
+from .client import jwt_keys, auth_client
+
+def test_pages_follow_cursor(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'MAX_PAGE_SIZE', 4)
+    created = put_links('john', 10)
+    client = auth_client('john')
+    seen, cursor = [], None
+    while True:
+        params = {'limit': 100}
+        if cursor:
+            params['cursor'] = cursor
+        resp = client.get('/get_my_links', params=params)
+        assert resp.status_code == 200
+        page = resp.json()
+        assert len(page) <= 4
+        seen.extend(l['created'] for l in page)
+        cursor = resp.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == created[::-1]
+
+def test_stream_returns_every_link(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'MAX_PAGE_SIZE', 3)
+    created = put_links('john', 10)
+    client = auth_client('john')
+    resp = client.get('/get_my_links', params={'stream': True})
+    assert resp.headers['content-type'] == 'application/x-ndjson'
+    lines = resp.text.splitlines()
+    assert len(lines) == 10
+    assert lines[0].startswith('{') and created[-1] in lines[0]
+
+def test_foreign_cursor_is_rejected(data_table):
+    put_links('alice', 3)
+    _, cursor = db.db_get_links_page('alice', limit=1)
+    client = auth_client('john')
+    resp = client.get('/get_my_links', params={'cursor': cursor})
+    assert resp.status_code == 400
+    resp = client.get('/get_my_links', params={'cursor': 'garbage!'})
+    assert resp.status_code == 400
+
+def test_get_links_by_user_reads_past_first_page(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'MAX_PAGE_SIZE', 2)
+    put_links('john', 7)
+    assert len(db.db_get_links_by_user('john')) == 7
+    assert len(db.db_get_links_by_user('john', limit=5)) == 5
+
+def test_put_tag_is_one_transaction(data_table):
+    created = put_links('john', 1, tags=())[0]
+    db.db_put_tag('john', created, 'a')
+    db.db_put_tag('john', created, 'b')
+    links = db.db_get_links_by_tag('john', 'a')
+    assert [l.tags for l in links] == [['a', 'b']]
+    assert db.db_get_links_by_tag('john', 'b')[0].tags == ['a', 'b']
+
+def test_add_tags_endpoint(data_table):
+    created = put_links('john', 3)
+    client = auth_client('john')
+    pairs = [{'link_timestamp': ts, 'tagname': tag}
+        for ts in created[:2] for tag in ('x', 'y')]
+    pairs.append({'link_timestamp': created[0], 'tagname': 'x'})
+    pairs.append({'link_timestamp': 'nope', 'tagname': 'x'})
+    resp = client.post('/add_tags', json=pairs)
+    report = resp.json()
+    assert report['added'] == 4
+    assert report['calls'] == {'BatchGetItem': 1, 'TransactWriteItems': 2}
+    assert [s['reason'] for s in report['skipped']] == ['link does not exist']
+    assert len(db.db_get_links_by_tag('john', 'y')) == 2
+    report = client.post('/add_tags', json=pairs[:1]).json()
+    assert report['added'] == 0 and report['calls'] == {'BatchGetItem': 1}
+
+def test_put_tag_splits_big_transactions(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'TRANSACT_MAX_ITEMS', 3)
+    created = put_links('john', 1)[0]
+    report = db.db_put_tags('john', [(created, t) for t in 'abcde'])
+    # link, catalog and 1 ref, then 3 and 1 refs
+    assert report['calls']['TransactWriteItems'] == 3
+    db.db_put_tag('john', created, 'f')
+    for tag in 'abcdef':
+        assert db.db_get_links_by_tag('john', tag)[0].tags == list('abcdef')
+
+def test_tag_entities_are_references(data_table):
+    created = put_links('john', 1)[0]
+    for tag in 'abc':
+        db.db_put_tag('john', created, tag)
+    ref = db._get_table().get_item(
+        Key={'PK': 'USER#john', 'SK': f'TAG#b#{created}'})['Item']
+    assert ref == {'PK': 'USER#john', 'SK': f'TAG#b#{created}', 'created': created}
+    db.db_delete_tag('john', created, 'a')
+    assert db.db_get_link_by_id('john', created).tags == ['b', 'c']
+    assert db.db_get_links_by_tag('john', 'a') == []
+    assert [l.tags for l in db.db_get_links_by_tag('john', 'c')] == [['b', 'c']]
+
+def test_put_tag_errors(data_table):
+    created = put_links('john', 1)[0]
+    db.db_put_tag('john', created, 'a')
+    with pytest.raises(ValueError, match='already exists'):
+        db.db_put_tag('john', created, 'a')
+    with pytest.raises(ValueError, match='does not exist'):
+        db.db_put_tag('john', '1999-01-01T00:00:00', 'a')
+    # the message has the number of tags, not the tags
+    with pytest.raises(ValueError, match=r'^A tag already exists \(3 tags, transaction 1\)$'):
+        db._db_add_tags_to_link('john', created, ['x' * 100, 'a', 'y' * 100])
+
+def _tagged(created):
+    # deterministic tags with skewed cardinalities
+    return {
+        'common': created[:],
+        'half': created[::2],
+        'third': created[::3],
+        'rare': created[::97],
+    }
+
+def _eval(expr, tagged, created):
+    # reference evaluation with python sets
+    sets = {tag: set(ids) for tag, ids in tagged.items()}
+    code = expr.replace('(', ' ( ').replace(')', ' ) ').split()
+    py = []
+    for token in code:
+        if token == 'AND': py.append('&')
+        elif token == 'OR': py.append('|')
+        elif token == 'NOT': py.append('universe -')
+        elif token in '()': py.append(token)
+        else: py.append(f'sets.get({token!r}, set())')
+    found = eval(' '.join(py), {'sets': sets, 'universe': set(created)})
+    return sorted(found, reverse=True)
+
+@pytest.mark.parametrize('expr', [
+    'half', 'half AND third', 'rare AND common', 'common AND NOT half',
+    'half OR third', 'NOT half', '( rare OR third ) AND NOT half',
+    'common AND NOT ( half OR third )', 'nope OR rare',
+])
+def test_links_by_tags(data_table, monkeypatch, expr):
+    monkeypatch.setattr(db, 'TAG_QUERY_PAGE_SIZE', 8)
+    created = put_links('john', 300)
+    tagged = _tagged(created)
+    for tag, ids in tagged.items():
+        put_tag_refs('john', tag, ids)
+    client = auth_client('john')
+    seen, cursor = [], None
+    while True:
+        params = {'q': expr, 'limit': 7}
+        if cursor:
+            params['cursor'] = cursor
+        resp = client.get('/get_links_by_tags', params=params)
+        assert resp.status_code == 200
+        seen.extend(l['created'] for l in resp.json())
+        cursor = resp.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == _eval(expr, tagged, created)
+
+def test_links_by_tags_seeks_past_common_refs(data_table):
+    created = put_links('john', 1000)
+    put_tag_refs('john', 'common', created)
+    put_tag_refs('john', 'rare', created[::250])
+    read = []
+    def count(parsed, **kwargs):
+        read.append(parsed.get('Count', 0))
+    events = db._get_table().meta.client.meta.events
+    events.register('after-call.dynamodb.Query', count)
+    try:
+        links, cursor = db.db_get_links_by_tags('john', 'rare AND common', limit=100)
+    finally:
+        events.unregister('after-call.dynamodb.Query', count)
+    assert [l.created for l in links] == created[::250][::-1]
+    assert cursor is None
+    # every rare ref costs at most one page of the common range, not 1000 refs
+    assert sum(read) <= 5 * 101 + 4
+
+def test_links_by_tags_bad_input(data_table):
+    client = auth_client('john')
+    for q in ('AND', 'a OR', '(a', 'a )', 'NOT'):
+        assert client.get('/get_links_by_tags', params={'q': q}).status_code == 400
+    resp = client.get('/get_links_by_tags', params={'q': 'a', 'cursor': 'garbage!'})
+    assert resp.status_code == 400
+
+def test_tag_catalog_counts(data_table, monkeypatch):
+    monkeypatch.setattr(db._link_cache, 'ttl', 5)
+    created = put_links('john', 4)
+    db.db_put_tags('john', [(ts, 'python') for ts in created] +
+        [(created[0], 'perf'), (created[1], 'perf'), (created[2], 'pyramid')])
+    db.db_delete_tag('john', created[2], 'pyramid')
+    db.db_delete_link('john', created[0])
+    import_file = json.dumps([{'url': 'https://new.com', 'tags': ['perf', 'news']}])
+    client = auth_client('john')
+    client.post('/import', files={'file': ('links.json', import_file)})
+    calls = []
+    events = db._get_table().meta.client.meta.events
+    events.register('before-parameter-build.dynamodb', lambda model, **kw: calls.append(model.name))
+    resp = client.get('/tags')
+    assert resp.json() == [{'tag': 'python', 'count': 3},
+        {'tag': 'perf', 'count': 2}, {'tag': 'news', 'count': 1}]
+    # one read, then the zero counter of `pyramid` is removed
+    assert calls == ['GetItem', 'UpdateItem']
+    calls.clear()
+    resp = client.get('/tags/suggest', params={'prefix': 'p'})
+    assert [t['tag'] for t in resp.json()] == ['python', 'perf']
+    assert calls == [] # served from the cache
+    assert 'T#pyramid' not in db._get_table().get_item(Key=db._tag_catalog_key('john'))['Item']
+
+def test_tag_catalog_suggest():
+    catalog = TagCatalog({'py': 1, 'python': 5, 'pytest': 5, 'rust': 9, 'old': 0})
+    assert catalog.suggest('py') == [('pytest', 5), ('python', 5), ('py', 1)]
+    assert catalog.suggest('py', limit=1) == [('pytest', 5)]
+    assert catalog.suggest('x') == []
+    assert catalog.top() == [('rust', 9), ('pytest', 5), ('python', 5), ('py', 1)]
+    assert 'old' not in catalog and 'rust' in catalog
+    assert pickle.loads(pickle.dumps(catalog)).suggest('r') == [('rust', 9)]
+
+def test_build_tag_catalog(data_table):
+    created = put_links('john', 3)
+    put_tag_refs('john', 'a', created)
+    put_tag_refs('john', 'b', created[:1])
+    assert build_tag_catalog(db._get_table(), 'john') == {'users': 1, 'tags': 2}
+    assert db.db_get_tag_catalog('john').top() == [('a', 3), ('b', 1)]
+    # the username is keyed the way app.db keys it
+    put_tag_refs('john_doe', 'c', put_links('john_doe', 2))
+    assert build_tag_catalog(db._get_table(), 'John Doe') == {'users': 1, 'tags': 1}
+    assert db.db_get_tag_catalog('John Doe').top() == [('c', 2)]
+
+@pytest.mark.parametrize('url, canonical', [
+    ('HTTPS://Example.COM:443', 'https://example.com/'),
+    ('http://example.com:8080/a/', 'http://example.com:8080/a'),
+    ('https://example.com/a?utm_source=x&b=2&a=1&fbclid=y', 'https://example.com/a?a=1&b=2'),
+    ('https://example.com/a#section', 'https://example.com/a'),
+    ('https://example.com/app#/route', 'https://example.com/app#/route'),
+    ('https://user@Example.com./a b', 'https://user@example.com/a b'),
+])
+def test_canonical_url(url, canonical):
+    assert canonical_url(url) == canonical
+    assert canonical_url(canonical) == canonical
+
+def test_url_lookup_is_exact(data_table):
+    db.db_put_link('john', LinkInp(url='https://a.com/long/path'))
+    assert db.db_get_link_by_url('john', 'https://a.com') == []
+    calls = []
+    events = db._get_table().meta.client.meta.events
+    events.register('before-parameter-build.dynamodb', lambda model, **kw: calls.append(model.name))
+    found = db.db_get_link_by_url('john', 'HTTPS://A.com/long/path/?utm_medium=mail#top')
+    assert [l.url for l in found] == ['https://a.com/long/path']
+    assert calls == ['GetItem', 'GetItem']
+
+def test_duplicate_links(data_table):
+    client = auth_client('john')
+    first = client.post('/add_link', json={'url': 'https://a.com/x'}).json()['Message']
+    resp = client.post('/add_link', params={'on_duplicate': 'reject'},
+        json={'url': 'https://A.com/x/?utm_source=feed'})
+    assert resp.status_code == 409
+    merged = client.post('/add_link', json={'url': 'https://a.com/x#top', 'title': 'Xylo'})
+    assert merged.json()['Message']['created'] == first['created']
+    assert merged.json()['Message']['title'] == 'Xylo'
+    assert [l['title'] for l in client.get('/search', params={'q': 'xyl'}).json()] == ['Xylo']
+    client.delete('/delete_link', params={'link_timestamp': first['created']})
+    assert db.db_get_link_by_url('john', 'https://a.com/x') == []
+    resp = client.post('/add_link', params={'on_duplicate': 'reject'},
+        json={'url': 'https://a.com/x'})
+    assert resp.status_code == 200
+
+def test_new_ids_sort_with_old_ones(data_table, monkeypatch):
+    old = put_links('john', 3) # seconds precision
+    clock = lambda: datetime(2023, 1, 1, 0, 0, 1, 500000)
+    monkeypatch.setattr(db, 'new_link_id', LinkIdGenerator(clock))
+    new = [db.db_put_link('john', LinkInp(url=f'https://new.com/{i}')).created
+        for i in range(2)]
+    assert new[0].startswith('2023-01-01T00:00:01.500000-') and new[0] < new[1]
+    assert [l.created for l in db.db_get_links_by_user('john')] ==\
+        [old[2], new[1], new[0], old[1], old[0]]
+    assert [l.created for l in db.db_get_links_by_user('john', offset=old[1])] ==\
+        [new[1], new[0], old[1], old[0]]
+    assert db.db_get_link_by_id('john', new[0]).url == 'https://new.com/0'
+
+def test_put_link_retries_taken_id(data_table, monkeypatch):
+    old = put_links('john', 1)
+    ids = iter([old[0], old[0], '2023-01-01T00:00:00.000001-000AAAAAA'])
+    monkeypatch.setattr(db, 'new_link_id', lambda: next(ids))
+    link = db.db_put_link('john', LinkInp(url='https://new.com'))
+    assert link.created == '2023-01-01T00:00:00.000001-000AAAAAA'
+    assert db.db_get_link_by_id('john', old[0]).url == 'https://example.com/0'
+    monkeypatch.setattr(db, 'new_link_id', lambda: old[0])
+    with pytest.raises(ValueError):
+        db.db_put_link('john', LinkInp(url='https://other.com'))
+
+def test_rekey_urls(data_table):
+    created = put_links('john', 3) # https://example.com/0..2 without URL# entities
+    table = db._get_table()
+    table.put_item(Item={'PK': 'USER#john', 'SK': 'LINK#2024-01-01T00:00:00',
+        'created': '2024-01-01T00:00:00', 'url': 'https://EXAMPLE.com/1/', 'tags': [],
+        'GSI1PK': 'USER#john', 'GSI1SK': 'LINK#https://EXAMPLE.com/1/'})
+    assert rekey_urls(table, 'john', dry_run=True) == {'links': 4, 'rekeyed': 1, 'duplicates': 1}
+    assert db.db_get_link_by_url('john', 'https://example.com/1') == []
+    assert rekey_urls(table, 'john') == {'links': 4, 'rekeyed': 1, 'duplicates': 1}
+    db.clear_caches()
+    found = db.db_get_link_by_url('john', 'https://example.com/1')
+    assert [l.created for l in found] == [created[1]]
+    assert rekey_urls(table, 'john') == {'links': 4, 'rekeyed': 0, 'duplicates': 1}
+    assert rekey_urls(table, 'JOHN')['links'] == 4
+
+def test_fields_projection(data_table):
+    created = put_links('john', 3)
+    put_tag_refs('john', 'a', created)
+    client = auth_client('john')
+    requests = []
+    events = db._get_table().meta.client.meta.events
+    events.register('before-parameter-build.dynamodb',
+        lambda params, **kw: requests.append(params))
+    resp = client.get('/get_my_links', params={'fields': 'url, title'})
+    assert resp.json()[0] == {'created': created[-1], 'title': 'Link 2',
+        'url': 'https://example.com/2'}
+    assert requests[-1]['ProjectionExpression'] == '#p0, #p1, #p2'
+    lines = client.get('/get_my_links', params={'fields': 'url', 'stream': True}).text
+    assert json.loads(lines.splitlines()[0]) == {'created': created[-1],
+        'url': 'https://example.com/2'}
+    found = client.get('/get_links_by_tags', params={'q': 'a', 'fields': 'tags'}).json()
+    assert found == [{'created': ts, 'tags': []} for ts in created[::-1]]
+    resp = client.get('/get_link_by_timestamp',
+        params={'timestamp': created[0], 'fields': 'icon'})
+    assert resp.json() == {'created': created[0], 'icon': None}
+    resp = client.get('/get_my_links', params={'fields': 'url,PK'})
+    assert resp.status_code == 400 and 'PK' in resp.json()['detail']
+
+def test_partial_links_pickle_without_module_globals():
+    link = link_model(('created', 'tags'))(created='2023-01-01T00:00:00', tags=['a'])
+    assert pickle.loads(pickle.dumps(link)) == link
+    assert not [name for name in vars(link_mod) if name.startswith('Link_')]
+    # the model is made again where it doesn't exist yet
+    code = ('import pickle, sys; link = pickle.loads(sys.stdin.buffer.read()); '
+        'print(type(link).__name__, link.json())')
+    out = subprocess.run([sys.executable, '-c', code], input=pickle.dumps(link),
+        capture_output=True, check=True).stdout.decode()
+    assert out.strip() == 'Link_created_tags {"created": "2023-01-01T00:00:00", "tags": ["a"]}'
+
+def test_plain_links_match_models(data_table):
+    created = put_links('john', 3)
+    put_tag_refs('john', 'a', created)
+    db.db_update_link_metadata('john', created[0], title='T', icon='https://i.co/x.png',
+        canonical='https://example.com/0')
+    as_json = lambda value: json.loads(json_dumps(value))
+    for fields in (None, ('created', 'url'), ('created', 'tags', 'icon')):
+        reads = [
+            lambda **kw: db.db_get_links_page('john', 10, **kw)[0],
+            lambda **kw: db.db_get_links_by_tag('john', 'a', **kw),
+            lambda **kw: db.db_get_links_by_tags('john', 'a', **kw)[0],
+            lambda **kw: db.db_get_link_by_id('john', created[0], **kw),
+            lambda **kw: db.db_get_link_by_url('john', 'https://example.com/1', **kw),
+        ]
+        for read in reads:
+            assert as_json(read(fields=fields, plain=True)) ==\
+                jsonable_encoder(read(fields=fields))
+    # what boto3 gives for numbers and sets
+    item = {'created': '1', 'url': 'u', 'tags': {'b', 'a'}, 'n': Decimal('2'),
+        'f': Decimal('0.5')}
+    assert as_json(item) == {'created': '1', 'url': 'u', 'tags': ['a', 'b'],
+        'n': 2, 'f': 0.5}
+    assert link_adapter(None)({'url': 'u'}) == {'created': None, 'title': None,
+        'url': 'u', 'icon': None, 'tags': [], 'canonical': None}
+
+def test_import_endpoint(data_table):
+    put_links('john', 1) # https://example.com/0 already exists
+    client = auth_client('john')
+    content = (b'url,title,tags\n'
+        b'https://example.com/0,Old,\n'
+        b'https://a.com,A,"x,y"\n'
+        b'https://b.com,B,x\n'
+        b'https://a.com,A again,\n'
+        b'not a url,,\n')
+    resp = client.post('/import', files={'file': ('links.csv', content)})
+    report = resp.json()
+    assert report['imported'] == 2
+    assert report['duplicates'] == 2
+    assert report['invalid'] == 1
+    assert len(db.db_get_links_by_user('john')) == 3
+    assert [l.url for l in db.db_get_links_by_tag('john', 'x')] == ['https://a.com', 'https://b.com']
+    resp = client.post('/import', files={'file': ('links.txt', content)})
+    assert resp.status_code == 400
+
+def test_import_errors(data_table, monkeypatch):
+    records = [{'url': f'https://example.com/{i}', 'tags': ['x']} for i in range(3)]
+    def throttled(*args, **kwargs):
+        raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException',
+            'Message': 'slow down'}}, 'UpdateItem')
+    # the links are written even if the tag catalog is not updated
+    monkeypatch.setattr(db, '_db_update_tag_catalog', throttled)
+    report = db.db_import_links('john', records)
+    assert (report['imported'], report['failed'], report['calls']) == (3, 0, 3)
+    assert len(db.db_get_links_by_user('john')) == 3
+    monkeypatch.setattr(db._get_table().meta.client, 'transact_write_items', throttled)
+    report = db.db_import_links('alice', records)
+    assert (report['imported'], report['failed']) == (0, 3)
+    # a bug is not reported as failed links
+    monkeypatch.setattr(db, '_import_put', lambda table_name, item: item['Put'])
+    with pytest.raises(KeyError):
+        db.db_import_links('bob', records)
+
+def test_import_writes_every_link_whole(data_table, monkeypatch):
+    # links of 5 items (URL#, LINK#, 3 TAG#), 2 of them per transaction
+    monkeypatch.setattr(db, 'TRANSACT_MAX_ITEMS', 12)
+    records = [{'url': f'https://a.com/{i}', 'tags': ['x', 'y', 'z']} for i in range(5)]
+    client = db._get_table().meta.client
+    transact, sent = client.transact_write_items, []
+    def fail_second(TransactItems):
+        sent.append([put['Put']['Item']['SK'] for put in TransactItems])
+        if len(sent) == 2:
+            raise ClientError({'Error': {'Code': 'InternalServerError',
+                'Message': 'try later'}}, 'TransactWriteItems')
+        return transact(TransactItems=TransactItems)
+    monkeypatch.setattr(client, 'transact_write_items', fail_second)
+    report = db.db_import_links('john', records, workers=1)
+    assert [len(items) for items in sent] == [10, 10, 5]
+    assert (report['imported'], report['failed'], report['calls']) == (3, 2, 6)
+    assert len(db.db_get_links_by_user('john')) == 3
+    # no url of a failed link is left behind
+    monkeypatch.setattr(client, 'transact_write_items', transact)
+    for i in range(5):
+        assert db.db_put_link('john', LinkInp(url=f'https://a.com/{i}')).url ==\
+            f'https://a.com/{i}'
+    assert len(db.db_get_links_by_user('john')) == 5
+
+def test_import_keeps_links_added_meanwhile(data_table):
+    def records():
+        yield {'url': 'https://a.com/0'}
+        # the user adds it while the import runs
+        db.db_put_link('john', LinkInp(url='https://a.com/1', title='Mine'))
+        yield {'url': 'https://a.com/1', 'title': 'Imported'}
+    report = db.db_import_links('john', records())
+    assert (report['imported'], report['duplicates'], report['failed']) == (1, 1, 0)
+    assert [l.title for l in db.db_get_link_by_url('john', 'https://a.com/1')] == ['Mine']
+    assert len(db.db_get_links_by_user('john')) == 2
+
+def test_import_link_bigger_than_a_transaction(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'TRANSACT_MAX_ITEMS', 10)
+    tags = [f't{i}' for i in range(30)]
+    report = db.db_import_links('john', [{'url': 'https://a.com', 'tags': tags}])
+    assert (report['imported'], report['failed']) == (1, 0)
+    assert [l.url for l in db.db_get_links_by_tag('john', 't29')] == ['https://a.com']
+    def failing(**kwargs):
+        raise ClientError({'Error': {'Code': 'InternalServerError',
+            'Message': 'try later'}}, 'TransactWriteItems')
+    monkeypatch.setattr(db._get_table().meta.client, 'transact_write_items', failing)
+    report = db.db_import_links('alice', [{'url': 'https://a.com', 'tags': tags}])
+    assert (report['imported'], report['failed']) == (0, 1)
+    # the items put before the transaction are deleted
+    assert db._get_table().query(KeyConditionExpression=Key('PK').eq('USER#alice'))['Items'] == []
+
+def test_export_resumes_from_cursor(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'MAX_PAGE_SIZE', 4)
+    created = put_links('john', 10, tags=('x',))
+    client = auth_client('john')
+    exported, cursor = [], None
+    for _ in range(10):
+        params = {'max_bytes': 300}
+        if cursor:
+            params['cursor'] = cursor
+        lines = [json.loads(l) for l in client.get('/export', params=params).text.splitlines()]
+        cursor = lines[-1].get('next_cursor')
+        exported.extend(l['created'] for l in lines if 'created' in l)
+        if not cursor:
+            break
+    assert exported == created[::-1]
+    assert lines[0]['tags'] == ['x']
+
+def test_export_csv_gzip(data_table):
+    put_links('john', 3)
+    client = auth_client('john')
+    resp = client.get('/export', params={'format': 'csv', 'gzip': True})
+    assert resp.headers['content-type'] == 'application/gzip'
+    rows = list(csv.reader(io.StringIO(gzip.decompress(resp.content).decode())))
+    assert rows[0] == ['created', 'title', 'url', 'icon', 'tags']
+    assert [r[2] for r in rows[1:]] == [f'https://example.com/{i}' for i in (2, 1, 0)]
+
+def test_export_limit_counts_bytes():
+    links = [Link(created=f'2023-01-01T00:00:0{i}', url=f'https://example.com/{i}',
+        title='Заметки о производительности') for i in range(9)]
+    async def pages():
+        yield links
+    async def export(max_bytes: int) -> bytes:
+        writer = ExportWriter('csv')
+        return b''.join([chunk async for chunk in
+            export_stream(pages(), writer, max_bytes, lambda link: link.created)])
+    row = len(ExportWriter('csv').link(links[0]).encode('utf-8'))
+    lines = asyncio.run(export(600)).decode('utf-8').splitlines(keepends=True)
+    assert lines[-1] == '# next_cursor=2023-01-01T00:00:05\n'
+    # the limit is crossed by the last row at most
+    assert 600 <= len(''.join(lines[:-1]).encode('utf-8')) < 600 + row
+
+def test_search(data_table):
+    client = auth_client('john')
+    links = [
+        {'url': 'https://docs.python.org/3/library/asyncio.html', 'title': 'asyncio - Asynchronous I/O'},
+        {'url': 'https://realpython.com/python-performance', 'title': 'Python Performance Tips'},
+        {'url': 'https://example.com/pythonic', 'title': 'Write idiomatic code'},
+    ]
+    client.post('/import', files={'file': ('links.json', json.dumps(links))})
+    found = client.get('/search', params={'q': 'python'}).json()
+    assert [l['title'] for l in found] == [
+        'Python Performance Tips', 'asyncio - Asynchronous I/O', 'Write idiomatic code']
+    found = client.get('/search', params={'q': 'pyth perf'}).json()
+    assert [l['title'] for l in found] == ['Python Performance Tips']
+    link = db.db_get_link_by_url('john', 'https://realpython.com/python-performance')[0]
+    db.db_delete_link('john', link.created)
+    assert client.get('/search', params={'q': 'perf'}).json() == []
+    assert not [i for i in db._get_table().scan()['Items']
+        if i['SK'].startswith('IDX#') and i['created'] == link.created]
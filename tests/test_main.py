@@ -1,5 +1,12 @@
+import os
+import sys
+import subprocess
+
 from fastapi.testclient import TestClient
+from app import db, main
 from app.main import app
+from scripts.build_openapi import build as build_openapi_file
+from .database import data_table, lambda_environment
 
 client = TestClient(app)
 from app.utils import get_password_hash
@@ -14,3 +21,41 @@ def test_hash():
     hashed_pass = get_password_hash(password)
     assert type(hashed_pass) == str
 
+
+def test_import_skips_lazy_modules():
+    # httpx and jose are only needed once a request uses them
+    code = ('import sys, app.main; '
+        'print(sorted(m for m in ("httpx", "jose") if m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+        text=True, check=True, env={**os.environ, 'LAMBDA_WARMUP': '0'}).stdout
+    assert out.strip() == '[]'
+
+def test_prebuilt_openapi(tmp_path, monkeypatch):
+    path = tmp_path / 'openapi.json'
+    schema = build_openapi_file(str(path))
+    assert schema == main.build_openapi()
+    monkeypatch.setenv('OPENAPI_SCHEMA_FILE', str(path))
+    monkeypatch.setattr(main, 'build_openapi', None) # must not be called
+    monkeypatch.setattr(main.app, 'openapi_schema', None)
+    assert TestClient(main.app).get('/openapi.json').json() == schema
+
+def test_packaged_openapi_on_lambda(tmp_path, monkeypatch):
+    path = tmp_path / 'openapi.json'
+    path.write_text('{"openapi": "3.0.2", "paths": {}}')
+    monkeypatch.setattr(main, 'PACKAGED_OPENAPI_SCHEMA', str(path))
+    monkeypatch.delenv('OPENAPI_SCHEMA_FILE', raising=False)
+    monkeypatch.setattr(main.app, 'openapi_schema', None)
+    assert main.custom_openapi()['paths'] != {} # not on Lambda
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'link-manager')
+    monkeypatch.setattr(main.app, 'openapi_schema', None)
+    assert main.custom_openapi() == {'openapi': '3.0.2', 'paths': {}}
+
+def test_warmup(data_table):
+    requests = []
+    main.warmup()
+    events = db._get_table().meta.client.meta.events
+    events.register('before-parameter-build.dynamodb',
+        lambda model, **kw: requests.append(model.name))
+    main.warmup()
+    assert requests == ['GetItem']
+    assert main.app.middleware_stack is not None
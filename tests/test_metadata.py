@@ -0,0 +1,182 @@
+import time
+import json
+import socket
+import asyncio
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from app import db, main
+from app.utils import metadata
+from app.utils.metadata import MetadataFetcher, parse_metadata
+from .database import data_table, lambda_environment
+from .client import (
+    jwt_keys, auth_client, lambda_invocations, api_event, LambdaContext,
+)
+
+PAGES = {
+    '/page': '<html><head><title> Stub\n Page </title>'
+        '<link rel="icon" href="/static/icon.png">'
+        '<link rel="canonical" href="/page?ref=canonical"></head><body>x</body></html>',
+    '/other': '<html><head><meta property="og:title" content="Other"></head></html>',
+}
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            server.hosts.append(self.headers['Host'])
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if self.path.startswith('/slow'):
+                time.sleep(0.1)
+            if self.path == '/redirect':
+                self.send_response(302)
+                self.send_header('Location', '/page')
+                self.end_headers()
+                return
+            body = PAGES.get(self.path.split('?')[0], '<title>Slow</title>').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    server.hits, server.active, server.max_active = Counter(), 0, 0
+    server.hosts = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(metadata, 'ENRICH_ALLOW_PRIVATE', True)
+    metadata.clear_metadata_caches()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    metadata.clear_metadata_caches()
+
+@pytest.fixture
+def fake_dns(monkeypatch):
+    '''
+    `*.test` names resolve to 127.0.0.1, returns the lookups per name
+    '''
+    lookups = Counter()
+    getaddrinfo = socket.getaddrinfo
+    def fake_getaddrinfo(host, port, *args, **kwargs):
+        if isinstance(host, str) and host.endswith('.test'):
+            lookups[host] += 1
+            host = '127.0.0.1'
+        return getaddrinfo(host, port, *args, **kwargs)
+    monkeypatch.setattr(socket, 'getaddrinfo', fake_getaddrinfo)
+    return lookups
+
+def test_parse_metadata():
+    meta = parse_metadata(PAGES['/page'], 'https://a.com/dir/page')
+    assert meta == {'title': 'Stub Page', 'icon': 'https://a.com/static/icon.png',
+        'canonical': 'https://a.com/page?ref=canonical'}
+    assert parse_metadata(PAGES['/other'], 'https://a.com')['title'] == 'Other'
+
+def test_fetch_follows_redirects_and_caches(stub_server):
+    server, base = stub_server
+    fetcher = MetadataFetcher(host_interval=0)
+    async def fetch_together():
+        return await asyncio.gather(*(fetcher.fetch(f'{base}/redirect') for _ in range(3)))
+    metas = asyncio.run(fetch_together())
+    assert metas[0]['title'] == 'Stub Page' and metas[0] == metas[2]
+    assert server.hits == {'/redirect': 1, '/page': 1}
+    # a page without icon gets the one seen on its host
+    meta = asyncio.run(fetcher.fetch(f'{base}/other'))
+    assert meta['icon'] == f'{base}/static/icon.png'
+
+def test_fetch_limits(stub_server):
+    server, base = stub_server
+    fetcher = MetadataFetcher(max_concurrency=2, host_interval=0)
+    async def fetch_many():
+        await asyncio.gather(*(fetcher.fetch(f'{base}/slow{i}') for i in range(6)))
+    asyncio.run(fetch_many())
+    assert server.max_active == 2
+    fetcher = MetadataFetcher(host_interval=0.2)
+    start = time.perf_counter()
+    async def fetch_same_host():
+        await asyncio.gather(*(fetcher.fetch(f'{base}/slow?p={i}') for i in range(3)))
+    asyncio.run(fetch_same_host())
+    assert time.perf_counter() - start >= 0.4
+
+def test_fetch_connects_to_checked_address(stub_server, fake_dns):
+    server, base = stub_server
+    port = server.server_address[1]
+    fetcher = MetadataFetcher(host_interval=0)
+    meta = asyncio.run(fetcher.fetch(f'http://page.test:{port}/page'))
+    assert meta['title'] == 'Stub Page'
+    # resolved once, for the check, a rebinding can't swap the address
+    assert fake_dns == {'page.test': 1}
+    assert server.hosts == [f'page.test:{port}']
+
+def test_slow_host_does_not_block_others(stub_server, fake_dns):
+    server, base = stub_server
+    port = server.server_address[1]
+    fetcher = MetadataFetcher(max_concurrency=1, host_interval=1.0)
+    async def fetch_other_host():
+        first = asyncio.ensure_future(fetcher.fetch(f'http://a.test:{port}/page'))
+        second = asyncio.ensure_future(fetcher.fetch(f'http://a.test:{port}/other'))
+        await asyncio.sleep(0.05) # the second one waits for a.test
+        start = time.perf_counter()
+        await fetcher.fetch(f'http://b.test:{port}/page')
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(first, second)
+        return elapsed
+    assert asyncio.run(fetch_other_host()) < 0.5
+
+def test_private_addresses_are_not_fetched(stub_server, monkeypatch):
+    server, base = stub_server
+    monkeypatch.setattr(metadata, 'ENRICH_ALLOW_PRIVATE', False)
+    assert asyncio.run(MetadataFetcher().fetch(f'{base}/page')) is None
+    assert server.hits == {}
+
+def test_add_link_is_enriched(data_table, stub_server, monkeypatch):
+    server, base = stub_server
+    monkeypatch.setenv('ENRICH_LINKS', '1')
+    monkeypatch.setattr(metadata.fetcher, 'host_interval', 0)
+    resp = auth_client('john').post('/add_link', json={'url': f'{base}/page'})
+    added = resp.json()['Message']
+    assert added['title'] is None and added['icon'] is None
+    link = db.db_get_link_by_id('john', added['created'])
+    assert link.title == 'Stub Page'
+    assert link.icon == f'{base}/static/icon.png'
+    assert link.canonical == f'{base}/page?ref=canonical'
+    assert [l.created for l in db.db_search_links('john', 'stub')] == [link.created]
+    # the user's title is kept, the page isn't fetched again
+    auth_client('alice').post('/add_link', json={'url': f'{base}/page', 'title': 'Mine'})
+    link = db.db_get_links_by_user('alice')[0]
+    assert link.title == 'Mine' and link.icon == f'{base}/static/icon.png'
+    assert server.hits == {'/page': 1}
+
+def test_add_link_on_lambda_does_not_wait_for_fetch(data_table, stub_server,
+    lambda_invocations, monkeypatch):
+    server, base = stub_server
+    monkeypatch.setenv('ENRICH_LINKS', '1')
+    monkeypatch.setattr(metadata.fetcher, 'host_interval', 0)
+    auth_client('john')
+    resp = main.handler(api_event('POST', '/add_link', 'john',
+        {'url': f'{base}/page'}), LambdaContext())
+    assert resp['statusCode'] == 200
+    created = json.loads(resp['body'])['Message']['created']
+    # the page is fetched by the next invocation, not this one
+    assert server.hits == {}
+    assert lambda_invocations == [{'job': 'enrich_link', 'args': {
+        'username': 'john', 'created': created, 'url': f'{base}/page'}}]
+    assert main.handler(lambda_invocations[0], LambdaContext()) ==\
+        {'job': 'enrich_link', 'status': 'done'}
+    assert server.hits == {'/page': 1}
+    assert db.db_get_link_by_id('john', created).title == 'Stub Page'
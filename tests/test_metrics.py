@@ -0,0 +1,93 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import db, db_async
+from app.utils import metrics
+from app.utils.metrics import Counter, Histogram, MetricsMiddleware
+from .database import data_table, lambda_environment, put_links
+from .client import jwt_keys, auth_client
+
+def test_render_format():
+    counter = Counter('c_total', 'A counter', ('op',))
+    counter.inc('get')
+    counter.inc('a "b"', value=0.5)
+    histogram = Histogram('h_seconds', 'A histogram', ('op',), buckets=(0.1, 1))
+    histogram.observe(0.05, 'get')
+    histogram.observe(2, 'get')
+    assert list(counter.lines()) == ['c_total{op="a \\"b\\""} 0.5', 'c_total{op="get"} 1']
+    assert list(histogram.lines()) == [
+        'h_seconds_bucket{op="get",le="0.1"} 1',
+        'h_seconds_bucket{op="get",le="1"} 1',
+        'h_seconds_bucket{op="get",le="+Inf"} 2',
+        'h_seconds_sum{op="get"} 2.05',
+        'h_seconds_count{op="get"} 2',
+    ]
+
+def test_check_resp_raises():
+    db.check_resp('ok', {'ResponseMetadata': {'HTTPStatusCode': 200}})
+    with pytest.raises(Exception, match='<failing>'):
+        db.check_resp('failing', {'ResponseMetadata': {'HTTPStatusCode': 500}})
+
+def test_failed_call_is_counted():
+    # botocore emits it without the operation model
+    metrics._after_call_error(exception=ConnectionError(), context={},
+        event_name='after-call-error.dynamodb.TransactWriteItems')
+    assert any(line.startswith('dynamodb_errors_total{operation="TransactWriteItems",'
+        'code="ConnectionError"}') for line in metrics.db_errors.lines())
+
+def test_metrics_endpoint(data_table, monkeypatch):
+    client = auth_client('john')
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setenv('METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics').status_code == 401
+    resp = client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert '# TYPE dynamodb_calls_total counter' in resp.text
+
+def test_stats_are_exported(data_table):
+    client = auth_client('john')
+    for _ in range(2):
+        client.get('/user/me')
+    lines = metrics.render().splitlines()
+    assert 'cache_hits_total{cache="user"} 1' in lines
+    assert 'cache_misses_total{cache="user"} 1' in lines
+    assert any(line.startswith('cache_entries{cache="jwt"} ') for line in lines)
+    assert any(line.startswith('hash_pool_workers ') for line in lines)
+    assert 'hash_pool_tasks{state="running"} 0' in lines
+    assert '# TYPE log_dropped_records_total counter' in lines
+
+def test_request_usage_per_route_and_user(data_table):
+    put_links('john', 3)
+    client = auth_client('john')
+    requests = metrics.db_calls_per_request.count('/get_my_links')
+    queries = metrics.db_calls.get('Query')
+    route_rcu = metrics.route_capacity.get('/get_my_links', 'read')
+    user_rcu = metrics.user_capacity.get('john', 'read')
+    assert client.get('/get_my_links').status_code == 200
+    assert metrics.db_calls_per_request.count('/get_my_links') == requests + 1
+    assert metrics.db_calls.get('Query') == queries + 1
+    # moto reports consumed capacity of reads
+    assert metrics.route_capacity.get('/get_my_links', 'read') > route_rcu
+    assert metrics.user_capacity.get('john', 'read') > user_rcu
+    assert metrics.http_requests.get('GET', '/get_my_links', '200') >= 1
+
+def test_server_timing_counts_worker_threads(data_table):
+    created = put_links('john', 3)
+    db.db_put_tags('john', [(ts, 'a') for ts in created])
+    app = FastAPI()
+    seen = {}
+
+    @app.get('/work')
+    async def work():
+        await db_async.db_get_link_by_id('john', created[0])
+        # BatchGetItem and the tag Query run in other threads
+        await db_async.db_get_links_by_tags('john', 'a')
+        seen.update(metrics.current_request().calls)
+        return {}
+
+    resp = TestClient(MetricsMiddleware(app, server_timing=True)).get('/work')
+    assert seen == {'GetItem': 1, 'Query': 1, 'BatchGetItem': 1}
+    assert resp.headers['server-timing'].startswith('db;dur=')
+    assert 'desc="3 calls"' in resp.headers['server-timing']
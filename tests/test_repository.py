@@ -0,0 +1,283 @@
+'''
+Contract of the storage backends: every test runs against each of them
+'''
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.repository import Repository, DynamoDBRepository, set_repository
+from app.db_sqlite import SQLiteRepository
+from app.models.link_mod import LinkInp
+from app.models.user_mod import UserInDB
+from .database import data_table, lambda_environment
+from .client import jwt_keys, auth_client
+
+@pytest.fixture(params=['dynamodb', 'sqlite'])
+def repo(request, tmp_path):
+    if request.param == 'dynamodb':
+        request.getfixturevalue('data_table')
+        yield DynamoDBRepository()
+        return
+    repository = SQLiteRepository(str(tmp_path / 'links.db'))
+    yield repository
+    repository.close()
+
+def test_incomplete_backend_is_not_created():
+    class Partial(Repository):
+        def put_link(self, *args, **kwargs):
+            pass
+    with pytest.raises(TypeError, match='get_links_page'):
+        Partial()
+
+def _import(repo, count: int, username: str = 'john') -> list:
+    '''
+    Import `count` links, link i has tag `all` and `even` or `odd`,
+    returns their timestamps in the import order
+    '''
+    report = repo.import_links(username, ({
+        'url': f'https://example.com/{i}',
+        'title': f'Link {i}',
+        'tags': ['all', 'odd' if i % 2 else 'even'],
+    } for i in range(count)))
+    assert report['imported'] == count
+    return [link.created for link in reversed(repo.get_links_by_user(username))]
+
+def test_put_link_keeps_urls_unique(repo):
+    link = repo.put_link('john', LinkInp(url='https://Example.com/a/?utm_source=x'))
+    assert link.title is None and link.tags == []
+    merged = repo.put_link('John', LinkInp(url='https://example.com/a', title='A'))
+    assert (merged.created, merged.title) == (link.created, 'A')
+    with pytest.raises(ValueError):
+        repo.put_link('john', LinkInp(url='https://example.com/a'), on_duplicate='reject')
+    assert repo.get_link_by_url('john', 'https://example.com/a/') == [merged]
+    assert repo.get_link_by_url('alice', 'https://example.com/a') == []
+    assert repo.get_link_by_id('john', link.created, fields=('created', 'url'),
+        plain=True) == {'created': link.created, 'url': 'https://Example.com/a/?utm_source=x'}
+    repo.delete_link('john', link.created)
+    assert repo.get_link_by_id('john', link.created) is None
+    assert repo.get_link_by_url('john', 'https://example.com/a') == []
+    with pytest.raises(ValueError):
+        repo.delete_link('john', link.created)
+
+def test_links_added_at_once_get_unique_ids(repo):
+    # moto is slow and not thread-safe, SQLite takes thousands per second
+    moto = isinstance(repo, DynamoDBRepository)
+    count, workers = (100, 1) if moto else (3000, 8)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        links = list(pool.map(lambda i: repo.put_link('john',
+            LinkInp(url=f'https://example.com/{i}')), range(count)))
+    created = [link.created for link in links]
+    assert len(set(created)) == count
+    assert [l.created for l in repo.get_links_by_user('john')] == sorted(created, reverse=True)
+
+def test_update_link_metadata(repo):
+    link = repo.put_link('john', LinkInp(url='https://example.com/a'))
+    updated = repo.update_link_metadata('john', link.created, title='Fetched',
+        icon='https://example.com/favicon.ico', canonical='https://example.com/')
+    assert (updated.title, updated.icon) == ('Fetched', 'https://example.com/favicon.ico')
+    again = repo.update_link_metadata('john', link.created, title='Other', icon=None)
+    assert (again.title, again.icon) == ('Fetched', None)
+    assert [l.created for l in repo.search_links('john', 'fetched')] == [link.created]
+    assert repo.update_link_metadata('john', '2000-01-01T00:00:00', title='x') is None
+
+def test_pages_follow_cursor(repo):
+    created = _import(repo, 7)
+    seen, cursor = [], None
+    while True:
+        links, cursor = repo.get_links_page('john', 3, cursor=cursor)
+        seen.extend(link.created for link in links)
+        if cursor is None:
+            break
+    assert seen == created[::-1]
+    pages = list(repo.iter_links_by_user('john', page_size=2, fields=('created',),
+        plain=True))
+    assert [l['created'] for page in pages for l in page] == created[::-1]
+    assert [l.created for l in repo.get_links_by_user('john', offset=created[3])] ==\
+        created[3::-1]
+    assert len(repo.get_links_by_user('john', limit=5)) == 5
+    _, cursor = repo.get_links_page('john', 3)
+    repo.check_link_cursor('john', cursor)
+    with pytest.raises(ValueError):
+        repo.check_link_cursor('alice', cursor)
+    with pytest.raises(ValueError):
+        repo.get_links_page('alice', 3, cursor=cursor)
+    links, _ = repo.get_links_page('john', 3, cursor=repo.link_cursor('john', created[5]))
+    assert [l.created for l in links] == created[4::-1][:3]
+
+def test_tags(repo):
+    created = _import(repo, 3)
+    repo.put_tag('john', created[0], 'new')
+    with pytest.raises(ValueError):
+        repo.put_tag('john', created[0], 'new')
+    with pytest.raises(ValueError):
+        repo.put_tag('john', '2000-01-01T00:00:00', 'new')
+    report = repo.put_tags('john', [(created[1], 'new'), (created[1], 'all'),
+        (created[1], 'new'), ('2000-01-01T00:00:00', 'x')])
+    assert report['added'] == 1
+    assert sorted(s['reason'] for s in report['skipped']) ==\
+        ['link does not exist', 'tag already exists']
+    assert repo.get_link_by_id('john', created[1]).tags == ['all', 'odd', 'new']
+    assert [l.created for l in repo.get_links_by_tag('john', 'new')] == created[:2]
+    repo.delete_tag('john', created[0], 'new')
+    repo.delete_tag('john', created[0], 'new') # nothing to delete
+    assert repo.get_link_by_id('john', created[0]).tags == ['all', 'even']
+    assert [l.created for l in repo.get_links_by_tag('john', 'new')] == [created[1]]
+    assert dict(repo.get_tag_catalog('john').top()) == {'all': 3, 'even': 2, 'odd': 1, 'new': 1}
+
+@pytest.mark.parametrize('expr, expected', [
+    ('even', lambda i: i % 2 == 0),
+    ('all AND NOT even', lambda i: i % 2),
+    ('NOT odd', lambda i: i % 2 == 0),
+    ('(even OR odd) AND NOT x3', lambda i: i % 3),
+    ('odd x3', lambda i: i % 2 and i % 3 == 0),
+    ('nope OR x3', lambda i: i % 3 == 0),
+])
+def test_links_by_tags(repo, expr, expected):
+    created = _import(repo, 12)
+    repo.put_tags('john', [(ts, 'x3') for ts in created[::3]])
+    seen, cursor = [], None
+    while True:
+        links, cursor = repo.get_links_by_tags('john', expr, limit=2, cursor=cursor)
+        seen.extend(link.created for link in links)
+        if cursor is None:
+            break
+    assert seen == [ts for i, ts in reversed(list(enumerate(created))) if expected(i)]
+    with pytest.raises(ValueError):
+        repo.get_links_by_tags('john', 'even AND')
+
+def test_search(repo):
+    repo.import_links('john', [
+        {'url': 'https://example.com/python-recipes', 'title': 'Cooking'},
+        {'url': 'https://python.org/b', 'title': 'Rust notes'},
+        {'url': 'https://blog.example.com/a', 'title': 'Python performance tips'},
+    ])
+    titles = lambda query: [l['title'] for l in
+        repo.search_links('john', query, fields=('created', 'title'), plain=True)]
+    assert titles('python') == ['Python performance tips', 'Rust notes', 'Cooking']
+    assert titles('pyth') == titles('python')
+    assert titles('python perf') == ['Python performance tips']
+    assert titles('python') == titles('PYTHON python')
+    assert titles('golang') == [] and titles('a') == []
+
+def test_import_report(repo):
+    repo.put_link('john', LinkInp(url='https://example.com/old'))
+    report = repo.import_links('john', [
+        {'url': 'https://example.com/old/', 'title': 'Old'},
+        {'url': 'https://example.com/new', 'tags': ['a', 'a']},
+        {'url': 'https://EXAMPLE.com/new'},
+        {'url': 'not a url'},
+    ])
+    assert {k: report[k] for k in ('read', 'imported', 'duplicates', 'invalid', 'failed')} ==\
+        {'read': 4, 'imported': 1, 'duplicates': 2, 'invalid': 1, 'failed': 0}
+    assert repo.get_link_by_url('john', 'https://example.com/new')[0].tags == ['a']
+
+def test_users_and_tokens(repo):
+    assert repo.get_user('john') is None and repo.get_token_version('john') is None
+    repo.put_user(UserInDB(username='John', hashpass='x', email='j@a.com'))
+    assert repo.get_user_cached('john') == UserInDB(username='John', hashpass='x',
+        email='j@a.com')
+    repo.update_hashpass('john', 'y')
+    repo.revoke_tokens('john')
+    user = repo.get_user('john')
+    assert (user.hashpass, user.token_version) == ('y', 1)
+    assert repo.get_token_version('john') == 1
+
+def test_delete_user_job(repo):
+    repo.put_user(UserInDB(username='john', hashpass='x'))
+    _import(repo, 5)
+    _import(repo, 2, 'alice')
+    job_id = repo.start_delete_user('john')
+    assert repo.get_user('john') is None
+    job = repo.get_delete_job(job_id)
+    assert (job['status'], job['stale']) == ('pending', True)
+    job = repo.run_delete_job(job_id)
+    assert (job['status'], job['stale']) == ('done', False) and job['deleted'] > 0
+    assert repo.run_delete_job(job_id) == job
+    assert repo.get_links_by_user('john') == []
+    assert len(repo.get_tag_catalog('john')) == 0
+    assert len(repo.get_links_by_user('alice')) == 2
+    assert repo.get_delete_job('nope') is None
+
+def test_username_is_taken_until_deletion_is_done(repo):
+    repo.put_user(UserInDB(username='john', hashpass='x'))
+    _import(repo, 3)
+    job_id = repo.start_delete_user('john')
+    with pytest.raises(ValueError, match='being deleted'):
+        repo.put_user(UserInDB(username='john', hashpass='y'))
+    assert repo.get_user('john') is None and repo.get_token_version('john') is None
+    assert repo.run_delete_job(job_id)['status'] == 'done'
+    repo.put_user(UserInDB(username='john', hashpass='y'))
+    _import(repo, 1)
+    assert repo.run_delete_job(job_id)['status'] == 'done'
+    assert repo.get_user('john').hashpass == 'y'
+    assert len(repo.get_links_by_user('john')) == 1
+
+"""
+    SQLITE
+"""
+
+@pytest.fixture
+def sqlite_app(tmp_path, lambda_environment):
+    repository = SQLiteRepository(str(tmp_path / 'links.db'))
+    set_repository(repository)
+    yield repository
+    set_repository(None)
+    repository.close()
+
+def test_api_on_sqlite(sqlite_app):
+    client = auth_client('john')
+    assert client.get('/user/me').json()['username'] == 'john'
+    resp = client.post('/add_link', json={'url': 'https://example.com', 'title': 'Example'})
+    created = resp.json()['Message']['created']
+    assert client.post('/add_tag', params={'link_timestamp': created,
+        'tagname': 'a'}).json() == {'Message': 'Tag added'}
+    assert [l['url'] for l in client.get('/get_my_links').json()] == ['https://example.com']
+    assert client.get('/get_links_by_tags', params={'q': 'a'}).json()[0]['created'] == created
+    assert client.get('/search', params={'q': 'exam'}).json()[0]['title'] == 'Example'
+    assert client.get('/tags').json() == [{'tag': 'a', 'count': 1}]
+    client.post('/add_link', json={'url': 'https://example.org'})
+    resp = client.get('/get_my_links', params={'limit': 1})
+    cursor = resp.headers['X-Next-Cursor']
+    resp = client.get('/get_my_links', params={'limit': 1, 'cursor': cursor})
+    assert [l['url'] for l in resp.json()] == ['https://example.com']
+    assert client.get('/export', params={'cursor': cursor}).status_code == 200
+    assert client.get('/get_my_links', params={'cursor': 'bad'}).status_code == 400
+
+def test_sqlite_concurrent_writes(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / 'links.db'), pool_size=2)
+    created = _import(repository, 8)
+    errors = []
+    def tag(ts: str):
+        try:
+            for i in range(20):
+                repository.put_tag('john', ts, f't{i}')
+                repository.get_tag_catalog('john')
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=tag, args=(ts,)) for ts in created]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    counts = dict(repository.get_tag_catalog('john').top())
+    assert all(counts[f't{i}'] == 8 for i in range(20))
+    repository.close()
+
+def test_sqlite_failed_import_is_not_counted_as_imported(tmp_path, monkeypatch):
+    repository = SQLiteRepository(str(tmp_path / 'links.db'))
+    index_link, calls = repository._index_link, []
+    def fail_second(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise sqlite3.OperationalError('disk I/O error')
+        index_link(*args)
+    monkeypatch.setattr(repository, '_index_link', fail_second)
+    report = repository.import_links('john', [
+        {'url': f'https://example.com/{i}'} for i in range(3)])
+    # the transaction is rolled back, the first link isn't imported either
+    assert (report['imported'], report['failed']) == (0, 3)
+    assert repository.get_links_by_user('john') == []
+    repository.close()
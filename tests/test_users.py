@@ -1,3 +1,129 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
-from app.main import app
\ No newline at end of file
+from app.main import app
+
+from app import db, main
+from app.models.user_mod import UserInDB
+from .database import data_table, lambda_environment, put_links
+from .client import (
+    jwt_keys, auth_client, lambda_invocations, api_event, LambdaContext,
+)
+
+def _partition(username: str) -> list:
+    resp = db._get_table().query(
+        KeyConditionExpression='PK = :pk',
+        ExpressionAttributeValues={':pk': f'USER#{username}'})
+    return resp['Items']
+
+def test_delete_me_runs_in_background(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'DELETE_PAGE_SIZE', 7)
+    created = put_links('john', 30)
+    db.db_put_tags('john', [(ts, 'x') for ts in created])
+    put_links('alice', 2)
+    client = auth_client('john')
+    resp = client.request('DELETE', '/user/delete_me', json={'deletion_confirm': 'delete'})
+    job_id = resp.json()['job_id']
+    assert _partition('john') == []
+    assert len(_partition('alice')) == 2
+    job = client.get(f'/user/delete_status/{job_id}').json()
+    # 30 links, 30 tag refs and the tag catalog
+    assert job['status'] == 'done' and job['deleted'] == 61
+    assert client.get('/user/me').status_code == 401
+    assert client.get('/user/delete_status/nope').status_code == 404
+    # only the owner sees the job
+    assert auth_client('alice').get(f'/user/delete_status/{job_id}').status_code == 404
+    assert TestClient(app).get(f'/user/delete_status/{job_id}').status_code == 401
+
+def test_delete_me_on_lambda_runs_in_own_invocations(data_table, lambda_invocations,
+    monkeypatch):
+    monkeypatch.setattr(db, 'DELETE_PAGE_SIZE', 5)
+    put_links('john', 12)
+    auth_client('john')
+    resp = main.handler(api_event('DELETE', '/user/delete_me', 'john',
+        {'deletion_confirm': 'delete'}), LambdaContext())
+    job_id = json.loads(resp['body'])['job_id']
+    # the response doesn't wait for the deletion, 12 links and the tombstone
+    assert len(_partition('john')) == 13
+    event = {'job': 'delete_user', 'args': {'job_id': job_id}}
+    assert lambda_invocations == [event]
+    # with no time left, one page is deleted and the job invokes itself again
+    assert main.handler(event, LambdaContext(remaining_ms=5000))['status'] == 'continue'
+    assert len(_partition('john')) == 8 and lambda_invocations == [event, event]
+    assert main.handler(event, LambdaContext())['status'] == 'done'
+    assert _partition('john') == [] and len(lambda_invocations) == 2
+
+def test_delete_job_resumes_after_deadline(data_table, monkeypatch):
+    monkeypatch.setattr(db, 'DELETE_PAGE_SIZE', 5)
+    put_links('john', 12)
+    job_id = db.db_start_delete_user('john')
+    job = db.db_run_delete_job(job_id, deadline=0)
+    assert job['status'] == 'pending' and job['deleted'] == 5
+    assert job['stale']
+    assert len(_partition('john')) == 8
+    job = db.db_run_delete_job(job_id)
+    assert job['status'] == 'done' and job['deleted'] == 12
+    assert _partition('john') == []
+
+def test_register_again_during_pending_deletion(data_table, monkeypatch):
+    from app.utils import crypto
+    monkeypatch.setattr(crypto, 'BCRYPT_ROUNDS', 4)
+    put_links('john', 3)
+    client = TestClient(app)
+    register = {'username': 'john', 'password': 'qwerty', 'password_confirm': 'qwerty'}
+    assert client.post('/user/register', json=register).json()['success']
+    job_id = db.db_start_delete_user('john')
+    resp = client.post('/user/register', json=register)
+    assert resp.status_code == 409 and 'being deleted' in resp.json()['detail']['msg']
+    form = {'username': 'john', 'password': 'qwerty'}
+    assert client.post('/auth/access', data=form).status_code == 401
+    assert db.db_run_delete_job(job_id)['status'] == 'done'
+    # the tombstone goes last, then the name is free again
+    assert _partition('john') == []
+    assert client.post('/user/register', json=register).json()['success']
+    assert client.post('/auth/access', data=form).status_code == 200
+    put_links('john', 1)
+    assert db.db_run_delete_job(job_id)['status'] == 'done'
+    assert len(_partition('john')) == 2
+
+def test_legacy_delete_job_keeps_new_account(data_table):
+    put_links('john', 2)
+    job_id = db.db_start_delete_user('john')
+    # a job started before tombstones: the user entity was deleted at once
+    db._get_table().delete_item(Key={'PK': 'USER#john', 'SK': 'USER#john'})
+    db.db_put_user(UserInDB(username='john', hashpass='x'))
+    assert db.db_run_delete_job(job_id)['status'] == 'done'
+    assert db.db_get_user('john') is not None and len(_partition('john')) == 3
+
+def test_current_user_is_cached(data_table):
+    client = auth_client('john')
+    for _ in range(3):
+        assert client.get('/user/me').json()['username'] == 'john'
+    stats = db.user_cache_stats()['user']
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    db.db_put_user(db.db_get_user('john').copy(update={'email': 'j@a.com'}))
+    assert client.get('/user/me').json()['email'] == 'j@a.com'
+
+@pytest.mark.parametrize('stateless', [False, True])
+def test_revoked_tokens_are_rejected(data_table, monkeypatch, stateless):
+    from app.api import users
+    monkeypatch.setattr(users, 'AUTH_STATELESS', stateless)
+    client = auth_client('john')
+    assert client.get('/user/me').status_code == 200
+    assert client.post('/user/revoke_tokens').status_code == 200
+    assert client.get('/user/me').status_code == 401
+
+def test_register_and_login_rehash(data_table, monkeypatch):
+    from app.utils import crypto
+    monkeypatch.setattr(crypto, 'BCRYPT_ROUNDS', 4)
+    client = TestClient(app)
+    resp = client.post('/user/register', json={
+        'username': 'john', 'password': 'qwerty', 'password_confirm': 'qwerty'})
+    assert resp.json()['success']
+    assert db.db_get_user('john').hashpass.startswith('$2b$04$')
+    monkeypatch.setattr(crypto, 'BCRYPT_ROUNDS', 5)
+    form = {'username': 'john', 'password': 'qwerty'}
+    assert client.post('/auth/access', data=form).status_code == 200
+    assert db.db_get_user('john').hashpass.startswith('$2b$05$')
+    assert client.post('/auth/access', data=dict(form, password='nope')).status_code == 401
+    assert crypto.hash_pool_stats()['queued'] == 0